@@ -2,6 +2,7 @@
 # SPDX-FileType: SOURCE
 # SPDX-License-Identifier: Apache-2.0
 
+import glob
 import json
 import os
 from pathlib import Path
@@ -10,11 +11,23 @@ from datetime import date
 
 import yaml
 
-from datatypes import Config, Finding, JiraSecret, MatchText, Priority, Project, ProjectRepoType, Secrets, SLMCategoryConfig, SLMLicenseConfig, SLMPolicy, Status, Subproject, TicketType, WSSecret
+from journal import StatusJournal, readJournal
+from locking import ConfigWriteLock
+from statedb import StateDB, getFileMtime, projectStateFromDict
+from datatypes import Config, Finding, JiraSecret, MatchText, Priority, Project, ProjectRepoType, Secrets, SLMCategoryConfig, SLMLicenseConfig, SLMPolicy, Status, Subproject, TicketType, WSSecret, ZipCompressionPolicy
 
 def getConfigFilename(scaffoldHome, month):
     return os.path.join(scaffoldHome, month, "config.json")
 
+def getJournalFilename(scaffoldHome, month, prj_name):
+    return os.path.join(scaffoldHome, month, f"config-{prj_name}.journal")
+
+def getJournalFilenames(scaffoldHome, month):
+    return sorted(glob.glob(getJournalFilename(scaffoldHome, month, "*")))
+
+def getStateDBFilename(scaffoldHome, month):
+    return os.path.join(scaffoldHome, month, "state.db")
+
 def getMatchesProjectFilename(scaffoldHome, month, prj_name):
     return os.path.join(scaffoldHome, month, f"matches-{prj_name}.json")
 
@@ -181,7 +194,11 @@ def loadSecrets(secrets_file_name = ".scaffold-secrets.json"):
         print(f'Error loading or parsing {secretsFile}: {str(e)}')
         return None
 
-def loadConfig(configFilename, scaffoldHome, secrets_file_name = '.scaffold-secrets.json'):
+# Loads the config. If stateOnly is True (for commands that only read
+# state, like status) and the state database is in use, only prj_only's
+# project is loaded (none, if prj_only is ""); the command queries
+# cfg._statedb for the others.
+def loadConfig(configFilename, scaffoldHome, secrets_file_name = '.scaffold-secrets.json', stateOnly=False, prj_only=""):
     cfg = Config()
 
     try:
@@ -203,6 +220,28 @@ def loadConfig(configFilename, scaffoldHome, secrets_file_name = '.scaffold-secr
             if cfg._version == -1:
                 print(f'No valid version found in config section')
                 raise RuntimeError(f'No valid version found in config section')
+
+            # apply any state changes that were journaled but not yet
+            # saved back to config.json, e.g. if the last run crashed
+            for journalFilename in getJournalFilenames(scaffoldHome, cfg._month):
+                replayJournal(js, journalFilename, cfg._version)
+
+            # if using the state database, it has the latest state, after
+            # importing any projects changed in config.json since they were
+            # last exported
+            cfg._state_backend = config_dict.get('stateBackend', "json")
+            if cfg._state_backend == "sqlite":
+                cfg._statedb = StateDB(getStateDBFilename(scaffoldHome, cfg._month))
+                mtime = getFileMtime(configFilename)
+                if cfg._statedb.getMeta("config-mtime") != mtime:
+                    cfg._statedb.importConfig(js, mtime)
+                if not stateOnly:
+                    cfg._statedb.overlayConfig(js)
+                elif prj_only != "":
+                    cfg._statedb.overlayConfig(js, prj_only)
+            elif cfg._state_backend != "json":
+                print(f'Invalid stateBackend {cfg._state_backend} found in config section')
+                raise RuntimeError(f'Invalid stateBackend {cfg._state_backend} found in config section')
             cfg._storepath = config_dict.get('storepath', "")
             if cfg._storepath == "":
                 print(f'No valid storepath found in config section')
@@ -213,6 +252,17 @@ def loadConfig(configFilename, scaffoldHome, secrets_file_name = '.scaffold-secr
             cfg._cdsbom_exec_path = config_dict.get('cdsbomExecPath', os.environ['CDSBOM_EXEC_PATH'] if 'CDSBOM_EXEC_PATH' in os.environ else "")
             cfg._tools_java_path = config_dict.get('toolsJavaPath', os.environ['TOOLS_JAVA_PATH'] if 'TOOLS_JAVA_PATH' in os.environ else "")
             cfg._zippath = config_dict.get('zippath', cfg._storepath)
+            cfg._git_cache = config_dict.get('gitCache', True)
+            cfg._reuse_unchanged = config_dict.get('reuseUnchanged', False)
+            cfg._clone_jobs = config_dict.get('cloneJobs', 4)
+            cfg._clone_jobs_per_host = config_dict.get('cloneJobsPerHost', {})
+            cfg._stream_archives = config_dict.get('streamArchives', False)
+            cfg._zip_jobs = config_dict.get('zipJobs', 0)
+            cfg._batch_agents = config_dict.get('batchAgents', False)
+            cfg._batch_reports = config_dict.get('batchReports', True)
+            zip_compression_dict = config_dict.get('zipCompression', {})
+            cfg._zip_compression._levels.update(zip_compression_dict.get('levels', {}))
+            cfg._zip_compression._compressed_extensions = zip_compression_dict.get('compressedExtensions', [])
             cfg._spdx_github_org = config_dict.get('spdxGithubOrg', "")
             if cfg._spdx_github_org == "":
                 print(f'No valid spdxGithubOrg found in config section')
@@ -289,11 +339,14 @@ def loadConfig(configFilename, scaffoldHome, secrets_file_name = '.scaffold-secr
                 raise RuntimeError(f'No projects found in config file')
 
             for prj_name, prj_dict in projects_dict.items():
+                if stateOnly and cfg._statedb is not None and prj_name != prj_only:
+                    continue
                 #TODO: Refactor this function - cognative and cyclomatic complexity is high
                 prj = Project()
                 prj._name = prj_name
                 prj._ok = True
                 prj._reports_private = prj_dict.get('reports-private', False)
+                prj._journal_seq = prj_dict.get('journal-seq', 0)
                 if not prj_name in cfg._secrets._gitoauth:
                 # Update the secrets for any missing project data
                     cfg._secrets._gitoauth[prj_name] = cfg._secrets._default_oauth
@@ -371,11 +424,16 @@ def loadConfig(configFilename, scaffoldHome, secrets_file_name = '.scaffold-secr
                                 sp._code_path = ""
                                 sp._code_anyfiles = False
                                 sp._code_repos = {}
+                                sp._code_sha256 = ""
+                                sp._code_manifest_sha256 = ""
                             else:
                                 sp._code_pulled = code_dict.get('pulled', "")
                                 sp._code_path = code_dict.get('path', "")
                                 sp._code_anyfiles = code_dict.get('anyfiles', "")
                                 sp._code_repos = code_dict.get('repos', {})
+                                sp._code_sha256 = code_dict.get('sha256', "")
+                                sp._code_manifest_sha256 = code_dict.get('manifest-sha256', "")
+                                sp._code_reused_from = code_dict.get('reused-from', "")
 
                             # get web data
                             web_dict = sp_dict.get('web', {})
@@ -473,11 +531,16 @@ def loadConfig(configFilename, scaffoldHome, secrets_file_name = '.scaffold-secr
                                 sp._code_path = ""
                                 sp._code_anyfiles = False
                                 sp._code_repos = {}
+                                sp._code_sha256 = ""
+                                sp._code_manifest_sha256 = ""
                             else:
                                 sp._code_pulled = code_dict.get('pulled', "")
                                 sp._code_path = code_dict.get('path', "")
                                 sp._code_anyfiles = code_dict.get('anyfiles', "")
                                 sp._code_repos = code_dict.get('repos', {})
+                                sp._code_sha256 = code_dict.get('sha256', "")
+                                sp._code_manifest_sha256 = code_dict.get('manifest-sha256', "")
+                                sp._code_reused_from = code_dict.get('reused-from', "")
 
                             # get web data
                             web_dict = sp_dict.get('web', {})
@@ -565,11 +628,16 @@ def loadConfig(configFilename, scaffoldHome, secrets_file_name = '.scaffold-secr
                                 sp._code_path = ""
                                 sp._code_anyfiles = False
                                 sp._code_repos = {}
+                                sp._code_sha256 = ""
+                                sp._code_manifest_sha256 = ""
                             else:
                                 sp._code_pulled = code_dict.get('pulled', "")
                                 sp._code_path = code_dict.get('path', "")
                                 sp._code_anyfiles = code_dict.get('anyfiles', "")
                                 sp._code_repos = code_dict.get('repos', {})
+                                sp._code_sha256 = code_dict.get('sha256', "")
+                                sp._code_manifest_sha256 = code_dict.get('manifest-sha256', "")
+                                sp._code_reused_from = code_dict.get('reused-from', "")
 
                             # get web data
                             web_dict = sp_dict.get('web', {})
@@ -770,7 +838,7 @@ def parseSubprojectWSConfig(sp_dict, prj, sp):
 class ConfigJSONEncoder(json.JSONEncoder):
     def default(self, o): # pylint: disable=method-hidden
         if isinstance(o, Config):
-            return {
+            retval = {
                 "config": {
                     "storepath": o._storepath,
                     "zippath": o._zippath,
@@ -789,6 +857,31 @@ class ConfigJSONEncoder(json.JSONEncoder):
                 },
                 "projects": o._projects,
             }
+            if o._state_backend != "json":
+                retval["config"]["stateBackend"] = o._state_backend
+            if not o._git_cache:
+                retval["config"]["gitCache"] = False
+            if o._reuse_unchanged:
+                retval["config"]["reuseUnchanged"] = True
+            if o._clone_jobs != 4:
+                retval["config"]["cloneJobs"] = o._clone_jobs
+            if o._clone_jobs_per_host != {}:
+                retval["config"]["cloneJobsPerHost"] = o._clone_jobs_per_host
+            if o._stream_archives:
+                retval["config"]["streamArchives"] = True
+            if o._zip_jobs != 0:
+                retval["config"]["zipJobs"] = o._zip_jobs
+            if o._batch_agents:
+                retval["config"]["batchAgents"] = True
+            if not o._batch_reports:
+                retval["config"]["batchReports"] = False
+            default_zip_compression = ZipCompressionPolicy()
+            if o._zip_compression._levels != default_zip_compression._levels or o._zip_compression._compressed_extensions != []:
+                retval["config"]["zipCompression"] = {
+                    "levels": o._zip_compression._levels,
+                    "compressedExtensions": o._zip_compression._compressed_extensions,
+                }
+            return retval
 
         elif isinstance(o, Project):
             retval = {}
@@ -799,6 +892,9 @@ class ConfigJSONEncoder(json.JSONEncoder):
             if o._reports_private:
                 retval["reports-private"] = True
 
+            if o._journal_seq != 0:
+                retval["journal-seq"] = o._journal_seq
+
             # build ticket data, if any
             if o._ticket_type == TicketType.JIRA:
                 retval["ticket-type"] = "jira"
@@ -911,6 +1007,12 @@ class ConfigJSONEncoder(json.JSONEncoder):
                     js["code"]["path"] = o._code_path
                 if o._code_repos != {}:
                     js["code"]["repos"] = o._code_repos
+                if o._code_sha256 != "":
+                    js["code"]["sha256"] = o._code_sha256
+                if o._code_manifest_sha256 != "":
+                    js["code"]["manifest-sha256"] = o._code_manifest_sha256
+                if o._code_reused_from != "":
+                    js["code"]["reused-from"] = o._code_reused_from
                 if o._web_html_url != "":
                     js["web"]["htmlurl"] = o._web_html_url
                 if o._web_sbom_url != "":
@@ -955,6 +1057,12 @@ class ConfigJSONEncoder(json.JSONEncoder):
                     js["code"]["path"] = o._code_path
                 if o._code_repos != {}:
                     js["code"]["repos"] = o._code_repos
+                if o._code_sha256 != "":
+                    js["code"]["sha256"] = o._code_sha256
+                if o._code_manifest_sha256 != "":
+                    js["code"]["manifest-sha256"] = o._code_manifest_sha256
+                if o._code_reused_from != "":
+                    js["code"]["reused-from"] = o._code_reused_from
                 if o._web_html_url != "":
                     js["web"]["htmlurl"] = o._web_html_url
                 if o._web_sbom_url != "":
@@ -999,6 +1107,12 @@ class ConfigJSONEncoder(json.JSONEncoder):
                     js["code"]["path"] = o._code_path
                 if o._code_repos != {}:
                     js["code"]["repos"] = o._code_repos
+                if o._code_sha256 != "":
+                    js["code"]["sha256"] = o._code_sha256
+                if o._code_manifest_sha256 != "":
+                    js["code"]["manifest-sha256"] = o._code_manifest_sha256
+                if o._code_reused_from != "":
+                    js["code"]["reused-from"] = o._code_reused_from
                 if o._web_html_url != "":
                     js["web"]["htmlurl"] = o._web_html_url
                 if o._web_sbom_url != "":
@@ -1044,32 +1158,171 @@ class ConfigJSONEncoder(json.JSONEncoder):
         else:
             return {'__{}__'.format(o.__class__.__name__): o.__dict__}
 
+# Applies the records from the journal, if any, to the parsed JSON from
+# config.json before it is loaded. Each record holds the full state of a
+# subproject and/or project, so replaying a record twice does no harm.
+# Records from before the project was last saved to config.json (i.e.
+# whose journal-seq is older than the project's) are ignored. This is per
+# project, rather than by the config's version, because saving another
+# project (e.g. in another operator's run) raises the version without
+# saving this project's journaled state.
+def replayJournal(js, journalFilename, version):
+    projects = js.get('projects', {})
+    for record in readJournal(journalFilename):
+        prj_dict = projects.get(record.get('project', ""), None)
+        if prj_dict is None:
+            continue
+        if 'journal-seq' in record:
+            if record['journal-seq'] < prj_dict.get('journal-seq', 0):
+                continue
+        elif record.get('version', -1) < version:
+            # written before records had a journal-seq
+            continue
+        prj_state = record.get('project-state', None)
+        if prj_state is not None:
+            prj_dict.update(prj_state)
+        sp_name = record.get('subproject', None)
+        sp_state = record.get('subproject-state', None)
+        if sp_name is not None and sp_state is not None:
+            prj_dict.setdefault('subprojects', {})[sp_name] = sp_state
+
+# Records the current state of this project (and subproject, if given),
+# instead of rewriting all of config.json: either as a row in the month's
+# state database, or else appended to the month's journal. If no subproject
+# is given, the whole project is recorded, including all of its
+# subprojects, since project-level steps can add or remove subprojects.
+def saveState(scaffoldHome, cfg, prj, sp=None):
+    encoder = ConfigJSONEncoder()
+    prj_state = encoder.default(prj)
+    subprojects = prj_state.pop("subprojects", {})
+    record = {
+        "journal-seq": prj._journal_seq,
+        "project": prj._name,
+    }
+    if sp is not None:
+        # the project's SLM policies and other subprojects don't change
+        # during a subproject's step
+        prj_state.pop("slm", None)
+        record["subproject"] = sp._name
+        record["subproject-state"] = sp
+    else:
+        prj_state["subprojects"] = subprojects
+    record["project-state"] = prj_state
+
+    if cfg._statedb is not None:
+        record = json.loads(json.dumps(record, cls=ConfigJSONEncoder))
+        prj_state = record["project-state"]
+        cfg._statedb.saveState(prj._name, projectStateFromDict(prj_state),
+            record.get("subproject", None), record.get("subproject-state", None),
+            prj_state.get("subprojects", None))
+        return
+
+    # each project has its own journal, so that runs of different projects
+    # (holding different project locks) never write to the same file
+    journal = cfg._journals.get(prj._name, None)
+    if journal is None:
+        journal = StatusJournal(getJournalFilename(scaffoldHome, cfg._month, prj._name))
+        cfg._journals[prj._name] = journal
+    journal.append(record, cls=ConfigJSONEncoder)
+
 def saveBackupConfig(scaffoldHome, cfg):
     configFilename = getConfigFilename(scaffoldHome, cfg._month)
 
-    # if existing file is present, copy to backup
+    # if existing file is present, copy to backup. runs of other projects
+    # (under their own project locks) may be backing up or saving the same
+    # config.json, so choose the version and copy while holding the write
+    # lock, starting from the newest version that any of them has saved,
+    # and never overwrite an existing backup
     if os.path.isfile(configFilename):
-        backupDir = os.path.join(scaffoldHome, cfg._month, "backup")
-        backupFilename = os.path.join(backupDir, f"config-{cfg._version}.json")
-
-        if not os.path.exists(backupDir):
-            os.makedirs(backupDir)
-        copyfile(configFilename, backupFilename)
+        with ConfigWriteLock(os.path.dirname(configFilename)):
+            with open(configFilename, 'r') as f:
+                saved_version = json.load(f).get("config", {}).get("version", -1)
+            cfg._version = max(cfg._version, saved_version)
+            backupDir = os.path.join(scaffoldHome, cfg._month, "backup")
+            while os.path.exists(os.path.join(backupDir, f"config-{cfg._version}.json")):
+                cfg._version += 1
+            backupFilename = os.path.join(backupDir, f"config-{cfg._version}.json")
+
+            if not os.path.exists(backupDir):
+                os.makedirs(backupDir)
+            copyfile(configFilename, backupFilename)
 
     # now, increment the config version
     cfg._version += 1
 
     # don't save it back to disk yet -- we'll do that later (repeatedly)
 
-def saveConfig(scaffoldHome, cfg):
+# Saves the config to config.json. If prj_only is given, only that
+# project's state is saved: it is merged into the current config.json on
+# disk, leaving other projects (which may be running in other scaffold
+# processes, under their own project locks) as they are on disk.
+def saveConfig(scaffoldHome, cfg, prj_only=""):
     configFilename = getConfigFilename(scaffoldHome, cfg._month)
 
     # don't increment the config version -- we should have done that
     # by saving a backup
 
-    # save the config file out as json
-    with open(configFilename, "w") as f:
-        json.dump(cfg, f, indent=4, cls=ConfigJSONEncoder)
+    # serialize before opening the file, so that a failure can't leave a
+    # truncated config.json behind. this holds the state lock, like
+    # recording a stage's result does, and is only called once no stages
+    # are running, so nothing changes while we walk it. the saved projects'
+    # journal-seq is bumped first, so that their journal records from
+    # before now are never replayed over what this saves
+    with cfg._state_lock:
+        for prj_name in ([prj_only] if prj_only != "" else cfg._projects):
+            prj = cfg._projects.get(prj_name, None)
+            if prj is not None:
+                prj._journal_seq += 1
+        js = json.dumps(cfg, indent=4, cls=ConfigJSONEncoder)
+
+    if prj_only == "":
+        writeConfigFile(configFilename, js)
+        compacted = list(cfg._journals.keys())
+        journalFilenames = getJournalFilenames(scaffoldHome, cfg._month)
+    else:
+        with ConfigWriteLock(os.path.dirname(configFilename)):
+            js = mergeProjectConfig(configFilename, json.loads(js), prj_only)
+            writeConfigFile(configFilename, js)
+        compacted = [prj_only]
+        journalFilenames = [getJournalFilename(scaffoldHome, cfg._month, prj_only)]
+
+    # config.json now has everything that was journaled, so start over
+    for prj_name in compacted:
+        journal = cfg._journals.pop(prj_name, None)
+        if journal is not None:
+            journal.close()
+    for journalFilename in journalFilenames:
+        if os.path.isfile(journalFilename):
+            os.remove(journalFilename)
+
+    # and remember which projects' rows config.json now matches. after
+    # merging in just one project, other projects in config.json may have
+    # been changed since they were imported, so leave config-mtime alone
+    # and let the next load check them
+    if cfg._statedb is not None:
+        cfg._statedb.markExported(json.loads(js), [prj_only] if prj_only != "" else list(cfg._projects))
+        if prj_only == "":
+            cfg._statedb.setMeta("config-mtime", getFileMtime(configFilename))
+
+# save the config file out as json, replacing the old one in one step
+def writeConfigFile(configFilename, js):
+    tmpFilename = f"{configFilename}.tmp"
+    with open(tmpFilename, "w") as f:
+        f.write(js)
+    os.replace(tmpFilename, configFilename)
+
+# Returns the JSON text for config.json on disk, with the project prj_name
+# replaced by the one from ours (the parsed JSON for our config). The
+# version is the greater of the two, so it never goes backwards.
+def mergeProjectConfig(configFilename, ours, prj_name):
+    with open(configFilename, 'r') as f:
+        theirs = json.load(f)
+    if prj_name in ours.get("projects", {}):
+        theirs.setdefault("projects", {})[prj_name] = ours["projects"][prj_name]
+    theirs_version = theirs.get("config", {}).get("version", -1)
+    ours_version = ours.get("config", {}).get("version", -1)
+    theirs.setdefault("config", {})["version"] = max(theirs_version, ours_version)
+    return json.dumps(theirs, indent=4)
 
 def updateProjectStatusToSubprojectMin(cfg, prj):
     minStatus = Status.MAX
@@ -1089,10 +1342,15 @@ def isInThisCycle(cfg, prj, sp):
         cycle = prj._cycle
     if sp is not None and sp._cycle != 99:
         cycle = sp._cycle
+    return isCycleInMonth(cycle, cfg._month)
+
+# Returns True if a project or subproject with the given cycle (99 if none
+# is set) is due in month ("YYYY-MM").
+def isCycleInMonth(cycle, month):
     if cycle == 0 or cycle == 99:
         return True
 
-    mth = cfg._month[5:7]
+    mth = month[5:7]
     if cycle == 1 and mth in ['01', '04', '07', '10']:
         return True
     if cycle == 2 and mth in ['02', '05', '08', '11']:
@@ -3,7 +3,9 @@
 # SPDX-License-Identifier: Apache-2.0
 
 from enum import Enum
+import threading
 from datetime import date
+from types import MappingProxyType
 
 class ProjectRepoType(Enum):
     UNKNOWN = 0
@@ -164,13 +166,20 @@ class SLMCategoryConfig:
         self._license_configs = []
 
 
+# Findings for an SLMFile that has none, shared by all of them; read-only, so
+# to add findings, give the file its own dict instead
+NO_FINDINGS = MappingProxyType({})
+
+# There is one SLMFile for each file in a report (millions, for some combined
+# reports), so it uses __slots__ to keep each one small.
 class SLMFile:
+    __slots__ = ("_path", "_findings")
 
     def __init__(self):
         super(SLMFile, self).__init__()
 
         self._path = ""
-        self._findings = {}
+        self._findings = NO_FINDINGS
 
 
 class SLMLicense:
@@ -204,6 +213,20 @@ class SLMPolicy:
         self._flag_categories = []
 
 
+class ZipCompressionPolicy:
+
+    def __init__(self):
+        super(ZipCompressionPolicy, self).__init__()
+
+        # deflate level (0-9, with 0 meaning store uncompressed) for each
+        # category of file: "compressed" (already-compressed formats, found
+        # by extension or magic bytes), "text" and "binary"
+        self._levels = {"compressed": 0, "text": 6, "binary": 6}
+        # extensions to treat as already compressed, on top of the ones
+        # that parallelzip knows about
+        self._compressed_extensions = []
+
+
 class Project:
 
     def __init__(self):
@@ -215,6 +238,11 @@ class Project:
         self._status = Status.UNKNOWN
         self._reports_private = False
 
+        # bumped each time the project is saved to config.json, so that
+        # replaying its journal can tell which records config.json already
+        # has
+        self._journal_seq = 0
+
         self._subprojects = {}
 
         self._matches = []
@@ -295,6 +323,15 @@ class Subproject:
         self._code_anyfiles = False
         # mapping of repo name to pulled commit hash
         self._code_repos = {}
+        # SHA-256 of the zip file, and of its manifest (the path, size and
+        # SHA-256 of each file in it), so that subprojects whose code is the
+        # same as last month's can be told apart with a hash comparison
+        self._code_sha256 = ""
+        self._code_manifest_sha256 = ""
+        # month whose code and scan results were reused (see reuse.py),
+        # skipping the WhiteSource upload and the Fossology upload, scanning
+        # and clearing, or "" if they weren't
+        self._code_reused_from = ""
 
         # only if GitHub
         self._github_org = ""
@@ -334,6 +371,9 @@ class Subproject:
         self._code_path = ""
         self._code_anyfiles = False
         self._code_repos = {}
+        self._code_sha256 = ""
+        self._code_manifest_sha256 = ""
+        self._code_reused_from = ""
 
         # reset scan-dependent SLM vars
         self._slm_report_xlsx = ""
@@ -418,6 +458,28 @@ class Config:
         self._ok = False
         self._storepath = ""
         self._zippath = ""
+        # whether to keep bare mirrors of repos under _zippath between months
+        self._git_cache = True
+        # whether to reuse last month's results for subprojects whose repos
+        # haven't changed
+        self._reuse_unchanged = False
+        # how many repos to clone at once from any one host, and overrides
+        # of that for particular hosts
+        self._clone_jobs = 4
+        self._clone_jobs_per_host = {}
+        # whether zipcode streams code straight out of the git cache,
+        # rather than getcode checking it out to disk
+        self._stream_archives = False
+        # how many threads to compress zip files with; 0 for one per CPU
+        self._zip_jobs = 0
+        # ZipCompressionPolicy for the code zip files
+        self._zip_compression = ZipCompressionPolicy()
+        # whether the sequential runner schedules agents for all of a
+        # project's uploaded subprojects at once
+        self._batch_agents = False
+        # whether the sequential runner requests SPDX reports for all of a
+        # project's cleared subprojects at once
+        self._batch_reports = True
         self._trivy_exec_path = ""
         self._parlay_exec_path = ""
         self._npm_exec_path = ""
@@ -436,6 +498,9 @@ class Config:
         self._ws_server_url = ""
         self._ws_unified_agent_jar_path = ""
         self._ws_default_env = {}
+        # where run keeps subproject state between saves: "json" (journal +
+        # config.json) or "sqlite" (state.db)
+        self._state_backend = "json"
         self._fossology_job_spec = {
                 "analysis": {
                     "bucket": False,
@@ -459,6 +524,15 @@ class Config:
         # DO NOT OUTPUT THESE TO CONFIG.JSON
         self._secrets = None
         self._secrets_file = None
+        # mapping of project name to its StatusJournal for this month,
+        # opened on first use
+        self._journals = {}
+        # StateDB for this month, if _state_backend is "sqlite"
+        self._statedb = None
+        # held while recording a finished stage's result (updating its
+        # project and saving the state) and while serializing the config,
+        # so that saving never walks state that is being changed
+        self._state_lock = threading.RLock()
 
     def __repr__(self):
         is_ok = "OK"
@@ -11,6 +11,7 @@ from jinja2 import Template
 from datatypes import Instance, Priority, Status, InstanceSet
 from datefuncs import getYMStr, parseYM, priorMonth
 from instancesfile import loadInstances, saveInstances
+from slmpolicy import getCompiledPolicy
 
 # Helper for calculating findings instances and review categories
 # Call with spName == "COMBINED" for combined report (should only
@@ -26,6 +27,7 @@ def analyzeFindingsInstances(cfg, prj, spName, slmJsonFilename):
     if policy is None:
         print(f'{prj._name}/{spName}: Unable to get policy for findings; skipping analysis')
         return None
+    compiled = getCompiledPolicy(policy)
 
     # confirm whether this project has any findings templates
     if prj._findings == []:
@@ -122,7 +124,7 @@ def analyzeFindingsInstances(cfg, prj, spName, slmJsonFilename):
     # the review list
     for catName, licName, fileName in catLicFiles:
         found = False
-        if catName in policy._flag_categories:
+        if compiled.isFlagCategory(catName):
             # check if this file is in any instance
             for inst in instances:
                 if fileName in inst._files:
@@ -0,0 +1,154 @@
+# SPDX-FileCopyrightText: Copyright The Linux Foundation
+# SPDX-FileType: SOURCE
+# SPDX-License-Identifier: Apache-2.0
+
+import threading
+import weakref
+
+# An in-memory index of a Fossology server's folders and uploads, so that
+# looking up a folder by name, or an upload by the start of its name, is a
+# dictionary lookup rather than a REST call that lists (and then scans)
+# everything. The folders are listed with one call, and the uploads with
+# one call for all folders, the first time each is needed. Folders created
+# and uploads added through the index are added to it, so it stays current
+# for the rest of the run without listing everything again.
+class FossologyIndex:
+
+    def __init__(self, fossologyServer):
+        super(FossologyIndex, self).__init__()
+
+        self._server = fossologyServer
+        self._lock = threading.RLock()
+        # folder name => first folder with that name, or None if not yet
+        # listed
+        self._folders = None
+        # folder ID => parent folder ID
+        self._parents = {}
+        # (parent folder ID, folder name) => folder
+        self._children = {}
+        # folder ID => list of uploads directly in that folder, or None if
+        # not yet listed
+        self._uploads = None
+        # (folder ID, name fragment (lower case)) => upload or None
+        self._matches = {}
+
+    # Returns the first folder named exactly name, or None if there isn't
+    # one.
+    def getFolder(self, name):
+        with self._lock:
+            self._loadFolders()
+            return self._folders.get(name, None)
+
+    # Returns the first upload in folder (or one of its subfolders) whose
+    # name starts with uploadNameFragment, or None if there isn't one.
+    def getUpload(self, folder, uploadNameFragment):
+        key = (folder.id, uploadNameFragment.lower())
+        with self._lock:
+            if key in self._matches:
+                return self._matches[key]
+            self._loadFolders()
+            self._loadUploads()
+            match = None
+            for folderId in self._getFolderTree(folder.id):
+                for upload in self._uploads.get(folderId, []):
+                    if upload.uploadname.lower().startswith(key[1]):
+                        match = upload
+                        break
+                if match is not None:
+                    break
+            self._matches[key] = match
+            return match
+
+    # Returns the folder named name under parent, creating it if it doesn't
+    # already exist.
+    def createFolder(self, parent, name):
+        with self._lock:
+            self._loadFolders()
+            folder = self._children.get((parent.id, name), None)
+            if folder is not None:
+                return folder
+        folder = self._server.create_folder(parent, name)
+        if folder:
+            self.addFolder(folder)
+        return folder
+
+    # Adds a folder that was just created to the index.
+    def addFolder(self, folder):
+        with self._lock:
+            if self._folders is None:
+                return
+            self._addFolder(folder)
+
+    # Adds an upload that was just made to the index.
+    def addUpload(self, upload):
+        with self._lock:
+            if self._uploads is None:
+                return
+            self._uploads.setdefault(upload.folderid, []).append(upload)
+            # any lookup that found nothing before might find this now
+            self._matches = {key: match for key, match in self._matches.items() if match is not None}
+
+    # Forgets the uploads, so they are listed again the next time they are
+    # needed, e.g. to see whether an upload that seemed to fail got through.
+    def invalidateUploads(self):
+        with self._lock:
+            self._uploads = None
+            self._matches = {}
+
+    # Forgets everything, so it is all listed again the next time it is
+    # needed.
+    def invalidate(self):
+        with self._lock:
+            self._folders = None
+            self._parents = {}
+            self._children = {}
+            self._uploads = None
+            self._matches = {}
+
+    def _loadFolders(self):
+        if self._folders is not None:
+            return
+        self._folders = {}
+        for folder in self._server.list_folders():
+            self._addFolder(folder)
+
+    def _addFolder(self, folder):
+        self._parents[folder.id] = folder.parent
+        self._children[(folder.parent, folder.name)] = folder
+        self._folders.setdefault(folder.name, folder)
+
+    def _loadUploads(self):
+        if self._uploads is not None:
+            return
+        self._uploads = {}
+        uploads = self._server.list_uploads(all_pages=True)[0]
+        for upload in uploads:
+            self._uploads.setdefault(upload.folderid, []).append(upload)
+
+    # Returns the IDs of the folder and all of the folders under it.
+    def _getFolderTree(self, folderId):
+        children = {}
+        for childId, parentId in self._parents.items():
+            children.setdefault(parentId, []).append(childId)
+        tree = []
+        todo = [folderId]
+        while todo:
+            current = todo.pop(0)
+            if current in tree:
+                continue
+            tree.append(current)
+            todo.extend(children.get(current, []))
+        return tree
+
+_indexes = weakref.WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+# Returns the FossologyIndex for the Fossology server, which lasts as long
+# as the server object does, i.e. for the rest of the run.
+def getFossologyIndex(fossologyServer):
+    with _indexes_lock:
+        index = _indexes.get(fossologyServer, None)
+        if index is None:
+            index = FossologyIndex(fossologyServer)
+            _indexes[fossologyServer] = index
+        return index
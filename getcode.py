@@ -2,64 +2,57 @@
 # SPDX-FileType: SOURCE
 # SPDX-License-Identifier: Apache-2.0
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import os
 import util
 
 import git
 
+import gitcache
+import reuse
 from datatypes import ProjectRepoType, Status
 
 # Runner for GOTLISTING in GITHUB and GITHUB_SHARED
 def doGetRepoCodeForSubproject(cfg, prj, sp):
+    # if nothing has changed since last month, reuse last month's results
+    reused, unchanged = reuse.checkPriorMonth(cfg, prj, sp)
+    if reused:
+        return True
+
     # first, get path and make directory (if doesn't exist) for collecting code
     today = datetime.today().strftime("%Y-%m-%d")
     sp_path = os.path.join(cfg._zippath, cfg._month, "code", prj._name, sp._name)
-    org = ""
     ziporg_path = ""
     if sp._repotype == ProjectRepoType.GITHUB_SHARED:
-        org = prj._github_shared_org
         ziporg_path = os.path.join(sp_path, sp._name)
     elif sp._repotype == ProjectRepoType.GITHUB:
-        org = sp._github_org
         ziporg_path = os.path.join(sp_path, sp._github_ziporg)
     # clear contents if it's already there
-    if os.path.exists(ziporg_path):
-        util.retry_rmtree(ziporg_path)
-    # and create it if it isn't
-    if not os.path.exists(ziporg_path):
+    util.deferred_rmtree(cfg, ziporg_path, prj, sp)
+    # and create it if it isn't (not needed if streaming from the git cache)
+    stream = isStreamingArchives(cfg)
+    if not stream and not os.path.exists(ziporg_path):
         os.makedirs(ziporg_path)
 
-    # clone each repo and remove its .git directory
+    # clone each repo (by way of the git cache)
+    clones = []
     for repo in sp._repos:
-        git_url = f"git@github.com:{org}/{repo}.git"
-        dotgit_path = os.path.join(ziporg_path, repo, ".git")
-        if sp._github_branch != "":
-            print(f"{prj._name}/{sp._name}: cloning {git_url} branch {sp._github_branch}")
-            git.Git(ziporg_path).clone(git_url, depth=1, branch=sp._github_branch, single_branch=True)
-        else:
-            print(f"{prj._name}/{sp._name}: cloning {git_url}")
-            git.Git(ziporg_path).clone(git_url, depth=1)
-        # Record the top commit
-        r = git.Repo(dotgit_path, odbt=git.GitCmdObjectDB)
-        try:
-            cmts = []
-            try:
-                cmts = list(r.iter_commits())
-            except:
-                pass # We'll just leave this as empty.  git throws an exception if there are no commits - issue #49
-            if len(cmts) > 0:
-                sp._code_repos[repo] = cmts[0].hexsha
-        finally:
-            r.close()
+        git_url = gitcache.getRepoURL(prj, sp, repo)
+        clones.append((repo, git_url, os.path.join(ziporg_path, repo), sp._github_branch, repo not in unchanged))
+    if not cloneReposForSubproject(cfg, prj, sp, ziporg_path, clones, stream):
+        return False
 
     # before finishing, check and see whether it actually has any files
     anyfiles = False
-    gitPattern = ".git"+os.sep
-    for dirpath, _, files in os.walk(ziporg_path):
-        if files and gitPattern not in dirpath and not dirpath.endswith(".git"):
-            anyfiles = True
-            break
+    if stream:
+        anyfiles = anyFilesInGitCache(cfg, prj, sp)
+    else:
+        gitPattern = ".git"+os.sep
+        for dirpath, _, files in os.walk(ziporg_path):
+            if files and gitPattern not in dirpath and not dirpath.endswith(".git"):
+                anyfiles = True
+                break
     if not anyfiles:
         print(f"{prj._name}/{sp._name}: skipping, no files found")
         sp._code_anyfiles = False
@@ -78,43 +71,41 @@ def doGetRepoCodeForSubproject(cfg, prj, sp):
 
 # Runner for GOTLISTING in GERRIT
 def doGetRepoCodeForGerritSubproject(cfg, prj, sp):
+    # if nothing has changed since last month, reuse last month's results
+    reused, unchanged = reuse.checkPriorMonth(cfg, prj, sp)
+    if reused:
+        return True
+
     # first, get path and make directory (if doesn't exist) for collecting code
     today = datetime.today().strftime("%Y-%m-%d")
     sp_path = os.path.join(cfg._zippath, cfg._month, "code", prj._name, sp._name)
     ziporg_path = os.path.join(sp_path, sp._name)
     # clear contents if it's already there
-    if os.path.exists(ziporg_path):
-        util.retry_rmtree(ziporg_path)
-    # and create it if it isn't
-    if not os.path.exists(ziporg_path):
+    util.deferred_rmtree(cfg, ziporg_path, prj, sp)
+    # and create it if it isn't (not needed if streaming from the git cache)
+    stream = isStreamingArchives(cfg)
+    if not stream and not os.path.exists(ziporg_path):
         os.makedirs(ziporg_path)
 
-    # clone each repo and remove its .git directory
+    # clone each repo (by way of the git cache)
+    clones = []
     for repo in sp._repos:
         # parse repo name
         dashName = repo.replace("/", "-")
-        dstFolder = os.path.join(ziporg_path, dashName)
-        gitAddress = os.path.join(prj._gerrit_apiurl, repo)
-        # get repo
-        print(f"{prj._name}/{sp._name}: cloning {gitAddress}")
-        git.Repo.clone_from(gitAddress, dstFolder, depth=1)
-        # also record the top commit
-        dotgit_path = os.path.join(dstFolder, ".git")
-        r = git.Repo(dotgit_path)
-        try:
-            if len(r.refs) > 0:
-                cmts = list(r.iter_commits())
-                if len(cmts) > 0:
-                    sp._code_repos[repo] = cmts[0].hexsha
-        finally:
-            r.close()
+        gitAddress = gitcache.getRepoURL(prj, sp, repo)
+        clones.append((repo, gitAddress, os.path.join(ziporg_path, dashName), "", repo not in unchanged))
+    if not cloneReposForSubproject(cfg, prj, sp, ziporg_path, clones, stream):
+        return False
 
     # before zipping it all together, check and see whether it actually has any files
     anyfiles = False
-    for dirpath, _, files in os.walk(ziporg_path):
-        if files and ".git/" not in dirpath and not dirpath.endswith(".git"):
-            anyfiles = True
-            break
+    if stream:
+        anyfiles = anyFilesInGitCache(cfg, prj, sp)
+    else:
+        for dirpath, _, files in os.walk(ziporg_path):
+            if files and ".git/" not in dirpath and not dirpath.endswith(".git"):
+                anyfiles = True
+                break
     if not anyfiles:
         print(f"{prj._name}/{sp._name}: skipping, no files found")
         sp._code_anyfiles = False
@@ -130,3 +121,80 @@ def doGetRepoCodeForGerritSubproject(cfg, prj, sp):
     sp._status = Status.GOTCODE
     sp._code_pulled = today
     return True
+
+# Returns True if code should be streamed out of the git cache straight
+# into the zip file by zipcode, rather than checked out to disk first.
+# Needs the git cache, since that is where the code is streamed from.
+def isStreamingArchives(cfg):
+    return cfg._stream_archives and cfg._git_cache
+
+# Returns True if any of the commits recorded for the subproject's repos
+# have any files, looking in the git cache rather than a checkout.
+def anyFilesInGitCache(cfg, prj, sp):
+    for repo in sp._repos:
+        commit = sp._code_repos.get(repo, "")
+        if commit != "" and gitcache.hasFiles(cfg, gitcache.getRepoURL(prj, sp, repo), commit):
+            return True
+    return False
+
+# Returns the hash of the top commit of the repo checked out at repo_path,
+# or "" if it doesn't have any commits.
+def getTopCommit(repo_path):
+    r = git.Repo(os.path.join(repo_path, ".git"), odbt=git.GitCmdObjectDB)
+    try:
+        if len(r.refs) == 0:
+            return ""
+        try:
+            cmts = list(r.iter_commits(max_count=1))
+        except:
+            return "" # git throws an exception if there are no commits - issue #49
+        if len(cmts) > 0:
+            return cmts[0].hexsha
+        return ""
+    finally:
+        r.close()
+
+# Clones a subproject's repos into ziporg_path, several at once (up to the
+# configured number per host; see gitcache.getHostCloneJobs), and records
+# the top commit of each. clones is a list of (repo, git_url, dst_path,
+# branch, fetch) tuples. If stream is True, the repos are only fetched into
+# the git cache, for zipcode to stream from later, and nothing is written
+# to ziporg_path. Returns True if every repo was cloned. Otherwise,
+# prints the error for each repo that failed, removes ziporg_path so that
+# it isn't left half-populated, and returns False.
+def cloneReposForSubproject(cfg, prj, sp, ziporg_path, clones, stream=False):
+    def cloneOne(clone):
+        repo, git_url, dst_path, branch, fetch = clone
+        action = "fetching" if stream else "cloning"
+        if branch != "":
+            print(f"{prj._name}/{sp._name}: {action} {git_url} branch {branch}")
+        else:
+            print(f"{prj._name}/{sp._name}: {action} {git_url}")
+        try:
+            if stream:
+                return repo, gitcache.fetchRepo(cfg, git_url, branch, fetch=fetch), None
+            gitcache.cloneRepo(cfg, git_url, dst_path, branch, fetch=fetch)
+            return repo, getTopCommit(dst_path), None
+        except Exception as e:
+            return repo, "", e
+
+    hosts = set(gitcache.getHost(clone[1]) for clone in clones)
+    workers = sum(gitcache.getHostCloneJobs(cfg, host) for host in hosts)
+    results = []
+    if clones != []:
+        with ThreadPoolExecutor(max_workers=min(workers, len(clones))) as executor:
+            results = list(executor.map(cloneOne, clones))
+
+    errors = {}
+    for repo, commit, e in results:
+        if e is not None:
+            errors[repo] = e
+        elif commit != "":
+            sp._code_repos[repo] = commit
+    if errors != {}:
+        for repo, e in errors.items():
+            print(f"{prj._name}/{sp._name}: unable to clone {repo}: {str(e)}")
+        print(f"{prj._name}/{sp._name}: {len(errors)} of {len(clones)} repos failed to clone; removing {ziporg_path}")
+        util.deferred_rmtree(cfg, ziporg_path, prj, sp)
+        return False
+    return True
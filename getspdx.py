@@ -3,12 +3,120 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 
+import requests
+
 from datatypes import Status, ProjectRepoType
+from poller import chain, completed, getPoller
 from runagents import getUploadFolder, getUpload
+from uploadcode import RETRY_STATUS_CODES
 from fossology.obj import ReportFormat
+
+# how much of a report to write at a time as it is downloaded
+REPORT_CHUNK_SIZE = 1024 * 1024
+# how many reports to download at once
+REPORT_DOWNLOAD_JOBS = 4
+# how long to wait for Fossology to generate a report before giving up
+REPORT_TIMEOUT_SECONDS = 2 * 60 * 60
+# how many checks of a report in a row can fail to connect, or get a status
+# code (other than 503) that means it might work next time, before giving up
+REPORT_CHECK_RETRIES = 4
+
+_download_executor = None
+_download_executor_lock = threading.Lock()
+
+# Returns the thread pool shared by all report downloads, starting it the
+# first time it is needed.
+def getDownloadExecutor():
+    global _download_executor
+    with _download_executor_lock:
+        if _download_executor is None:
+            _download_executor = ThreadPoolExecutor(max_workers=REPORT_DOWNLOAD_JOBS, thread_name_prefix="report-download")
+        return _download_executor
+
+# Writes the body of response (a streamed requests response) to path, a
+# piece at a time, so that even very large reports are never held in
+# memory. Writes to a temporary file first, so that path only ever holds a
+# complete report.
+def saveReport(response, path):
+    partPath = f"{path}.part"
+    try:
+        with open(partPath, "wb") as reportFile:
+            for chunk in response.iter_content(chunk_size=REPORT_CHUNK_SIZE):
+                reportFile.write(chunk)
+        os.replace(partPath, path)
+    finally:
+        response.close()
+        if os.path.exists(partPath):
+            os.remove(partPath)
+
+# Starts watching (with the shared Poller) for Fossology to finish
+# generating the report, and then downloads it to path in the background.
+# A check that fails to connect, or gets a status code that means it might
+# work next time, is tried again at the next check, unless
+# REPORT_CHECK_RETRIES checks in a row have failed; a 503 just means the
+# report is still being generated, so it isn't counted. Returns a Future
+# that gets True once it has been saved, or an exception if it fails.
+def startReportDownload(fossologyServer, report_id, path):
+    saved = Future()
+    saved.set_running_or_notify_cancel()
+    started = time.monotonic()
+    counts = {"errors": 0}
+
+    def download(response):
+        try:
+            saveReport(response, path)
+            saved.set_result(True)
+        except Exception as e:
+            saved.set_exception(e)
+
+    def check():
+        try:
+            response = fossologyServer.session.get(f"{fossologyServer.api}/report/{report_id}", headers={}, stream=True)
+        except requests.exceptions.RequestException as ex:
+            return retryLater(str(ex))
+        if response.status_code == 200:
+            getDownloadExecutor().submit(download, response)
+            return True, True
+        response.close()
+        if response.status_code == 503:
+            # still being generated
+            counts["errors"] = 0
+            if time.monotonic() - started > REPORT_TIMEOUT_SECONDS:
+                raise Exception(f"Timed out waiting for report {report_id}")
+            return False, None
+        elif response.status_code == 403:
+            raise Exception(f"Authorization error getting report {report_id}")
+        elif response.status_code in RETRY_STATUS_CODES:
+            return retryLater(f"status code {response.status_code}")
+        else:
+            raise Exception(f"Download of report {report_id} failed")
+
+    def retryLater(error):
+        counts["errors"] += 1
+        if counts["errors"] > REPORT_CHECK_RETRIES:
+            raise Exception(f"Error getting report {report_id} after {counts['errors']} attempts: {error}")
+        print(f"Error getting report {report_id} ({error}); will retry")
+        return False, None
+
+    def ready(future):
+        if future.exception() is not None:
+            saved.set_exception(future.exception())
+    getPoller().watch(check).add_done_callback(ready)
+    return saved
+
 def doGetSPDXForSubproject(cfg, fossologyServer, prj, sp):
+    return startGetSPDXForSubproject(cfg, fossologyServer, prj, sp).result()
+
+# Like doGetSPDXForSubproject, but returns a Future (see poller.py) for its
+# result as soon as the report has been requested, which is done once it
+# has been downloaded. The Future is already done if there was nothing to
+# wait for.
+def startGetSPDXForSubproject(cfg, fossologyServer, prj, sp):
     uploadName = os.path.basename(sp._code_path)
     uploadFolderName = f"{prj._name}-{cfg._month}"
     spdxFolder = os.path.join(cfg._storepath, cfg._month, "spdx", prj._name)
@@ -16,16 +124,16 @@ def doGetSPDXForSubproject(cfg, fossologyServer, prj, sp):
 
     if uploadName == "":
         print(f"{prj._name}/{sp._name}: no code path in config, so no upload name; not running agents")
-        return False
+        return completed(False)
 
     uploadFolder = getUploadFolder(fossologyServer, uploadFolderName)
     if not uploadFolder:
         print(f"{prj._name}/{sp._name}: error getting the upload folder for generation of SPDX file")
-        return False
+        return completed(False)
     upload = getUpload(fossologyServer, uploadFolder, uploadName)
     if not upload:
         print(f"{prj._name}/{sp._name}: error getting the upload generation of SPDX file")
-        return False
+        return completed(False)
         
     # create spdx directory for project if it doesn't already exist
     if not os.path.exists(spdxFolder):
@@ -36,18 +144,25 @@ def doGetSPDXForSubproject(cfg, fossologyServer, prj, sp):
     
     try:
         report_id = fossologyServer.generate_report(upload, report_format=ReportFormat.SPDX2TV, group="fossy")
-        content, name = fossologyServer.download_report(report_id, wait_time=60)
-        with open(spdxFilePath, "wb") as reportFile:
-            written = reportFile.write(content)
-            assert written == len(content)
     except Exception as e:
         print(f"{prj._name}/{sp._name}: error getting SPDX tag-value file")
         print(e)
-        return False
+        return completed(False)
 
-    # once we get here, the agents have been run
-    sp._status = Status.GOTSPDX
-    
-    # and when we return, the runner framework should update the project's
-    # status to reflect the min of its subprojects
-    return True
+    # Fossology generates the report while the poller waits for it, so the
+    # runner can get on with other subprojects in the meantime
+    def finish(done):
+        try:
+            done.result()
+        except Exception as e:
+            print(f"{prj._name}/{sp._name}: error getting SPDX tag-value file")
+            print(e)
+            return False
+
+        # once we get here, the agents have been run
+        sp._status = Status.GOTSPDX
+
+        # and when we return, the runner framework should update the project's
+        # status to reflect the min of its subprojects
+        return True
+    return chain(startReportDownload(fossologyServer, report_id, spdxFilePath), finish)
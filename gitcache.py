@@ -0,0 +1,251 @@
+# SPDX-FileCopyrightText: Copyright The Linux Foundation
+# SPDX-FileType: SOURCE
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import re
+import subprocess
+import tarfile
+import threading
+from contextlib import contextmanager
+
+import git
+
+import util
+from datatypes import ProjectRepoType
+
+GIT_CACHE_DIR_NAME = "gitcache"
+
+# one lock per mirror, so that subprojects being run concurrently that
+# share a repo don't update its mirror at the same time
+_mirror_locks = {}
+_mirror_locks_lock = threading.Lock()
+
+def _getMirrorLock(mirror_path):
+    with _mirror_locks_lock:
+        lock = _mirror_locks.get(mirror_path, None)
+        if lock is None:
+            lock = threading.Lock()
+            _mirror_locks[mirror_path] = lock
+        return lock
+
+# one semaphore per host, shared by all subprojects, limiting how many
+# clones from that host run at once
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+# Returns how many clones may run at once from this host
+def getHostCloneJobs(cfg, host):
+    return max(1, cfg._clone_jobs_per_host.get(host, cfg._clone_jobs))
+
+def _getHostSemaphore(cfg, host):
+    with _host_semaphores_lock:
+        semaphore = _host_semaphores.get(host, None)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(getHostCloneJobs(cfg, host))
+            _host_semaphores[host] = semaphore
+        return semaphore
+
+# Returns the host name and path parts of this git URL, e.g.
+# git@github.com:org/repo.git => ["github.com", "org", "repo"]
+def getURLParts(git_url):
+    location = git_url
+    # scp-like syntax, e.g. git@github.com:org/repo.git
+    m = re.match(r"^[^/@:]+@([^/:]+):(.*)$", location)
+    if m:
+        location = f"{m.group(1)}/{m.group(2)}"
+    else:
+        location = re.sub(r"^[a-zA-Z][a-zA-Z0-9+.-]*://", "", location)
+        # drop any user name
+        location = re.sub(r"^[^/@]*@", "", location)
+    location = location.strip("/")
+    if location.endswith(".git"):
+        location = location[:-len(".git")]
+    return [re.sub(r"[^a-zA-Z0-9._-]", "_", part) for part in location.split("/") if part not in ("", ".", "..")]
+
+# Returns the host that this git URL points to, e.g. "github.com"
+def getHost(git_url):
+    parts = getURLParts(git_url)
+    return parts[0] if parts != [] else ""
+
+# Returns the git URL for one of the subproject's repos.
+def getRepoURL(prj, sp, repo):
+    if sp._repotype == ProjectRepoType.GERRIT or prj._repotype == ProjectRepoType.GERRIT:
+        return os.path.join(prj._gerrit_apiurl, repo)
+    if sp._repotype == ProjectRepoType.GITHUB_SHARED:
+        return f"git@github.com:{prj._github_shared_org}/{repo}.git"
+    return f"git@github.com:{sp._github_org}/{repo}.git"
+
+# Returns the path of the bare mirror for this git URL, under the zippath,
+# e.g. git@github.com:org/repo.git => ZIPPATH/gitcache/github.com/org/repo.git
+def getMirrorPath(cfg, git_url):
+    return os.path.join(cfg._zippath, GIT_CACHE_DIR_NAME, *getURLParts(git_url)) + ".git"
+
+# Creates the bare mirror if it doesn't exist yet, or else fetches just the
+# latest commit of the branch into it. Since the mirror already has last
+# month's objects, the fetch only transfers what has changed since.
+def updateMirror(git_url, mirror_path, branch=""):
+    if os.path.exists(mirror_path) and not os.path.isfile(os.path.join(mirror_path, "HEAD")):
+        # left behind by an interrupted clone
+        util.retry_rmtree(mirror_path)
+    if not os.path.exists(mirror_path):
+        os.makedirs(os.path.dirname(mirror_path), exist_ok=True)
+        if branch != "":
+            git.Git().clone(git_url, mirror_path, bare=True, depth=1, branch=branch)
+        else:
+            git.Git().clone(git_url, mirror_path, bare=True, depth=1)
+        return
+
+    g = git.Git()
+    # never let git go looking for a repo above the mirror
+    g.set_persistent_git_options(git_dir=mirror_path)
+    g.remote("set-url", "origin", git_url)
+    if branch == "":
+        # follow the remote's default branch, in case it has changed
+        branch = getRemoteDefaultBranch(g)
+        if branch == "":
+            # nothing to fetch, e.g. the repo is still empty
+            return
+        g.symbolic_ref("HEAD", f"refs/heads/{branch}")
+    g.fetch("origin", f"+refs/heads/{branch}:refs/heads/{branch}", depth=1)
+
+# Returns the name of the branch that the remote's HEAD points to, or "" if
+# it doesn't have one (e.g. an empty repo).
+def getRemoteDefaultBranch(g):
+    for line in g.ls_remote("--symref", "origin", "HEAD").splitlines():
+        if line.startswith("ref: refs/heads/") and line.endswith("\tHEAD"):
+            return line[len("ref: refs/heads/"):-len("\tHEAD")]
+    return ""
+
+# Gets a checkout of the latest commit of git_url (or of its branch, if
+# given) into dst_path, by way of the repo's mirror in the git cache. The
+# checkout is a shallow clone, like one made directly from git_url. If
+# anything goes wrong with the mirror, it is removed and the repo is
+# cloned directly instead. If fetch is False (e.g. because the remote is
+# known not to have changed since the mirror was last updated), an existing
+# mirror is used as it is.
+# No more than the host's configured number of clones (see
+# getHostCloneJobs) run at once.
+def cloneRepo(cfg, git_url, dst_path, branch="", fetch=True):
+    with _getHostSemaphore(cfg, getHost(git_url)):
+        _cloneRepo(cfg, git_url, dst_path, branch, fetch)
+
+def _cloneRepo(cfg, git_url, dst_path, branch, fetch):
+    if not cfg._git_cache:
+        _cloneShallow(git_url, dst_path, branch)
+        return
+
+    mirror_path = getMirrorPath(cfg, git_url)
+    with _getMirrorLock(mirror_path):
+        try:
+            if fetch or not os.path.isfile(os.path.join(mirror_path, "HEAD")):
+                updateMirror(git_url, mirror_path, branch)
+            # --depth only applies to local clones with a file:// URL
+            _cloneShallow(f"file://{os.path.abspath(mirror_path)}", dst_path, branch)
+            return
+        except git.GitCommandError as e:
+            print(f"Unable to use git cache for {git_url}, cloning directly: {str(e)}")
+            if os.path.exists(mirror_path):
+                util.retry_rmtree(mirror_path)
+            if os.path.exists(dst_path):
+                util.retry_rmtree(dst_path)
+    _cloneShallow(git_url, dst_path, branch)
+
+def _cloneShallow(git_url, dst_path, branch=""):
+    if branch != "":
+        git.Git().clone(git_url, dst_path, depth=1, branch=branch, single_branch=True)
+    else:
+        git.Git().clone(git_url, dst_path, depth=1)
+
+# Brings the repo's mirror in the git cache up to date (unless fetch is
+# False and it already exists), without checking anything out, and returns
+# the hash of the latest commit of git_url (or of its branch, if given), or
+# "" if it doesn't have any commits. Used with openArchive to stream code
+# straight from the mirror.
+def fetchRepo(cfg, git_url, branch="", fetch=True):
+    with _getHostSemaphore(cfg, getHost(git_url)):
+        mirror_path = getMirrorPath(cfg, git_url)
+        with _getMirrorLock(mirror_path):
+            try:
+                if fetch or not os.path.isfile(os.path.join(mirror_path, "HEAD")):
+                    updateMirror(git_url, mirror_path, branch)
+            except git.GitCommandError:
+                # start again from a fresh mirror
+                if os.path.exists(mirror_path):
+                    util.retry_rmtree(mirror_path)
+                updateMirror(git_url, mirror_path, branch)
+            g = git.Git()
+            g.set_persistent_git_options(git_dir=mirror_path)
+            ref = f"refs/heads/{branch}" if branch != "" else "HEAD"
+            try:
+                return g.rev_parse("--verify", "--quiet", f"{ref}^{{commit}}")
+            except git.GitCommandError:
+                return ""
+
+# Returns True if the repo's mirror exists and has the commit.
+def hasCommit(cfg, git_url, commit):
+    mirror_path = getMirrorPath(cfg, git_url)
+    with _getMirrorLock(mirror_path):
+        if not os.path.isfile(os.path.join(mirror_path, "HEAD")):
+            return False
+        g = git.Git()
+        g.set_persistent_git_options(git_dir=mirror_path)
+        try:
+            g.cat_file("-e", f"{commit}^{{commit}}")
+        except git.GitCommandError:
+            return False
+        return True
+
+# Returns True if the commit in the repo's mirror has any files.
+def hasFiles(cfg, git_url, commit):
+    mirror_path = getMirrorPath(cfg, git_url)
+    with _getMirrorLock(mirror_path):
+        g = git.Git()
+        g.set_persistent_git_options(git_dir=mirror_path)
+        return g.ls_tree(commit) != ""
+
+# Attributes that `git archive` applies but a checkout doesn't: leaving out
+# export-ignore files and rewriting export-subst ones. Attributes in the
+# repo's info/attributes take precedence over the repo's own .gitattributes
+# files, so this turns them off for every path.
+ARCHIVE_ATTRIBUTES = "* -export-ignore -export-subst\n"
+
+# Makes sure that the mirror's info/attributes turns off the export-only
+# attributes, so that archives of it have the same files as a checkout.
+def _setArchiveAttributes(mirror_path):
+    attributesPath = os.path.join(mirror_path, "info", "attributes")
+    if os.path.isfile(attributesPath):
+        with open(attributesPath, "r") as f:
+            if ARCHIVE_ATTRIBUTES in f.read():
+                return
+    os.makedirs(os.path.dirname(attributesPath), exist_ok=True)
+    with open(attributesPath, "a") as f:
+        f.write(ARCHIVE_ATTRIBUTES)
+
+# Streams the files in the commit out of the repo's mirror as a tar
+# archive, which is read as it is produced rather than written to disk.
+# The archive has the same files, with the same contents, as a checkout of
+# the commit would: the export-ignore and export-subst attributes are
+# turned off, both in the repo and in the user's global attributes file.
+# Yields a tarfile.TarFile in stream mode. The mirror is locked while
+# the archive is being read.
+@contextmanager
+def openArchive(cfg, git_url, commit):
+    mirror_path = getMirrorPath(cfg, git_url)
+    with _getMirrorLock(mirror_path):
+        _setArchiveAttributes(mirror_path)
+        cmd = ["git", f"--git-dir={mirror_path}", "-c", f"core.attributesFile={os.devnull}", "archive", "--format=tar", commit]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+                yield tar
+            # read to the end, so git isn't left blocked on a full pipe
+            while proc.stdout.read(65536):
+                pass
+        finally:
+            proc.stdout.close()
+            stderr = proc.stderr.read()
+            proc.stderr.close()
+            proc.wait()
+        if proc.returncode != 0:
+            raise git.GitCommandError(cmd, proc.returncode, stderr)
@@ -0,0 +1,79 @@
+# SPDX-FileCopyrightText: Copyright The Linux Foundation
+# SPDX-FileType: SOURCE
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+import threading
+import time
+
+# fsync the journal after this many records, or after this many seconds
+# since the last fsync, whichever comes first. Anything not yet fsynced when
+# the machine crashes is lost, and the affected subprojects just repeat
+# their last step on the next run.
+JOURNAL_FSYNC_EVERY = 32
+JOURNAL_FSYNC_SECONDS = 2.0
+
+# Append-only log of state transitions for one month, written as one JSON
+# record per line. Records are small compared to config.json, so writing
+# one after each step is cheap; saveConfig folds them into config.json and
+# removes the journal, and loadConfig replays any journal it finds.
+class StatusJournal:
+
+    def __init__(self, filename, fsyncEvery=JOURNAL_FSYNC_EVERY, fsyncSeconds=JOURNAL_FSYNC_SECONDS):
+        super(StatusJournal, self).__init__()
+
+        self._filename = filename
+        self._fsync_every = fsyncEvery
+        self._fsync_seconds = fsyncSeconds
+        self._lock = threading.Lock()
+        self._f = open(filename, "a")
+        # records written since the last fsync
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    # Writes one record. cls is passed on to json.dumps, for records holding
+    # objects that need a custom encoder.
+    def append(self, record, cls=None):
+        line = json.dumps(record, separators=(",", ":"), cls=cls) + "\n"
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+            self._pending += 1
+            if self._pending >= self._fsync_every or time.monotonic() - self._last_sync >= self._fsync_seconds:
+                self._sync()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._pending > 0:
+            os.fsync(self._f.fileno())
+            self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.flush()
+                self._sync()
+                self._f.close()
+                self._f = None
+
+# Returns the list of records in the journal, or [] if there isn't one.
+# A partial last line (from a crash mid-write) is ignored.
+def readJournal(filename):
+    records = []
+    if not os.path.isfile(filename):
+        return records
+    with open(filename, "r") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                print(f"Ignoring incomplete last record in {filename}")
+                break
+            try:
+                records.append(json.loads(line))
+            except json.decoder.JSONDecodeError:
+                print(f"Ignoring unreadable record in {filename}")
+    return records
@@ -0,0 +1,233 @@
+# SPDX-FileCopyrightText: Copyright The Linux Foundation
+# SPDX-FileType: SOURCE
+# SPDX-License-Identifier: Apache-2.0
+
+import glob
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+
+MONTH_LOCK_FILE_NAME = "lock.lock"
+# how long a lock is good for without being renewed. Locks are renewed in
+# the background while held, so a lock whose lease has run out was left
+# behind by a scaffold process that crashed or lost its machine.
+LOCK_LEASE_SECONDS = 600
+# how long to keep trying to get the short-lived config write lock
+CONFIG_WRITE_LOCK_WAIT_SECONDS = 60
+
+def getProjectLockFilename(month_dir, prj_name):
+    return os.path.join(month_dir, f"lock-{prj_name}.lock")
+
+def getConfigWriteLockFilename(month_dir):
+    return os.path.join(month_dir, "config-write.lock")
+
+# Returns the lease from a lock file, or None if there isn't one. Lock files
+# without a readable lease (e.g. from older versions of scaffold) get a lease
+# based on the file's modification time.
+def readLease(filename):
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        try:
+            mtime = os.path.getmtime(filename)
+        except OSError:
+            return None
+        return {"host": "", "pid": 0, "acquired": mtime, "expires": mtime + LOCK_LEASE_SECONDS}
+
+# Returns True if the process pid on host is known to have exited, i.e. it
+# is on this machine and no longer running. Processes on other machines
+# can't be checked, so they are never known to have exited.
+def isProcessGone(host, pid):
+    if host == socket.gethostname() and pid > 0:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pass
+    return False
+
+# Returns True if the lease has run out, or if it belongs to a process on
+# this machine that is no longer running.
+def isLeaseStale(lease):
+    if lease.get("expires", 0) < time.time():
+        return True
+    return isProcessGone(lease.get("host", ""), lease.get("pid", 0))
+
+# Returns True if the lock file exists and its lease is still good.
+def isLockHeld(filename):
+    lease = readLease(filename)
+    return lease is not None and not isLeaseStale(lease)
+
+# Removes the lock file if its lease is stale. The stale file is renamed
+# first, so that if two processes find it at once, only one removes it,
+# and neither removes a new lock that a third process just took.
+def breakStaleLock(filename):
+    lease = readLease(filename)
+    if lease is None or not isLeaseStale(lease):
+        return False
+    staleFilename = f"{filename}.stale-{socket.gethostname()}-{os.getpid()}"
+    try:
+        os.rename(filename, staleFilename)
+    except OSError:
+        return False
+    # make sure we moved the same stale lock that we looked at
+    movedLease = readLease(staleFilename)
+    if movedLease is not None and not isLeaseStale(movedLease):
+        try:
+            os.rename(staleFilename, filename)
+        except OSError:
+            pass
+        return False
+    print(f"Removed stale lock {filename} held by {lease.get('host', '')}:{lease.get('pid', 0)} since {datetime.fromtimestamp(lease.get('acquired', 0))}")
+    os.remove(staleFilename)
+    return True
+
+# A lease-based lock file, for either a whole month or a single project
+# within it. Project locks and the month lock are hierarchical: the month
+# lock can only be taken if no project in the month is locked, and a
+# project lock can only be taken if the month isn't locked. So `run projA`
+# and `run projB` can go at the same time, but `newmonth` waits for both.
+#
+# Lock files hold a JSON lease (host, pid, acquired and expires times), and
+# the lease is renewed in the background for as long as the lock is held.
+# A lock whose lease has run out, or whose process is gone, is stale and is
+# removed by the next process that wants it.
+class ScaffoldLock:
+
+    def __init__(self, month_dir, prj_name="", lease_seconds=LOCK_LEASE_SECONDS):
+        super(ScaffoldLock, self).__init__()
+
+        self._month_dir = month_dir
+        self._prj_name = prj_name
+        self._lease_seconds = lease_seconds
+        if prj_name == "":
+            self._filename = os.path.join(month_dir, MONTH_LOCK_FILE_NAME)
+        else:
+            self._filename = getProjectLockFilename(month_dir, prj_name)
+        self._held = False
+        self._stop_renewing = threading.Event()
+        self._renewer = None
+
+    def _lease(self):
+        now = time.time()
+        return {
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "project": self._prj_name,
+            "acquired": now,
+            "expires": now + self._lease_seconds,
+        }
+
+    def _create(self):
+        breakStaleLock(self._filename)
+        try:
+            with open(self._filename, 'x') as f:
+                json.dump(self._lease(), f)
+            return True
+        except FileExistsError:
+            return False
+
+    # Returns the names of the locks that conflict with this one and are
+    # currently held.
+    def _conflicts(self):
+        if self._prj_name == "":
+            lockFilenames = glob.glob(getProjectLockFilename(self._month_dir, "*"))
+        else:
+            lockFilenames = [os.path.join(self._month_dir, MONTH_LOCK_FILE_NAME)]
+        return [lf for lf in lockFilenames if isLockHeld(lf)]
+
+    # Tries to take the lock. Returns True if it was taken, or False if
+    # this lock or a conflicting one is already held.
+    def acquire(self):
+        if not self._create():
+            return False
+        # take our lock first, then look for conflicts, so that two
+        # conflicting processes can't both miss each other
+        if self._conflicts():
+            os.remove(self._filename)
+            return False
+        self._held = True
+        self._stop_renewing.clear()
+        self._renewer = threading.Thread(target=self._renew, daemon=True)
+        self._renewer.start()
+        return True
+
+    def _renew(self):
+        while not self._stop_renewing.wait(self._lease_seconds / 3):
+            lease = self._lease()
+            oldLease = readLease(self._filename)
+            if oldLease is None:
+                print(f"Lock {self._filename} was removed while held; no longer renewing it")
+                return
+            lease["acquired"] = oldLease.get("acquired", lease["acquired"])
+            tmpFilename = f"{self._filename}.tmp-{os.getpid()}"
+            with open(tmpFilename, 'w') as f:
+                json.dump(lease, f)
+            os.replace(tmpFilename, self._filename)
+
+    def release(self):
+        if not self._held:
+            return
+        self._stop_renewing.set()
+        if self._renewer is not None:
+            self._renewer.join()
+            self._renewer = None
+        if os.path.exists(self._filename):
+            os.remove(self._filename)
+        self._held = False
+
+    def describe(self):
+        if self._prj_name == "":
+            return "this month"
+        return f"project {self._prj_name}"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+# Short-lived lock held while merging a project's state into config.json,
+# so that two processes saving different projects don't overwrite each
+# other's changes. Waits up to CONFIG_WRITE_LOCK_WAIT_SECONDS for it.
+class ConfigWriteLock:
+
+    def __init__(self, month_dir, wait_seconds=CONFIG_WRITE_LOCK_WAIT_SECONDS):
+        super(ConfigWriteLock, self).__init__()
+
+        self._filename = getConfigWriteLockFilename(month_dir)
+        self._wait_seconds = wait_seconds
+
+    def __enter__(self):
+        deadline = time.time() + self._wait_seconds
+        while True:
+            breakStaleLock(self._filename)
+            try:
+                with open(self._filename, 'x') as f:
+                    now = time.time()
+                    json.dump({"host": socket.gethostname(), "pid": os.getpid(), "acquired": now, "expires": now + self._wait_seconds}, f)
+                return self
+            except FileExistsError:
+                if time.time() > deadline:
+                    raise RuntimeError(f"Timed out waiting for {self._filename}")
+                time.sleep(0.1)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        os.remove(self._filename)
+
+# Removes the lock for the month, or for a single project if prj_name is
+# given, whether or not it is stale.
+def clearLock(month_dir, prj_name=""):
+    if prj_name == "":
+        filename = os.path.join(month_dir, MONTH_LOCK_FILE_NAME)
+    else:
+        filename = getProjectLockFilename(month_dir, prj_name)
+    if os.path.exists(filename):
+        os.remove(filename)
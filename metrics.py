@@ -4,6 +4,7 @@
 
 import os
 
+from config import getFindingsProjectFilename, loadFindings
 from datatypes import Metrics, Priority, Status
 from instancesfile import loadInstances
 from metricsfile import loadMetrics
@@ -90,111 +91,132 @@ def printMetrics(metricsFilename):
     print(f"  Low:       {counts_instances[3]} instances ({counts_instances_files[3]} files)")
     print(f"")
 
-def getMetrics(cfg, fdServer):
+def getMetrics(cfg, fdServer, scaffoldHome):
     all_metrics = {}
 
+    if cfg._statedb is not None:
+        # read each subproject's state from the state database, rather than
+        # needing every project to be loaded
+        findings = {}
+        for prj_name, sp_name, status in cfg._statedb.listSubprojects():
+            if prj_name not in findings:
+                findingsFilename = getFindingsProjectFilename(scaffoldHome, cfg._month, prj_name)
+                findings[prj_name] = loadFindings(findingsFilename) if os.path.isfile(findingsFilename) else []
+            sp_state = cfg._statedb.getSubprojectState(prj_name, sp_name)
+            code = sp_state.get("code", {})
+            repos = []
+            for repotype in ["github", "github-shared", "gerrit"]:
+                repos = sp_state.get(repotype, {}).get("repos", repos)
+            all_metrics.setdefault(prj_name, {})[sp_name] = getSubprojectMetrics(cfg, fdServer, prj_name, sp_name,
+                Status[status], repos, code.get("path", ""), code.get("pulled", ""), findings[prj_name])
+        return all_metrics
+
     for prj in cfg._projects.values():
         prj_metrics = {}
         for sp in prj._subprojects.values():
-            print(f"{prj._name}/{sp._name}: getting metrics")
-            sp_metrics = Metrics()
-            sp_metrics._prj_name = prj._name
-            sp_metrics._sp_name = sp._name
-
-            # determine state category
-            st = sp._status.value
-            if st >= Status.START.value and st <= Status.RANAGENTS.value:
-                sp_metrics._state_category = "inproc"
-            elif st > Status.RANAGENTS.value and st <= Status.MADEDRAFTFINDINGS.value:
-                sp_metrics._state_category = "analyzed"
-            elif st > Status.MADEDRAFTFINDINGS.value and st <= Status.FILEDTICKETS.value:
-                sp_metrics._state_category = "uploaded"
-            elif st > Status.FILEDTICKETS.value and st <= Status.DELIVERED.value:
-                sp_metrics._state_category = "delivered"
-            elif st == Status.STOPPED.value:
-                sp_metrics._state_category = "stopped"
-            else:
-                sp_metrics._state_category = "unknown"
-
-            # determine number of unpacked files, if it's been uploaded to Fossology
-            if st >= Status.UPLOADEDCODE.value and st != Status.STOPPED.value:
-                sp_metrics._unpacked_files = getNumberUnpackedFiles(cfg, fdServer, prj, sp)
-            else:
-                sp_metrics._unpacked_files = 0
-
-            # determine number of repos regardless of stage (if not scanned yet,
-            # we'll just rely on last month's count, or else empty set)
-            sp_metrics._num_repos = len(sp._repos)
-
-            # determine instances, if we've at least made draft findings
-            if st >= Status.MADEDRAFTFINDINGS.value and st != Status.STOPPED.value:
-                instSet = getInstanceSet(cfg, prj, sp)
-                if instSet is None:
-                    print(f"{prj._name}/{sp._name}: unable to load instances file")
-                else:
-                    for inst in instSet._flagged:
-                        # currently can't use inst._priority because it has to
-                        # be retrieved from the finding data
-                        priority = getInstancePriority(cfg, prj, inst._finding_id)
-                        if priority == Priority.VERYHIGH:
-                            sp_metrics._instances_veryhigh += 1
-                            sp_metrics._files_veryhigh += len(inst._files)
-                        elif priority == Priority.HIGH:
-                            sp_metrics._instances_high += 1
-                            sp_metrics._files_high += len(inst._files)
-                        elif priority == Priority.MEDIUM:
-                            sp_metrics._instances_medium += 1
-                            sp_metrics._files_medium += len(inst._files)
-                        elif priority == Priority.LOW:
-                            sp_metrics._instances_low += 1
-                            sp_metrics._files_low += len(inst._files)
-                        else:
-                            print(f"{prj._name}/{sp._name}: invalid priority {priority} for instance with id {inst._finding_id}")
-
-            prj_metrics[sp._name] = sp_metrics
+            prj_metrics[sp._name] = getSubprojectMetrics(cfg, fdServer, prj._name, sp._name,
+                sp._status, sp._repos, sp._code_path, sp._code_pulled, prj._findings)
         all_metrics[prj._name] = prj_metrics
     return all_metrics
 
-def getNumberUnpackedFiles(cfg, fdServer, prj, sp):
+def getSubprojectMetrics(cfg, fdServer, prj_name, sp_name, status, repos, code_path, code_pulled, findings):
+    print(f"{prj_name}/{sp_name}: getting metrics")
+    sp_metrics = Metrics()
+    sp_metrics._prj_name = prj_name
+    sp_metrics._sp_name = sp_name
+
+    # determine state category
+    st = status.value
+    if st >= Status.START.value and st <= Status.RANAGENTS.value:
+        sp_metrics._state_category = "inproc"
+    elif st > Status.RANAGENTS.value and st <= Status.MADEDRAFTFINDINGS.value:
+        sp_metrics._state_category = "analyzed"
+    elif st > Status.MADEDRAFTFINDINGS.value and st <= Status.FILEDTICKETS.value:
+        sp_metrics._state_category = "uploaded"
+    elif st > Status.FILEDTICKETS.value and st <= Status.DELIVERED.value:
+        sp_metrics._state_category = "delivered"
+    elif st == Status.STOPPED.value:
+        sp_metrics._state_category = "stopped"
+    else:
+        sp_metrics._state_category = "unknown"
+
+    # determine number of unpacked files, if it's been uploaded to Fossology
+    if st >= Status.UPLOADEDCODE.value and st != Status.STOPPED.value:
+        sp_metrics._unpacked_files = getNumberUnpackedFiles(cfg, fdServer, prj_name, sp_name, code_path)
+    else:
+        sp_metrics._unpacked_files = 0
+
+    # determine number of repos regardless of stage (if not scanned yet,
+    # we'll just rely on last month's count, or else empty set)
+    sp_metrics._num_repos = len(repos)
+
+    # determine instances, if we've at least made draft findings
+    if st >= Status.MADEDRAFTFINDINGS.value and st != Status.STOPPED.value:
+        instSet = getInstanceSet(cfg, prj_name, sp_name, code_pulled)
+        if instSet is None:
+            print(f"{prj_name}/{sp_name}: unable to load instances file")
+        else:
+            for inst in instSet._flagged:
+                # currently can't use inst._priority because it has to
+                # be retrieved from the finding data
+                priority = getInstancePriority(findings, inst._finding_id)
+                if priority == Priority.VERYHIGH:
+                    sp_metrics._instances_veryhigh += 1
+                    sp_metrics._files_veryhigh += len(inst._files)
+                elif priority == Priority.HIGH:
+                    sp_metrics._instances_high += 1
+                    sp_metrics._files_high += len(inst._files)
+                elif priority == Priority.MEDIUM:
+                    sp_metrics._instances_medium += 1
+                    sp_metrics._files_medium += len(inst._files)
+                elif priority == Priority.LOW:
+                    sp_metrics._instances_low += 1
+                    sp_metrics._files_low += len(inst._files)
+                else:
+                    print(f"{prj_name}/{sp_name}: invalid priority {priority} for instance with id {inst._finding_id}")
+
+    return sp_metrics
+
+def getNumberUnpackedFiles(cfg, fdServer, prj_name, sp_name, code_path):
     # first, get the folder and then upload ID for this sp
-    uploadName = os.path.basename(sp._code_path)
-    uploadFolder = f"{prj._name}-{cfg._month}"
+    uploadName = os.path.basename(code_path)
+    uploadFolder = f"{prj_name}-{cfg._month}"
     folderNum = fdServer.GetFolderNum(uploadFolder)
     if folderNum is None or folderNum == -1:
-        print(f"{prj._name}/{sp._name}: could not retrieve folder number for folder {uploadFolder}")
+        print(f"{prj_name}/{sp_name}: could not retrieve folder number for folder {uploadFolder}")
         return 0
     uploadNum = fdServer.GetUploadNum(folderNum, uploadName)
     if uploadNum is None or uploadNum == -1:
-        print(f"{prj._name}/{sp._name}: could not retrieve upload number for upload {uploadName} in folder {uploadFolder} ({folderNum})")
+        print(f"{prj_name}/{sp_name}: could not retrieve upload number for upload {uploadName} in folder {uploadFolder} ({folderNum})")
         return 0
 
     # also need the top tree item number
     u = fdServer._getUploadData(folderNum, uploadName, False)
     if u is None:
-        print(f"{prj._name}/{sp._name}: could not retrieve upload data for upload {uploadName}")
+        print(f"{prj_name}/{sp_name}: could not retrieve upload data for upload {uploadName}")
         return 0
 
     # now, retrieve and extract the relevant stats
     stats = fdServer.GetUploadStatistics(uploadNum, u.topTreeItemId)
     if stats == []:
-        print(f"{prj._name}/{sp._name}: could not retrieve stats for upload {uploadName}")
+        print(f"{prj_name}/{sp_name}: could not retrieve stats for upload {uploadName}")
         return 0
 
     unpacked_files = stats.get("Files", -1)
     if unpacked_files == -1:
-        print(f"{prj._name}/{sp._name}: file count not found in stats for upload {uploadName}")
+        print(f"{prj_name}/{sp_name}: file count not found in stats for upload {uploadName}")
         return 0
 
     return unpacked_files
 
-def getInstanceSet(cfg, prj, sp):
+def getInstanceSet(cfg, prj_name, sp_name, code_pulled):
     # calculate paths; report folder would have been created in doCreateReport stage
-    reportFolder = os.path.join(cfg._storepath, cfg._month, "report", prj._name)
-    instancesJsonFilename = f"{sp._name}-instances-{sp._code_pulled}.json"
+    reportFolder = os.path.join(cfg._storepath, cfg._month, "report", prj_name)
+    instancesJsonFilename = f"{sp_name}-instances-{code_pulled}.json"
     instancesJsonPath = os.path.join(reportFolder, instancesJsonFilename)
     return loadInstances(instancesJsonPath)
 
-def getInstancePriority(cfg, prj, finding_id):
-    for finding in prj._findings:
+def getInstancePriority(findings, finding_id):
+    for finding in findings:
         if finding._id == finding_id:
             return finding._priority
@@ -24,6 +24,14 @@ def copyToNextMonth(scaffold_home, cfg):
         print(f"Directory for next month already exists at {newMonthDir}; bailing")
         return False
 
+    # the journal and state database, if any, belong to the old month
+    for journal in cfg._journals.values():
+        journal.close()
+    cfg._journals = {}
+    if cfg._statedb is not None:
+        cfg._statedb.close()
+        cfg._statedb = None
+
     # update the config object
     cfg._month = newYM
     cfg._version = 1
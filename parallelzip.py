@@ -0,0 +1,310 @@
+# SPDX-FileCopyrightText: Copyright The Linux Foundation
+# SPDX-FileType: SOURCE
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import os
+import sys
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from datatypes import ZipCompressionPolicy
+
+# files bigger than this are written by zipfile itself, streaming from disk,
+# rather than being read into memory to be compressed by a worker
+LARGE_FILE_SIZE = 32 * 1024 * 1024
+
+# how many compressed entries (per worker) may be waiting to be written
+PENDING_PER_WORKER = 4
+
+# how much of the start of a file to look at to decide its category
+HEAD_SIZE = 8000
+
+# how much of a large file to read at a time
+CHUNK_SIZE = 1024 * 1024
+
+# timestamp given to every entry in a deterministic zip file (the earliest
+# that the zip format allows)
+DETERMINISTIC_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# categories of files in a ZipCompressionPolicy
+CATEGORY_COMPRESSED = "compressed"
+CATEGORY_TEXT = "text"
+CATEGORY_BINARY = "binary"
+
+# extensions of formats that are already compressed, so that deflating them
+# again would cost CPU time for next to no gain
+COMPRESSED_EXTENSIONS = {
+    # archives
+    ".zip", ".jar", ".war", ".ear", ".apk", ".aar", ".whl", ".egg", ".nupkg", ".crx", ".xpi", ".vsix",
+    ".gz", ".tgz", ".bz2", ".tbz2", ".xz", ".txz", ".zst", ".lz4", ".lzma", ".7z", ".rar",
+    # documents that are zip files inside
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".epub",
+    # images, fonts, audio and video
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".woff", ".woff2",
+    ".mp3", ".mp4", ".m4a", ".ogg", ".webm", ".mov",
+    ".pdf",
+}
+
+# first bytes of formats that are already compressed, for files whose
+# extension doesn't give them away
+COMPRESSED_MAGIC = [
+    b"PK\x03\x04",            # zip, jar, etc.
+    b"\x1f\x8b",              # gzip
+    b"\xfd7zXZ\x00",          # xz
+    b"7z\xbc\xaf\x27\x1c",    # 7z
+    b"\x28\xb5\x2f\xfd",      # zstd
+    b"Rar!\x1a\x07",          # rar
+    b"\x89PNG\r\n\x1a\n",     # PNG
+    b"\xff\xd8\xff",          # JPEG
+    b"GIF87a", b"GIF89a",
+    b"wOFF", b"wOF2",
+    b"OggS",
+]
+
+# Returns the ZipCompressionPolicy category for a file, given its name and
+# (up to) the first HEAD_SIZE bytes of its contents.
+def getCategory(policy, name, head):
+    ext = os.path.splitext(name)[1].lower()
+    if ext in COMPRESSED_EXTENSIONS or ext in policy._compressed_extensions:
+        return CATEGORY_COMPRESSED
+    for magic in COMPRESSED_MAGIC:
+        if head.startswith(magic):
+            return CATEGORY_COMPRESSED
+    # bzip2 has a one-digit block size after its magic
+    if head.startswith(b"BZh") and head[3:4].isdigit():
+        return CATEGORY_COMPRESSED
+    if b"\x00" in head[:HEAD_SIZE]:
+        return CATEGORY_BINARY
+    return CATEGORY_TEXT
+
+# Returns the deflate level (0 meaning store) for a category in the policy.
+def getLevel(policy, category):
+    default = ZipCompressionPolicy()._levels
+    return policy._levels.get(category, default.get(category, zlib.Z_DEFAULT_COMPRESSION))
+
+# Returns the SHA-256 (as hex) of the file at path.
+def getFileSha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+##### Compatibility shim for zipfile internals
+##### zipfile has no public way to add an entry that is already compressed,
+##### which ParallelZipWriter needs so that workers can do the compressing.
+##### Everything that uses zipfile's private attributes is here.
+
+# the oldest and newest Python versions whose zipfile appendCompressed has
+# been checked against (see tests/testparallelzip.py). on any other
+# version, ParallelZipWriter has ZipFile.open compress each entry instead,
+# in the writing thread
+ZIPFILE_INTERNALS_VERSIONS = ((3, 9), (3, 13))
+
+# Returns True if appendCompressed can be used with this Python's zipfile.
+def canAppendCompressed():
+    return ZIPFILE_INTERNALS_VERSIONS[0] <= sys.version_info[:2] <= ZIPFILE_INTERNALS_VERSIONS[1]
+
+# Appends an entry whose data is already compressed (and whose sizes and
+# CRC are already set in zinfo) to zf, the same way that
+# ZipFile.open(..., 'w') does, except that the sizes and CRC are already
+# known when the local header is written.
+def appendCompressed(zf, zinfo, compressed):
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+    zf._writecheck(zinfo)
+    zf._didModify = True
+    zinfo.header_offset = zf.fp.tell()
+    zf.fp.write(zinfo.FileHeader(zip64))
+    zf.fp.write(compressed)
+    zf.start_dir = zf.fp.tell()
+    zf.filelist.append(zinfo)
+    zf.NameToInfo[zinfo.filename] = zinfo
+
+# Sets the deflate level that ZipFile.open(zinfo, 'w') compresses zinfo's
+# data at.
+def setCompressLevel(zinfo, level):
+    if hasattr(zinfo, "compress_level"):
+        # Python 3.13 and later
+        zinfo.compress_level = level
+    else:
+        zinfo._compresslevel = level
+
+# Returns a one-line summary of a ParallelZipWriter's stats, e.g.
+# "12 files, 34567 bytes => 5678 bytes (16.4%); compressed: 2 files at 100.0%, ..."
+def describeStats(stats):
+    files = sum(s[0] for s in stats.values())
+    size = sum(s[1] for s in stats.values())
+    compressed = sum(s[2] for s in stats.values())
+    ratio = 100.0 * compressed / size if size > 0 else 100.0
+    parts = []
+    for category, (c_files, c_size, c_compressed) in sorted(stats.items()):
+        c_ratio = 100.0 * c_compressed / c_size if c_size > 0 else 100.0
+        parts.append(f"{category}: {c_files} files at {c_ratio:.1f}%")
+    retval = f"{files} files, {size} bytes => {compressed} bytes ({ratio:.1f}%)"
+    if parts != []:
+        retval += "; " + ", ".join(parts)
+    return retval
+
+# Writes a standard deflated zip file, compressing the files in worker
+# threads (zlib releases the GIL while it compresses) and appending the
+# compressed entries to the zip file in the order they were added. The
+# result is the same kind of zip file that zipfile.ZipFile would write,
+# so it can be read by Fossology, the Unified Agent and zipfile itself.
+# Each file is deflated at the level that policy (a ZipCompressionPolicy)
+# gives for its category, or stored if that level is 0.
+# If deterministic is True, every entry gets the same timestamp and either
+# 0644 or 0755 permissions, so that the same files added in the same order
+# always give a byte-for-byte identical zip file.
+# On Python versions that canAppendCompressed doesn't know, the workers only
+# categorize the files, and ZipFile.open compresses them as they are written.
+class ParallelZipWriter:
+
+    def __init__(self, path, jobs=0, policy=None, deterministic=False):
+        super(ParallelZipWriter, self).__init__()
+
+        self._jobs = jobs if jobs > 0 else (os.cpu_count() or 1)
+        self._policy = policy if policy is not None else ZipCompressionPolicy()
+        self._deterministic = deterministic
+        # whether workers compress entries, for appendCompressed to add
+        self._precompress = canAppendCompressed()
+        # category => [files, bytes, compressed bytes]
+        self._stats = {}
+        # name => (size, SHA-256) of each file written so far
+        self._manifest = {}
+        self._zf = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED)
+        self._executor = ThreadPoolExecutor(max_workers=self._jobs)
+        # futures for compressed entries not yet written, in order
+        self._pending = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Adds the file at fpath to the zip file as arcname.
+    def write(self, fpath, arcname):
+        if os.path.getsize(fpath) > LARGE_FILE_SIZE:
+            with open(fpath, 'rb') as f:
+                self.writestream(zipfile.ZipInfo.from_file(fpath, arcname=arcname), f)
+            return
+        self._submit(self._compressFile, fpath, arcname)
+
+    # Adds data (bytes) to the zip file, with the name, date and mode from
+    # zinfo (a zipfile.ZipInfo).
+    def writestr(self, zinfo, data):
+        self._normalize(zinfo)
+        self._submit(self._compress, zinfo, data)
+
+    # Adds the contents of fileobj to the zip file, with the name, date and
+    # mode from zinfo, reading and compressing it a piece at a time rather
+    # than all at once. For large files whose size isn't known up front.
+    def writestream(self, zinfo, fileobj):
+        self._drain(0)
+        self._normalize(zinfo)
+        head = fileobj.read(HEAD_SIZE)
+        category = getCategory(self._policy, zinfo.filename, head)
+        level = getLevel(self._policy, category)
+        if level == 0:
+            zinfo.compress_type = zipfile.ZIP_STORED
+        else:
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            setCompressLevel(zinfo, level)
+        h = hashlib.sha256(head)
+        with self._zf.open(zinfo, 'w', force_zip64=True) as dst:
+            dst.write(head)
+            for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+                dst.write(chunk)
+                h.update(chunk)
+        self._addStats(category, zinfo, h.hexdigest())
+
+    # Returns a dict of category => (files, bytes, compressed bytes) for
+    # everything written so far.
+    def getStats(self):
+        return {category: tuple(s) for category, s in self._stats.items()}
+
+    # Returns the manifest of everything written so far: one
+    # "SHA-256  size  name" line per file, sorted by name. It depends only on
+    # the files' names and contents, not on how or in what order they were
+    # zipped.
+    def getManifest(self):
+        return "".join(f"{sha256}  {size}  {name}\n" for name, (size, sha256) in sorted(self._manifest.items()))
+
+    # Returns the SHA-256 (as hex) of the manifest.
+    def getManifestSha256(self):
+        return hashlib.sha256(self.getManifest().encode("utf-8")).hexdigest()
+
+    def close(self):
+        if self._zf is None:
+            return
+        try:
+            self._drain(0)
+        finally:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._zf.close()
+            self._zf = None
+
+    def _submit(self, fn, *args):
+        self._drain(self._jobs * PENDING_PER_WORKER)
+        self._pending.append(self._executor.submit(fn, *args))
+
+    # Writes the oldest pending entries, waiting for them to be compressed if
+    # need be, until no more than limit are left.
+    def _drain(self, limit):
+        while len(self._pending) > limit:
+            category, zinfo, data, sha256 = self._pending.popleft().result()
+            if self._precompress:
+                appendCompressed(self._zf, zinfo, data)
+            else:
+                with self._zf.open(zinfo, 'w') as dst:
+                    dst.write(data)
+            self._addStats(category, zinfo, sha256)
+
+    def _addStats(self, category, zinfo, sha256):
+        s = self._stats.setdefault(category, [0, 0, 0])
+        s[0] += 1
+        s[1] += zinfo.file_size
+        s[2] += zinfo.compress_size
+        self._manifest[zinfo.filename] = (zinfo.file_size, sha256)
+
+    # In deterministic mode, gives the entry a fixed timestamp and keeps only
+    # whether it is executable from its permissions.
+    def _normalize(self, zinfo):
+        if not self._deterministic:
+            return
+        executable = (zinfo.external_attr >> 16) & 0o111
+        zinfo.date_time = DETERMINISTIC_DATE_TIME
+        zinfo.external_attr = (0o100755 if executable else 0o100644) << 16
+        zinfo.create_system = 3
+
+    def _compressFile(self, fpath, arcname):
+        zinfo = zipfile.ZipInfo.from_file(fpath, arcname=arcname)
+        self._normalize(zinfo)
+        with open(fpath, 'rb') as f:
+            data = f.read()
+        return self._compress(zinfo, data)
+
+    # Returns the entry's category, zinfo, data to write (compressed, unless
+    # ZipFile.open is to compress it) and SHA-256.
+    def _compress(self, zinfo, data):
+        category = getCategory(self._policy, zinfo.filename, data[:HEAD_SIZE])
+        level = getLevel(self._policy, category)
+        zinfo.file_size = len(data)
+        if level == 0:
+            compressed = data
+            zinfo.compress_type = zipfile.ZIP_STORED
+        elif not self._precompress:
+            compressed = data
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            setCompressLevel(zinfo, level)
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+            compressed = compressor.compress(data) + compressor.flush()
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+        if self._precompress:
+            zinfo.compress_size = len(compressed)
+            zinfo.CRC = zlib.crc32(data)
+        return category, zinfo, compressed, hashlib.sha256(data).hexdigest()
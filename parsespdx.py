@@ -3,11 +3,15 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import os
+import re
+import threading
+import weakref
 
 from datatypes import SLMCategory, SLMFile, SLMLicense, Status
 from slmjson import loadSLMCategories, saveSLMCategories
-from slm.tvReader import TVReader
+from slmpolicy import getCompiledPolicy
 from slm.tvParser import TVParser
+from slm.tvReader import TVReader
 
 MD5_EMPTY_FILE = "d41d8cd98f00b204e9800998ecf8427e"
 
@@ -38,63 +42,59 @@ def doParseSPDXForSubproject(cfg, prj, sp):
     spdxFilename = f"{sp._name}-{sp._code_pulled}.spdx"
     spdxFilePath = os.path.join(spdxFolder, spdxFilename)
 
-    tvList = []
-    try:
-        with open(spdxFilePath, 'r') as f:
-            # read in the tag-value pairs line-by-line
-            reader = TVReader()
-            for line in f:
-                reader.readNextLine(line)
-            tvList = reader.finalize()
-            # check for errors
-            if reader.isError():
-                print(f"{prj._name}/{sp._name}: error reading SPDX file: {reader.errorMessage}")
-
-    except FileNotFoundError:
+    if not os.path.isfile(spdxFilePath):
         print(f"{prj._name}/{sp._name}: SPDX tag-value file not found at {spdxFilePath}")
         return False
 
-    # parse the tag-value pairs
+    # create one category for each SLMCategoryConfig, so they're in
+    # the correct order; same for licenses in each category
+    # we'll later drop any that don't have files
+    compiled = getCompiledPolicy(policy)
+    cats = compiled.buildCategories()
+    aliases = compiled._aliases
+    matcher = getNoLicenseFoundMatcher(prj)
+
+    # read and parse the tag-value pairs line-by-line, handling each file's
+    # data as soon as it has been parsed, so that neither the pairs nor the
+    # parsed file data for the whole document are ever held in memory
+    reader = TVReader(TVParser.TAGS)
     parser = TVParser()
-    for tag, value in tvList:
-        parser.parseNextPair(tag, value)
-    fdList = parser.finalize()
+    numFiles = 0
+    # license => None, for each license that isn't categorized, in the order
+    # they were found
+    missing_lics = {}
+    with open(spdxFilePath, 'r') as f:
+        for fd in parser.parsePairs(reader.readLines(f)):
+            numFiles += 1
+
+            # apply adjustments
+            applyAlias(aliases, fd)
+            matcher.apply(fd)
+
+            # reformulate into category/license/file structure, and/or error out
+            # if any are missing
+            slot = compiled.getLicenseSlot(cats, fd.license)
+            if slot is not None:
+                addToLicenseSlot(slot[0], slot[1], fd)
+            else:
+                # license isn't categorized
+                missing_lics[fd.license] = None
+
     # check for errors
+    if reader.isError():
+        print(f"{prj._name}/{sp._name}: error reading SPDX file: {reader.errorMessage}")
+        return False
     if parser.isError():
         print(f"{prj._name}/{sp._name}: error parsing SPDX file: {parser.errorMessage}")
         return False
-    # empty list means no file data found
-    if fdList == []:
+    # no files means no file data found
+    if numFiles == 0:
         print(f"{prj._name}/{sp._name}: error parsing SPDX file: no file data found")
         return False
 
-    # apply adjustments
-    applyAliases(policy, fdList)
-    applyNoLicenseFoundFindings(cfg, prj, fdList)
-
-    # create one category for each SLMCategoryConfig, so they're in
-    # the correct order; same for licenses in each category
-    # we'll later drop any that don't have files
-    cats = buildCategories(policy)
-
-    # reformulate into category/license/file structure, and/or error out
-    # if any are missing
-    missing_lics = []
-    for fd in fdList:
-        cat_name = getCategoryForLicense(policy, fd.license)
-        if cat_name:
-            retval = addToLicense(cats, cat_name, fd)
-            if not retval:
-                print(f"{prj._name}/{sp._name}: error adding file path {fd.path} for license {fd.license}")
-                return False
-        else:
-            # license isn't categorized
-            if fd.license not in missing_lics:
-                missing_lics.append(fd.license)
-
     # check for missing licenses
     if len(missing_lics) > 0:
-        sp._slm_pending_lics = missing_lics
+        sp._slm_pending_lics = list(missing_lics)
         print(f"{prj._name}/{sp._name}: need to add licenses to categories, see licenses-pending")
         return False
     else:
@@ -121,22 +121,27 @@ def doParseSPDXForSubproject(cfg, prj, sp):
     # status to reflect the min of its subprojects
     return True
 
+# Returns a dict of each alias configured in the policy => the license
+# name it translates to.
+def getAliases(policy):
+    return dict(getCompiledPolicy(policy)._aliases)
+
+def applyAlias(aliases, fd):
+    newLicense = aliases.get(fd.license, "")
+    if newLicense != "":
+        fd.license = newLicense
+
 def applyAliases(policy, fdList):
     # build lookup of all configured aliases, with orig name => translated name
-    aliases = {}
-    for cat in policy._category_configs:
-        for lic in cat._license_configs:
-            for a in lic._aliases:
-                aliases[a] = lic._name
+    aliases = getAliases(policy)
 
     # now, walk through fdList and apply aliases
     for fd in fdList:
-        newLicense = aliases.get(fd.license, "")
-        if newLicense != "":
-            fd.license = newLicense
+        applyAlias(aliases, fd)
 
-def applyNoLicenseFoundFindings(cfg, prj, fdList):
-    # prepare extension search lists
+# Returns (extensions, anywhere patterns, exact filenames) from the
+# project's slm extensions-skip list.
+def getExtensionsSkipPatterns(prj):
     # split out those extensions ending in asterisks => anywhere in file path, not just at end
     # split out those extensions ending in equal sign => exact filename match
     anyList = []
@@ -149,50 +154,79 @@ def applyNoLicenseFoundFindings(cfg, prj, fdList):
             exactList.append(str.lower(ext.rstrip("=")))
         else:
             extRevisedList.append(str.lower(ext))
+    return extRevisedList, anyList, exactList
+
+# The project's rules for findings on files with no license found (the
+# slm extensions-skip list and third party dirs), compiled into set lookups
+# and one regex each for the substring rules, so that each file's path is
+# checked in a single pass per rule rather than once per pattern.
+class NoLicenseFoundMatcher:
+
+    def __init__(self, prj):
+        super(NoLicenseFoundMatcher, self).__init__()
+
+        extRevisedList, anyList, exactList = getExtensionsSkipPatterns(prj)
+        self._extensions = set(extRevisedList)
+        self._exact_names = set(exactList)
+        # patterns anywhere in the lower-cased file path
+        self._anywhere = compileSubstrings(anyList)
+        # directories anywhere in the file path, case sensitive
+        self._thirdparty = compileSubstrings(prj._slm_thirdparty_dirs)
+
+    def apply(self, fd):
+        if fd.license != "No license found":
+            return
+        # check file extensions, patterns anywhere in the path, and
+        # whether the filename is exactly the same as the "extension"
+        lowerPath = fd.path.lower()
+        ext = os.path.splitext(lowerPath)[1].lstrip(".")
+        if ext in self._extensions or \
+                (self._anywhere is not None and self._anywhere.search(lowerPath)) or \
+                os.path.split(lowerPath)[1] in self._exact_names:
+            fd.finding_extensions = "yes"
+
+        # also check third party dirs
+        if self._thirdparty is not None and self._thirdparty.search(fd.path):
+            fd.finding_thirdparty = "yes"
+
+        # also check empty files
+        if fd.md5 == MD5_EMPTY_FILE:
+            fd.finding_emptyfile = "yes"
+
+# Returns a regex that finds any of the substrings, or None if there aren't
+# any. Longer ones are tried first, though any match will do.
+def compileSubstrings(substrings):
+    if not substrings:
+        return None
+    return re.compile("|".join(re.escape(sub) for sub in sorted(set(substrings), key=len, reverse=True)))
+
+_matchers = weakref.WeakKeyDictionary()
+_matchers_lock = threading.Lock()
+
+# Returns the NoLicenseFoundMatcher for prj, compiling it the first time (or
+# again if the project's extensions-skip list or third party dirs have
+# changed since), so that every subproject's parse shares it.
+def getNoLicenseFoundMatcher(prj):
+    signature = (tuple(prj._slm_extensions_skip), tuple(prj._slm_thirdparty_dirs))
+    with _matchers_lock:
+        entry = _matchers.get(prj, None)
+        if entry is None or entry[0] != signature:
+            entry = (signature, NoLicenseFoundMatcher(prj))
+            _matchers[prj] = entry
+        return entry[1]
+
+def applyNoLicenseFoundFindings(cfg, prj, fdList):
+    # use the project's compiled rules for all of the files
+    matcher = getNoLicenseFoundMatcher(prj)
 
     for fd in fdList:
-        if fd.license == "No license found":
-            # check file extensions
-            ext = os.path.splitext(fd.path)[1].lstrip(".")
-            if str.lower(ext) in extRevisedList:
-                fd.finding_extensions = "yes"
-            # also check list of those with asterisks, for pattern anywhere in filename
-            for pattern in anyList:
-                if pattern in str.lower(fd.path):
-                    fd.finding_extensions = "yes"
-            # also check whether the filename is exactly the same as the "extension"
-            for exactPattern in exactList:
-                if exactPattern == str.lower(os.path.split(fd.path)[1]):
-                    fd.finding_extensions = "yes"
-
-            # also check third party dirs
-            for directory in prj._slm_thirdparty_dirs:
-                if directory in fd.path:
-                    fd.finding_thirdparty = "yes"
-
-            # also check empty files
-            if fd.md5 == MD5_EMPTY_FILE:
-                fd.finding_emptyfile = "yes"
+        matcher.apply(fd)
 
 def getCategoryForLicense(policy, lic):
-    for cat_cfg in policy._category_configs:
-        for lic_cfg in cat_cfg._license_configs:
-            if lic_cfg._name == lic:
-                return cat_cfg._name
-
-    return None
+    return getCompiledPolicy(policy).getCategoryForLicense(lic)
 
 def buildCategories(policy):
-    cats = []
-    for cc in policy._category_configs:
-        cat = SLMCategory()
-        cat._name = cc._name
-        for lc in cc._license_configs:
-            lic = SLMLicense()
-            lic._name = lc._name
-            cat._licenses.append(lic)
-        cats.append(cat)
-    return cats
+    return getCompiledPolicy(policy).buildCategories()
 
 def pruneCategories(cats):
     cats = [cat for cat in cats if cat._numfiles > 0]
@@ -207,21 +241,29 @@ def addToLicense(cats, cat_name, fd):
             # find the license
             for lic in cat._licenses:
                 if lic._name == fd.license:
-                    # add it
-                    f = SLMFile()
-                    f._path = fd.path
-                    if fd.finding_extensions != "":
-                        f._findings["extension"] = fd.finding_extensions
-                    if fd.finding_thirdparty != "":
-                        f._findings["thirdparty"] = fd.finding_thirdparty
-                    if fd.finding_emptyfile != "":
-                        f._findings["emptyfile"] = fd.finding_emptyfile
-                    lic._numfiles += 1
-                    cat._numfiles += 1
-                    lic._files.append(f)
+                    addToLicenseSlot(cat, lic, fd)
                     return True
     return False
 
+# Adds the file to lic, which is in cat, e.g. as found by
+# CompiledSLMPolicy.getLicenseSlot.
+def addToLicenseSlot(cat, lic, fd):
+    f = SLMFile()
+    f._path = fd.path
+    # most files have no findings, and can share NO_FINDINGS
+    findings = {}
+    if fd.finding_extensions != "":
+        findings["extension"] = fd.finding_extensions
+    if fd.finding_thirdparty != "":
+        findings["thirdparty"] = fd.finding_thirdparty
+    if fd.finding_emptyfile != "":
+        findings["emptyfile"] = fd.finding_emptyfile
+    if findings:
+        f._findings = findings
+    lic._numfiles += 1
+    cat._numfiles += 1
+    lic._files.append(f)
+
 def doCreateCombinedSLMJSONForProject(cfg, prj):
     # confirm we're at the right stages
     if prj._status != Status.GOTSPDX:
@@ -241,16 +283,8 @@ def doCreateCombinedSLMJSONForProject(cfg, prj):
     # we know now that there is only 1 policy, so we just get it and proceed
     policy = list(prj._slm_policies.values())[0]
 
-    allCategories = []
     # initiate with config categories and licenses
-    for configCat in policy._category_configs:
-        newCat = SLMCategory()
-        newCat._name = configCat._name
-        allCategories.append(newCat)
-        for configLic in configCat._license_configs:
-            newLic = SLMLicense()
-            newLic._name = configLic._name
-            newCat._licenses.append(newLic)
+    allCategories = getCompiledPolicy(policy).buildCategories()
     # load each subproject's JSON file, and incorporate its data into this combined one
     for sp in prj._subprojects.values():
         # skip those that are stopped
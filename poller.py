@@ -0,0 +1,126 @@
+# SPDX-FileCopyrightText: Copyright The Linux Foundation
+# SPDX-FileType: SOURCE
+# SPDX-License-Identifier: Apache-2.0
+
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+# how long to wait before the first check of something being watched, and
+# the most to wait between checks
+POLL_INITIAL_SECONDS = 2.0
+POLL_MAX_SECONDS = 60.0
+# how much longer to wait after each check that finds it isn't done yet
+POLL_BACKOFF_FACTOR = 1.5
+# each wait is randomly up to this fraction shorter or longer, so that
+# things started together don't all get checked at the same moment
+POLL_JITTER = 0.25
+
+# Watches many outstanding things at once (e.g. Fossology uploads being
+# unpacked, or scanning jobs), from a single background thread. Each one is
+# checked with exponential backoff plus jitter, and its Future is completed
+# as soon as a check finds it done, which wakes anything waiting on the
+# Future (e.g. the StageScheduler).
+class Poller:
+
+    def __init__(self, initialSeconds=POLL_INITIAL_SECONDS, maxSeconds=POLL_MAX_SECONDS, factor=POLL_BACKOFF_FACTOR, jitter=POLL_JITTER):
+        super(Poller, self).__init__()
+
+        self._initial_seconds = initialSeconds
+        self._max_seconds = maxSeconds
+        self._factor = factor
+        self._jitter = jitter
+        self._cond = threading.Condition()
+        # heap of (due time, sequence number, watch) to check next
+        self._due = []
+        self._seq = itertools.count()
+        self._thread = None
+
+    # Starts watching something. check is called (from the poller's thread)
+    # with no arguments each time it is due, and returns (done, result).
+    # Returns a Future that gets the result once check says it is done, or
+    # the exception if check raises one.
+    def watch(self, check):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        w = _Watch(check, future, self._initial_seconds)
+        with self._cond:
+            self._schedule(w, w._delay)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="poller", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    # Returns how many things are being watched.
+    def pending(self):
+        with self._cond:
+            return len(self._due)
+
+    def _schedule(self, w, delay):
+        jittered = delay * random.uniform(1.0 - self._jitter, 1.0 + self._jitter)
+        heapq.heappush(self._due, (time.monotonic() + jittered, next(self._seq), w))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._due or self._due[0][0] > time.monotonic():
+                    timeout = None if not self._due else self._due[0][0] - time.monotonic()
+                    self._cond.wait(timeout)
+                _, _, w = heapq.heappop(self._due)
+            try:
+                done, result = w._check()
+            except Exception as e:
+                w._future.set_exception(e)
+                continue
+            if done:
+                w._future.set_result(result)
+                continue
+            w._delay = min(self._max_seconds, w._delay * self._factor)
+            with self._cond:
+                self._schedule(w, w._delay)
+
+class _Watch:
+
+    def __init__(self, check, future, delay):
+        super(_Watch, self).__init__()
+
+        self._check = check
+        self._future = future
+        self._delay = delay
+
+_poller = None
+_poller_lock = threading.Lock()
+
+# Returns the Poller shared by everything in this process.
+def getPoller():
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = Poller()
+        return _poller
+
+# Returns a Future that is already done, with result; for a start...
+# function that has nothing to wait for (e.g. because it failed early).
+def completed(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+# Returns a Future that gets the result of calling fn with future (once
+# future is done), or the exception if fn raises one. Lets a runner do
+# something with the result of a watched upload or job, e.g. advance the
+# subproject's status.
+def chain(future, fn):
+    chained = Future()
+    chained.set_running_or_notify_cancel()
+    def done(f):
+        try:
+            chained.set_result(fn(f))
+        except Exception as e:
+            chained.set_exception(e)
+    future.add_done_callback(done)
+    return chained
@@ -0,0 +1,160 @@
+# SPDX-FileCopyrightText: Copyright The Linux Foundation
+# SPDX-FileType: SOURCE
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import git
+
+import datefuncs
+import gitcache
+from config import getConfigFilename, getJournalFilenames, replayJournal, ConfigJSONEncoder
+from datatypes import ProjectRepoType, Status
+
+# how many `git ls-remote` calls to have going at once
+LS_REMOTE_WORKERS = 8
+
+# Returns the parsed JSON for the project from the prior month's
+# config.json (with any journals applied), or None if there isn't one.
+def getPriorMonthProject(cfg, prj):
+    year, month = datefuncs.parseYM(cfg._month)
+    if year == 0 or month == 0:
+        return None
+    priorYM = datefuncs.getYMStr(*datefuncs.priorMonth(year, month))
+    priorConfigFilename = getConfigFilename(cfg._storepath, priorYM)
+    try:
+        with open(priorConfigFilename, 'r') as f:
+            js = json.load(f)
+    except (OSError, json.decoder.JSONDecodeError):
+        return None
+    for journalFilename in getJournalFilenames(cfg._storepath, priorYM):
+        replayJournal(js, journalFilename, js.get('config', {}).get('version', -1))
+    return js.get('projects', {}).get(prj._name, None)
+
+# Returns the commit hash that each repo's branch (or default branch) points
+# to now, looking them up concurrently. Repos that can't be looked up are
+# left out.
+def getRemoteHeads(prj, sp):
+    def lsRemote(repo):
+        ref = f"refs/heads/{sp._github_branch}" if sp._github_branch != "" else "HEAD"
+        try:
+            output = git.Git().ls_remote(gitcache.getRepoURL(prj, sp, repo), ref)
+        except git.GitCommandError:
+            return repo, None
+        for line in output.splitlines():
+            commit, _, name = line.partition("\t")
+            if name == ref:
+                return repo, commit
+        return repo, None
+
+    with ThreadPoolExecutor(max_workers=LS_REMOTE_WORKERS) as executor:
+        results = list(executor.map(lsRemote, sp._repos))
+    return {repo: commit for repo, commit in results if commit is not None}
+
+# Returns a dict of repo name => commit hash for the subproject's repos
+# whose remote branch still points at the commit pulled last month.
+def findUnchangedRepos(prj, sp, prior_sp):
+    if prior_sp is None:
+        return {}
+    prior_repos = prior_sp.get('code', {}).get('repos', {})
+    if prior_repos == {}:
+        return {}
+    heads = getRemoteHeads(prj, sp)
+    return {repo: commit for repo, commit in heads.items() if prior_repos.get(repo, None) == commit}
+
+# Hard links src to dst if possible (e.g. on the same filesystem), and
+# copies it otherwise.
+def linkOrCopy(src, dst):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+# If none of the subproject's repos have changed since last month, and last
+# month's run got as far as parsing the SPDX file, reuses last month's zip,
+# SPDX file and (if the project's SLM config hasn't changed) SLM JSON
+# instead of pulling, uploading, scanning and clearing the code again.
+# The Fossology upload is not copied to this month's folder, since nothing
+# after GOTSPDX needs it. The subproject's code state records which month
+# was reused, so that it is clear why those stages were skipped. Returns
+# True if the subproject was advanced.
+def reusePriorMonth(cfg, prj, sp, prior_prj, unchanged):
+    prior_sp = prior_prj.get('subprojects', {}).get(sp._name, None)
+    if prior_sp is None or sorted(unchanged.keys()) != sorted(sp._repos):
+        return False
+    try:
+        prior_status = Status[prior_sp.get('status', "UNKNOWN")]
+    except KeyError:
+        return False
+    if prior_status.value < Status.PARSEDSPDX.value or prior_status == Status.STOPPED:
+        return False
+    prior_code = prior_sp.get('code', {})
+    if not prior_code.get('anyfiles', False):
+        return False
+
+    # find last month's files
+    year, month = datefuncs.parseYM(cfg._month)
+    priorYM = datefuncs.getYMStr(*datefuncs.priorMonth(year, month))
+    prior_pulled = prior_code.get('pulled', "")
+    prior_zip = prior_code.get('path', "")
+    prior_spdx = os.path.join(cfg._storepath, priorYM, "spdx", prj._name, f"{sp._name}-{prior_pulled}.spdx")
+    prior_json = prior_sp.get('slm', {}).get('report-json', "")
+    for path in [prior_zip, prior_spdx]:
+        if path == "" or not os.path.isfile(path):
+            return False
+
+    # and put copies where this month's would go
+    today = datetime.today().strftime("%Y-%m-%d")
+    sp_path = os.path.join(cfg._zippath, cfg._month, "code", prj._name, sp._name)
+    if sp._repotype == ProjectRepoType.GITHUB:
+        ziporg_path = os.path.join(sp_path, sp._github_ziporg)
+    else:
+        ziporg_path = os.path.join(sp_path, sp._name)
+    zf_path = os.path.join(sp_path, f"{ziporg_path}-{today}.zip")
+    spdx_path = os.path.join(cfg._storepath, cfg._month, "spdx", prj._name, f"{sp._name}-{today}.spdx")
+    print(f"{prj._name}/{sp._name}: no repos changed since {priorYM}; reusing its code and scan results, and skipping the WhiteSource upload and the Fossology upload, scanning and clearing")
+    linkOrCopy(prior_zip, zf_path)
+    linkOrCopy(prior_spdx, spdx_path)
+    sp._code_pulled = today
+    sp._code_path = zf_path
+    sp._code_anyfiles = True
+    sp._code_repos = dict(unchanged)
+    sp._code_sha256 = prior_code.get('sha256', "")
+    sp._code_manifest_sha256 = prior_code.get('manifest-sha256', "")
+    sp._code_reused_from = priorYM
+
+    # the SLM JSON depends on the project's policies, so only reuse it if
+    # they haven't changed; otherwise parse the reused SPDX file again
+    current_slm = json.loads(json.dumps(ConfigJSONEncoder().default(prj)["slm"], cls=ConfigJSONEncoder))
+    prior_policy = prior_sp.get('slm', {}).get('policy', "")
+    if prior_json != "" and os.path.isfile(prior_json) and prior_prj.get('slm', None) == current_slm and prior_policy == sp._slm_policy_name:
+        json_path = os.path.join(cfg._storepath, cfg._month, "report", prj._name, f"{sp._name}-{today}.json")
+        linkOrCopy(prior_json, json_path)
+        sp._slm_report_json = json_path
+        sp._slm_pending_lics = []
+        sp._status = Status.PARSEDSPDX
+    else:
+        sp._status = Status.GOTSPDX
+    return True
+
+# Called before getting a subproject's code. Returns (True, unchanged) if
+# last month's results were reused and the subproject was advanced, or
+# (False, unchanged) if its code still needs to be pulled, where unchanged
+# is the dict of repos that haven't changed (and so don't need fetching).
+def checkPriorMonth(cfg, prj, sp):
+    if not cfg._reuse_unchanged:
+        return False, {}
+    prior_prj = getPriorMonthProject(cfg, prj)
+    if prior_prj is None:
+        return False, {}
+    unchanged = findUnchangedRepos(prj, sp, prior_prj.get('subprojects', {}).get(sp._name, None))
+    if unchanged == {}:
+        return False, unchanged
+    return reusePriorMonth(cfg, prj, sp, prior_prj, unchanged), unchanged
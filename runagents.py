@@ -4,21 +4,32 @@
 
 import os
 import copy
+from concurrent.futures import Future
 from pathlib import Path
 
+import requests
+from fossology.obj import Job
+
 from datatypes import Status, ProjectRepoType
 from datefuncs import parseYM, priorMonth, getYMStr
+from fossologyindex import getFossologyIndex
+from poller import chain, completed, getPoller
+from uploadcode import RETRY_STATUS_CODES
+
+# Fossology job statuses that mean the job hasn't finished yet
+JOB_RUNNING_STATUSES = ["Queued", "Processing"]
+# how many checks of a running job between messages saying we're still
+# waiting
+CHECKS_BETWEEN_MESSAGES = 10
+# how many checks of a job in a row can fail to connect, or get a status
+# code that means it might work next time, before giving up on the job
+JOB_CHECK_RETRIES = 4
 
 def getUploadFolder(fossologyServer, uploadFolderName):
     ''' Gets the prior upload folder searching all folders for a matching name
         returns None if no upload or priorUploadFolder exists
     '''
-    folder = None
-    for fossFolder in fossologyServer.list_folders():
-        if fossFolder.name == uploadFolderName:
-            folder = fossFolder
-            break
-    return folder
+    return getFossologyIndex(fossologyServer).getFolder(uploadFolderName)
     
 def getUpload(fossologyServer, uploadFolder, uploadNameFragment):
     '''
@@ -26,11 +37,7 @@ def getUpload(fossologyServer, uploadFolder, uploadNameFragment):
     '''
     if not uploadFolder:
         return None
-    uploads = fossologyServer.list_uploads(folder=uploadFolder)[0]
-    for upload in uploads:
-        if upload.uploadname.lower().startswith(uploadNameFragment.lower()):
-            return upload
-    return None     # Didn't find it
+    return getFossologyIndex(fossologyServer).getUpload(uploadFolder, uploadNameFragment)
 
 def uploadExists(fossologyServer, priorUploadFolder, uploadNameFragment):
     folder = priorUploadFolder
@@ -43,7 +50,49 @@ def uploadExists(fossologyServer, priorUploadFolder, uploadNameFragment):
     else:
         return False
 
+# Starts watching (with the shared Poller) for a scanning job to finish.
+# Returns a Future that gets the job, with its final status, once it is no
+# longer queued or processing. A check that fails to connect, or gets a
+# status code that means it might work next time, is tried again at the
+# next check, unless JOB_CHECK_RETRIES checks in a row have failed.
+def watchJob(fossologyServer, job, name):
+    counts = {"checks": 0, "errors": 0}
+    def check():
+        try:
+            response = fossologyServer.session.get(f"{fossologyServer.api}/jobs/{job.id}")
+            error = None if response.status_code not in RETRY_STATUS_CODES else f"status code {response.status_code}"
+        except requests.exceptions.RequestException as ex:
+            error = str(ex)
+        if error is not None:
+            counts["errors"] += 1
+            if counts["errors"] > JOB_CHECK_RETRIES:
+                raise Exception(f"Error checking scan job {job.id} for {name} after {counts['errors']} attempts: {error}")
+            print(f"{name}: Error checking scan job {job.id} ({error}); will retry")
+            return False, None
+        counts["errors"] = 0
+        if response.status_code != 200:
+            raise Exception(f"Error checking scan job {job.id} for {name}: status code {response.status_code}")
+        detail = Job.from_json(response.json())
+        if detail.status not in JOB_RUNNING_STATUSES:
+            return True, detail
+        counts["checks"] += 1
+        if counts["checks"] % CHECKS_BETWEEN_MESSAGES == 0:
+            print(f"{name}: Waiting for scan completion...")
+        return False, None
+    if job.status not in JOB_RUNNING_STATUSES:
+        future = Future()
+        future.set_result(job)
+        return future
+    return getPoller().watch(check)
+
 def doRunAgentsForSubproject(cfg, fossologyServer, prj, sp):
+    return startRunAgentsForSubproject(cfg, fossologyServer, prj, sp).result()
+
+# Like doRunAgentsForSubproject, but returns a Future (see poller.py) for
+# its result as soon as the scanning job has been scheduled, which is done
+# once the job finishes. The Future is already done if there was nothing
+# to wait for.
+def startRunAgentsForSubproject(cfg, fossologyServer, prj, sp):
     year, month = parseYM(cfg._month)
 
     uploadName = os.path.basename(sp._code_path)
@@ -51,18 +100,18 @@ def doRunAgentsForSubproject(cfg, fossologyServer, prj, sp):
 
     if uploadName == "":
         print(f"{prj._name}/{sp._name}: no code path in config, so no upload name; not running agents")
-        return False
+        return completed(False)
 
     # run nomos and monk
     print(f"{prj._name}/{sp._name}: running nomos and monk")
     uploadFolder = getUploadFolder(fossologyServer, uploadFolderName)
     if not uploadFolder:
         print(f"{prj._name}/{sp._name}: Upload folder not found")
-        return False
+        return completed(False)
     upload = getUpload(fossologyServer, uploadFolder, uploadName)
     if not upload:
         print(f"{prj._name}/{sp._name}: Upload found")
-        return False
+        return completed(False)
         
     jobSpec = copy.deepcopy(cfg._fossology_job_spec)
     # run reuser agent if prior upload exists, checking up to 12 prior months
@@ -122,20 +171,28 @@ def doRunAgentsForSubproject(cfg, fossologyServer, prj, sp):
         '''
     # We have everything configured, we can start the run
     try:
-        job = fossologyServer.schedule_jobs(uploadFolder, upload, jobSpec, wait=True, timeout=10)
+        job = fossologyServer.schedule_jobs(uploadFolder, upload, jobSpec)
     except Exception:
          print(f"{prj._name}/{sp._name}: Exception running scanning job - see FOSSology for details")
-         return False
-    # Poll for completion
-    while job.status == "Processing":
-        print(f"{prj._name}/{sp._name}: Waiting for scan completion...")
-        job = fossologyServer.detail_job(job.id, wait=True, timeout=30)
-    if job.status != "Completed":
-        print(f"{prj._name}/{sp._name}: Error running scanning job - see FOSSology for details")
-        return False
-    # once we get here, the agents have been run
-    sp._status = Status.RANAGENTS
-    
-    # and when we return, the runner framework should update the project's
-    # status to reflect the min of its subprojects
-    return True
+         return completed(False)
+
+    # the Poller checks for completion, so the runner can get on with other
+    # subprojects while this one is being scanned
+    pending = watchJob(fossologyServer, job, f"{prj._name}/{sp._name}")
+
+    def finish(done):
+        try:
+            job = done.result()
+        except Exception:
+            print(f"{prj._name}/{sp._name}: Exception checking scanning job - see FOSSology for details")
+            return False
+        if job.status != "Completed":
+            print(f"{prj._name}/{sp._name}: Error running scanning job - see FOSSology for details")
+            return False
+        # once we get here, the agents have been run
+        sp._status = Status.RANAGENTS
+
+        # and when we return, the runner framework should update the project's
+        # status to reflect the min of its subprojects
+        return True
+    return chain(pending, finish)
@@ -2,28 +2,17 @@
 # SPDX-FileType: SOURCE
 # SPDX-License-Identifier: Apache-2.0
 
-from datetime import datetime
-import os
-import shutil
+from concurrent.futures import as_completed
 
-from config import saveConfig, updateProjectStatusToSubprojectMin, isInThisCycle
-from datatypes import ProjectRepoType, Status, Subproject
-from repolisting import doRepoListingForProject, doRepoListingForGerritProject, doRepoListingForSubproject
-from getcode import doGetRepoCodeForSubproject, doGetRepoCodeForGerritSubproject
-from zipcode import doZipRepoCodeForSubproject, doZipRepoCodeForGerritSubproject
-from uploadws import doUploadWSForSubproject
-from uploadcode import doUploadCodeForProject, doUploadCodeForSubproject
-from runagents import doRunAgentsForSubproject
-from getspdx import doGetSPDXForSubproject
-from parsespdx import doParseSPDXForSubproject, doCreateCombinedSLMJSONForProject
-from createreports import doCreateReportForProject, doCreateReportForSubproject
-from findings import doMakeDraftFindingsIfNoneForSubproject, doMakeFinalFindingsForSubproject, doMakeDraftFindingsIfNoneForProject, doMakeFinalFindingsForProject
-from approving import doApprove
-from uploadspdx import doUploadSPDXForSubproject
-from uploadreport import doUploadReportsForSubproject, doUploadReportsForProject
-from tickets import doFileTicketsForSubproject
+from config import saveState, isInThisCycle
+from datatypes import ProjectRepoType, Status
+from scheduler import StageScheduler
+from stages import getProjectStage, getSubprojectStage, updateProjectPostSubproject
 
-def doNextThing(scaffold_home, cfg, fossologyServer, prj_only, sp_only):
+def doNextThing(scaffold_home, cfg, fossologyServer, prj_only, sp_only, jobs=1):
+    if jobs > 1:
+        doNextThingParallel(scaffold_home, cfg, fossologyServer, prj_only, sp_only, jobs)
+        return
     for prj in cfg._projects.values():
         if prj_only == "" or prj_only == prj._name:
             if isInThisCycle(cfg, prj, None):
@@ -33,6 +22,13 @@ def doNextThing(scaffold_home, cfg, fossologyServer, prj_only, sp_only):
             else:
                 print(f"{prj._name}: not in this cycle; skipping")
 
+# Runs the same steps as doNextThing, but lets a StageScheduler pick any
+# ready (subproject, stage) pair and run up to `jobs` stages of each resource
+# class at once.
+def doNextThingParallel(scaffold_home, cfg, fossologyServer, prj_only, sp_only, jobs):
+    scheduler = StageScheduler(scaffold_home, cfg, fossologyServer, jobs)
+    scheduler.run(prj_only, sp_only)
+
 # Tries to do the next thing for this project. Returns True if
 # accomplished something (meaning that we could call this again
 # and possibly do the next-next thing), or False if accomplished
@@ -50,9 +46,11 @@ def doNextThingForProject(scaffold_home, cfg, fossologyServer, prj, sp_only):
                 while retval:
                     retval = doNextThingForSubproject(scaffold_home, cfg, fossologyServer, prj, sp)
                     updateProjectPostSubproject(cfg, prj)
-                    saveConfig(scaffold_home, cfg)
+                    saveState(scaffold_home, cfg, prj, sp)
                     if retval:
                         did_something = True
+        if doBatchedStagesForProject(scaffold_home, cfg, fossologyServer, prj, sp_only):
+            did_something = True
         return did_something
 
     # if GITHUB_SHARED project, check state to decide when to go to subprojects
@@ -60,10 +58,11 @@ def doNextThingForProject(scaffold_home, cfg, fossologyServer, prj, sp_only):
         did_something = False
         retval_prj = True
         while retval_prj:
-            if prj._status == Status.START:
+            prjStage = getProjectStage(prj)
+            if prjStage is not None:
                 # get repo listing at project level and see if we're good
-                retval_prj = doRepoListingForProject(cfg, prj)
-                saveConfig(scaffold_home, cfg)
+                retval_prj = prjStage.run(cfg, fossologyServer, prj)
+                saveState(scaffold_home, cfg, prj)
                 if retval_prj:
                     did_something = True
             # elif prj._status == Status.GOTCODE:
@@ -81,10 +80,13 @@ def doNextThingForProject(scaffold_home, cfg, fossologyServer, prj, sp_only):
                         while retval:
                             retval = doNextThingForSubproject(scaffold_home, cfg, fossologyServer, prj, sp)
                             updateProjectPostSubproject(cfg, prj)
-                            saveConfig(scaffold_home, cfg)
+                            saveState(scaffold_home, cfg, prj, sp)
                             if retval:
                                 did_something = True
                                 retval_sp_all = True
+                if doBatchedStagesForProject(scaffold_home, cfg, fossologyServer, prj, sp_only):
+                    did_something = True
+                    retval_sp_all = True
                 if not retval_sp_all:
                     break
         return did_something
@@ -93,11 +95,11 @@ def doNextThingForProject(scaffold_home, cfg, fossologyServer, prj, sp_only):
         did_something = False
         retval_prj = True
         while retval_prj:
-            if prj._status == Status.START:
+            prjStage = getProjectStage(prj)
+            if prjStage is not None:
                 # get repo listing at project level and see if we're good
-                retval_prj = doRepoListingForGerritProject(cfg, prj)
-                updateProjectStatusToSubprojectMin(cfg, prj)
-                saveConfig(scaffold_home, cfg)
+                retval_prj = prjStage.run(cfg, fossologyServer, prj)
+                saveState(scaffold_home, cfg, prj)
                 if retval_prj:
                     did_something = True
             # elif prj._status == Status.GOTCODE:
@@ -115,10 +117,13 @@ def doNextThingForProject(scaffold_home, cfg, fossologyServer, prj, sp_only):
                         while retval:
                             retval = doNextThingForGerritSubproject(scaffold_home, cfg, fossologyServer, prj, sp)
                             updateProjectPostSubproject(cfg, prj)
-                            saveConfig(scaffold_home, cfg)
+                            saveState(scaffold_home, cfg, prj, sp)
                             if retval:
                                 did_something = True
                                 retval_sp_all = True
+                if doBatchedStagesForProject(scaffold_home, cfg, fossologyServer, prj, sp_only):
+                    did_something = True
+                    retval_sp_all = True
                 if not retval_sp_all:
                     break
         return did_something
@@ -131,224 +136,74 @@ def doNextThingForProject(scaffold_home, cfg, fossologyServer, prj, sp_only):
 # accomplished something (meaning that we could call this again
 # and possibly do the next-next thing), or False if accomplished
 # nothing (meaning that we probably need to intervene).
+# See stages.GITHUB_STAGES for which step runs for each status.
 def doNextThingForSubproject(scaffold_home, cfg, fossologyServer, prj, sp):
     if not isInThisCycle(cfg, prj, sp):
         print(f"{prj._name}/{sp._name}: not in this cycle; skipping")
         return False
-    status = sp._status
-    if status == Status.START:
-        # get repo listing and see if we're good
-        return doRepoListingForSubproject(cfg, prj, sp)
-    elif status == Status.GOTLISTING:
-        # get code
-        return doGetRepoCodeForSubproject(cfg, prj, sp)
-    elif status == Status.GOTCODE:
-        # delete .git folder and zip code
-        return doZipRepoCodeForSubproject(cfg, prj, sp)
-    elif status == Status.ZIPPEDCODE:
-        # upload to WhiteSource
-        return doUploadWSForSubproject(cfg, prj, sp)
-    elif status == Status.UPLOADEDWS:
-        # upload code
-        return doUploadCodeForSubproject(cfg, fossologyServer, prj, sp)
-    elif status == Status.UPLOADEDCODE:
-        # run agents
-        return doRunAgentsForSubproject(cfg, fossologyServer, prj, sp)
-    elif status == Status.RANAGENTS:
-        # needs manual clearing
-        print(f"{prj._name}/{sp._name}: status is RANAGENTS; clear in Fossology then run `clear` action")
-        return False
-    elif status == Status.CLEARED:
-        # get SPDX tag-value file
-        return doGetSPDXForSubproject(cfg, fossologyServer, prj, sp)
-    elif status == Status.GOTSPDX:
-        # parse SPDX tag-value file
-        return doParseSPDXForSubproject(cfg, prj, sp)
-    elif status == Status.PARSEDSPDX:
-        # create report for subproject
-        return doCreateReportForSubproject(cfg, prj, sp)
-    elif status == Status.CREATEDREPORTS or status == Status.MADEDRAFTFINDINGS:
-        # create draft of findings report for subproject, if none yet
-        return doMakeDraftFindingsIfNoneForSubproject(cfg, prj, sp)
-    elif status == Status.APPROVEDFINDINGS:
-        # create final draft of findings report for subproject
-        return doMakeFinalFindingsForSubproject(cfg, prj, sp)
-    elif status == Status.MADEFINALFINDINGS:
-        # upload SPDX file to GitHub org or reports folder if private
-        return doUploadSPDXForSubproject(cfg, prj, sp)
-    elif status == Status.UPLOADEDSPDX:
-        # upload findings report to unique URL
-        return doUploadReportsForSubproject(cfg, prj, sp)
-    elif status == Status.UPLOADEDREPORTS:
-        # file and update tickets for instances, if using ticket tracker
-        return doFileTicketsForSubproject(cfg, prj, sp)
-    elif status == Status.FILEDTICKETS:
-        # needs manual delivering
-        print(f"{prj._name}/{sp._name}: status is FILEDTICKETS; deliver report then run `deliver` action")
+    if sp._status in getBatchedStatuses(cfg):
+        # left for doBatchedStagesForProject
         return False
-    elif status == Status.DELIVERED:
-        # we are done
+    stage = getSubprojectStage(prj, sp)
+    if stage is None:
+        # we are done, or we aren't going any further
         return False
-    elif status == Status.STOPPED:
-        # we aren't going any further
-        return False
-
-    else:
+    return stage.run(cfg, fossologyServer, prj, sp)
+
+# Returns the statuses whose stages the sequential runner starts for all of
+# a project's subprojects at once, rather than one subproject at a time,
+# because they mostly wait for Fossology to do something: UPLOADEDCODE if
+# batchAgents is on, and CLEARED if batchReports is on.
+def getBatchedStatuses(cfg):
+    statuses = []
+    if cfg._batch_agents:
+        statuses.append(Status.UPLOADEDCODE)
+    if cfg._batch_reports:
+        statuses.append(Status.CLEARED)
+    return statuses
+
+# Starts the stage for every one of the project's subprojects whose status
+# is one of getBatchedStatuses (e.g. scheduling the Fossology agents, or
+# generating SPDX reports), all before waiting for any of them, so that
+# Fossology can work on them in parallel. Then moves each subproject on (and
+# saves the new state) as it finishes. Returns True if any of them
+# accomplished something.
+def doBatchedStagesForProject(scaffold_home, cfg, fossologyServer, prj, sp_only):
+    did_something = False
+    pending = {}
+    for sp in prj._subprojects.values():
+        if sp_only != "" and sp_only != sp._name:
+            continue
+        if sp._status not in getBatchedStatuses(cfg) or not isInThisCycle(cfg, prj, sp):
+            continue
+        stage = getSubprojectStage(prj, sp)
+        try:
+            pending[stage.start(cfg, fossologyServer, prj, sp)] = (sp, stage)
+        except Exception as e:
+            print(f"{prj._name}/{sp._name}: Exception running {stage._name}", type(e).__name__, "-", e)
+    if not pending:
         return False
 
+    print(f"{prj._name}: waiting for Fossology for {len(pending)} subprojects")
+    for future in as_completed(pending):
+        sp, stage = pending[future]
+        try:
+            retval = future.result()
+        except Exception as e:
+            print(f"{prj._name}/{sp._name}: Exception running {stage._name}", type(e).__name__, "-", e)
+            retval = False
+        with cfg._state_lock:
+            updateProjectPostSubproject(cfg, prj)
+            saveState(scaffold_home, cfg, prj, sp)
+        if retval:
+            did_something = True
+    return did_something
 
 # Tries to do the next thing for this Gerrit subproject. Returns True if
 # accomplished something (meaning that we could call this again and possibly do
 # the next-next thing), or False if accomplished nothing (meaning that we
 # probably need to intervene). Does not handle START case because that is
-# handled at the project level.
+# handled at the project level. See stages.GERRIT_STAGES for which step runs
+# for each status.
 def doNextThingForGerritSubproject(scaffold_home, cfg, fossologyServer, prj, sp):
-    if not isInThisCycle(cfg, prj, sp):
-        print(f"{prj._name}/{sp._name}: not in this cycle; skipping")
-        return False
-    status = sp._status
-    if status == Status.GOTLISTING:
-        # get code
-        return doGetRepoCodeForGerritSubproject(cfg, prj, sp)
-    elif status == Status.GOTCODE:
-        # delete .git folder and zip code
-        return doZipRepoCodeForGerritSubproject(cfg, prj, sp)
-    elif status == Status.ZIPPEDCODE:
-        # upload to WhiteSource
-        return doUploadWSForSubproject(cfg, prj, sp)
-    elif status == Status.UPLOADEDWS:
-        # upload code
-        return doUploadCodeForSubproject(cfg, fossologyServer, prj, sp)
-    elif status == Status.UPLOADEDCODE:
-        # run agents
-        return doRunAgentsForSubproject(cfg, fossologyServer, prj, sp)
-    elif status == Status.RANAGENTS:
-        # needs manual clearing
-        print(f"{prj._name}/{sp._name}: status is RANAGENTS; clear in Fossology then run `clear` action")
-        return False
-    elif status == Status.CLEARED:
-        # get SPDX tag-value file
-        return doGetSPDXForSubproject(cfg, fossologyServer, prj, sp)
-    elif status == Status.GOTSPDX:
-        # parse SPDX tag-value file
-        return doParseSPDXForSubproject(cfg, prj, sp)
-    elif status == Status.PARSEDSPDX:
-        # create report for subproject
-        return doCreateReportForSubproject(cfg, prj, sp)
-    elif status == Status.CREATEDREPORTS or status == Status.MADEDRAFTFINDINGS:
-        # create draft of findings report for subproject, if none yet
-        return doMakeDraftFindingsIfNoneForSubproject(cfg, prj, sp)
-    elif status == Status.APPROVEDFINDINGS:
-        # create final draft of findings report for subproject
-        return doMakeFinalFindingsForSubproject(cfg, prj, sp)
-    elif status == Status.MADEFINALFINDINGS:
-        # upload SPDX file to GitHub org
-        return doUploadSPDXForSubproject(cfg, prj, sp)
-    elif status == Status.UPLOADEDSPDX:
-        # upload findings report to unique URL
-        return doUploadReportsForSubproject(cfg, prj, sp)
-    elif status == Status.UPLOADEDREPORTS:
-        # file and update tickets for instances, if using ticket tracker
-        return doFileTicketsForSubproject(cfg, prj, sp)
-    elif status == Status.FILEDTICKETS:
-        # needs manual delivering
-        print(f"{prj._name}/{sp._name}: status is FILEDTICKETS; deliver report then run `deliver` action")
-        return False
-    elif status == Status.DELIVERED:
-        # we are done
-        return False
-    elif status == Status.STOPPED:
-        # we aren't going any further
-        return False
-
-    else:
-        return False
-
-# For some steps, after all subprojects have reached a particular
-# point, sometimes a step needs to be taken at the project level
-# before the status is advanced. This includes (if appropriate)
-# advancing the status of the project.
-def updateProjectPostSubproject(cfg, prj):
-    # if all subprojects have either parsed SPDX into JSON or are
-    # stopped, then we should check whether we need to prepare
-    # a combined project JSON as well
-    if prj._slm_combined_report == True and prj._status == Status.GOTSPDX:
-        readyForJSON = True
-        for sp in prj._subprojects.values():
-            if sp._status.value < Status.PARSEDSPDX.value:
-                readyForJSON = False
-                break
-        if readyForJSON:
-            # try to build the report, and exit without updating
-            # status if we fail
-            retval = doCreateCombinedSLMJSONForProject(cfg, prj)
-            if retval == False:
-                return
-
-    # if all subprojects have either created reports or are
-    # stopped, then we should check whether we need to create
-    # a combined project report as well
-    if prj._slm_combined_report == True and prj._status == Status.PARSEDSPDX:
-        readyForReport = True
-        for sp in prj._subprojects.values():
-            if sp._status.value < Status.CREATEDREPORTS.value:
-                readyForReport = False
-                break
-        if readyForReport:
-            # try to build the report, and exit without updating
-            # status if we fail
-            retval = doCreateReportForProject(cfg, prj)
-            if retval == False:
-                return
-
-    # if all subprojects have either created draft findings or
-    # are stopped, then we should check whether we need to create
-    # combined draft project findings as well
-    elif prj._slm_combined_report == True and (prj._status == Status.CREATEDREPORTS or prj._status == Status.MADEDRAFTFINDINGS):
-        readyForDraftFindings = True
-        for sp in prj._subprojects.values():
-            if sp._status.value < Status.MADEDRAFTFINDINGS.value:
-                readyForDraftFindings = False
-                break
-        if readyForDraftFindings:
-            # try to build the report, and exit without updating
-            # status if we fail
-            retval = doMakeDraftFindingsIfNoneForProject(cfg, prj)
-            if retval == False:
-                return
-
-    # if all subprojects have either created final findings or
-    # are stopped, then we should check whether we need to create
-    # combined final project findings as well
-    elif prj._slm_combined_report == True and prj._status == Status.APPROVEDFINDINGS:
-        readyForFinalFindings = True
-        for sp in prj._subprojects.values():
-            if sp._status.value < Status.MADEFINALFINDINGS.value:
-                readyForFinalFindings = False
-                break
-        if readyForFinalFindings:
-            # try to build the report, and exit without updating
-            # status if we fail
-            retval = doMakeFinalFindingsForProject(cfg, prj)
-            if retval == False:
-                return
-
-    # if all subprojects have finished uploading their reports or
-    # are stopped, then we should check whether we need to upload
-    # project-wide findings as well
-    elif prj._slm_combined_report == True and prj._status == Status.UPLOADEDSPDX:
-        readyForUpload = True
-        for sp in prj._subprojects.values():
-            if sp._status.value < Status.UPLOADEDREPORTS.value:
-                readyForUpload = False
-                break
-        if readyForUpload:
-            # try to upload the report, and exit without updating
-            # status if we fail
-            retval = doUploadReportsForProject(cfg, prj)
-            if retval == False:
-                return
-
-    # and, if appropriate, advance the status of the project to
-    # be the minimum of all its subprojects
-    updateProjectStatusToSubprojectMin(cfg, prj)
+    return doNextThingForSubproject(scaffold_home, cfg, fossologyServer, prj, sp)
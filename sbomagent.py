@@ -17,6 +17,7 @@ from pathlib import Path
 import uploadreport
 import uploadspdx
 from uploadspdx import doUploadToGitForSubproject
+from timings import timedSpan
 from spdx_tools.spdx.parser.error import SPDXParsingError
 
 trivyDebug = False
@@ -24,7 +25,15 @@ parlayDebug = False
 cdsbomDebug = False
 spdxV3Debug = False
 
+# Runs the SBOM tools on the subproject's code, timing each step as part of
+# an "sbom" span in the month's timings.jsonl.
 def runUnifiedAgent(cfg, prj, sp):
+    with timedSpan(cfg, "sbom", prj, sp) as span:
+        retval = runUnifiedAgentSteps(cfg, prj, sp, span)
+        span.setResult(retval)
+    return retval
+
+def runUnifiedAgentSteps(cfg, prj, sp, span):
     # make sure that the code to upload actually exists!
     if not sp._code_path:
         print(f"{prj._name}/{sp._name}: No code path found; can not run sbom")
@@ -37,13 +46,16 @@ def runUnifiedAgent(cfg, prj, sp):
         return False
     with tempfile.TemporaryDirectory() as tempdir:
         # Unzip file to a temporary directory
+        span.step("unzip")
         print(f"{prj._name}/{sp._name} [{datetime.now()}]: Unzipping project files")
         analysisdir = os.path.join(tempdir, "code")
         os.mkdir(analysisdir)
         with zipfile.ZipFile(sp._code_path, mode='r') as zip:
             zip.extractall(analysisdir)
+        span.step("npm")
         print(f"{prj._name}/{sp._name} [{datetime.now()}]: Looking for NPM projects to install")
         installNpm(analysisdir, cfg, prj, sp)
+        span.step("trivy")
         print(f"{prj._name}/{sp._name} [{datetime.now()}]: Running Trivy")
         if trivyDebug:
             trivy_cmd = [cfg._trivy_exec_path, "fs", "--timeout", "840m", "--debug", "--scanners", "license", "--format", "spdx-json", analysisdir]
@@ -73,6 +85,7 @@ errors:
             parlay_result = os.path.join(Path.home(), f"{prj._name}-{sp._name}-parlay-spdx.json")
         else:
             parlay_result = os.path.join(tempdir, f"{prj._name}-{sp._name}-parlay-spdx.json")
+        span.step("parlay")
         print(f"{prj._name}/{sp._name} [{datetime.now()}]: Running Parlay")
         parlay_cmd = [cfg._parlay_exec_path, "ecosystems", "enrich", str(trivy_result)]
         with open(parlay_result, 'w') as outfile:
@@ -92,6 +105,7 @@ errors:
             result = os.path.join(Path.home(), f"{prj._name}-{sp._name}-cdsbom-spdx.json")
         else:
             result = os.path.join(tempdir, f"{prj._name}-{sp._name}-cdsbom-spdx.json")
+        span.step("cdsbom")
         print(f"{prj._name}/{sp._name} [{datetime.now()}]: Running cdsbom")
         cdsbom_cmd = [cfg._cdsbom_exec_path, "-out", str(result), str(parlay_result)]
         cp = run(cdsbom_cmd, stdout=PIPE, stderr=PIPE, universal_newlines=True)
@@ -113,11 +127,13 @@ errors:
         except SPDXParsingError:
             print(f"{prj._name}/{sp._name}: unable to parse Parlay augmented SPDX document")
             return False
+        span.step("augment")
         print(f"{prj._name}/{sp._name} [{datetime.now()}]: Augmenting SPDX document")
         spdx.spdxutil.augmentTrivyDocument(spdxDocument, cfg, prj, sp)
         uploadSpdxFileName = f"{sp._name}-{sp._code_pulled}-{uploadspdx.UPLOAD_SPDX_SUFFIX}.{uploadspdx.JSON_EXTENSION}"
         uploadSpdxFile = os.path.join(tempdir, uploadSpdxFileName)
         spdx.spdxutil.writeFile(spdxDocument, uploadSpdxFile)
+        span.step("spdxv3")
         print(f"{prj._name}/{sp._name} [{datetime.now()}]: Creating SPDX 3 document")
         uploadSpdxV3FileName = f"{sp._name}-{sp._code_pulled}-{uploadspdx.UPLOAD_SPDX_V3_SUFFIX}.{uploadspdx.JSON_EXTENSION}"
         if spdxV3Debug:
@@ -136,6 +152,7 @@ errors:
             if Path(uploadSpdxV3File).is_file():
                 os.remove(uploadSpdxV3File)
 
+        span.step("merge")
         print(f"{prj._name}/{sp._name} [{datetime.now()}]: Merging SPDX documents")
         mergedSbom = mergeSourceAndSbom(cfg, prj, sp, tempdir, spdxDocument)
         if mergedSbom:
@@ -164,6 +181,7 @@ errors:
             uploadMergedSbomV3File = None
 
         # Upload the documents
+        span.step("upload")
         print(f"{prj._name}/{sp._name} [{datetime.now()}]: Uploading SBOMs")
         if not uploadspdx.doUploadFileForSubproject(cfg, prj, sp, tempdir, uploadspdx.UPLOAD_SPDX_SUFFIX, uploadspdx.JSON_EXTENSION):
             print(f"{prj._name}/{sp._name}: unable to upload SPDX dependencies file")
@@ -190,6 +208,7 @@ errors:
                 return False
         else:
             print(f"{prj._name}/{sp._name}: no merged SPDX V3 SBOM file to upload")
+        span.step("xlsx")
         workbook = spdx.xlsx.makeXlsx(spdxDocument)
         workbookSuffix = "dependencies"
         workbookExtension = "xlsx"
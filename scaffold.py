@@ -10,15 +10,13 @@ import sys
 
 from tabulate import tabulate
 
-from fossology import fossology_token, Fossology
-from fossology.obj import TokenScope
-
-
-from config import loadConfig, saveBackupConfig, saveConfig, isInThisCycle, updateFossologyToken
+# Only lightweight modules are imported here. Modules that pull in heavy
+# dependencies (fossology, git, jira, openpyxl, jinja2, spdx_tools) are
+# imported in the commands that need them, so that commands like `status`
+# start quickly. tests/testimporttime.py checks that this stays true.
+from datatypes import Status
+from config import loadConfig, saveBackupConfig, saveConfig, isCycleInMonth, isInThisCycle, updateFossologyToken
 import datefuncs
-from runners import doNextThing
-from manualws import runManualWSAgent
-from manualsbom import runManualSbomAgent
 from clearing import doCleared
 from newmonth import copyToNextMonth
 from approving import doApprove
@@ -26,15 +24,14 @@ from emailing import printEmail, printAllLinks, printReportLinks
 from delivering import doDelivered
 from metrics import getMetrics, printMetrics
 from metricsfile import saveMetrics
-from transfer import doTransfer
-from datetime import datetime
+from timings import printProfile
+from locking import ScaffoldLock, clearLock
+from util import wait_for_deletions
 from secrets import token_urlsafe
 
-LOCK_FILE_NAME = "lock.lock"
-
 def printUsage():
     print(f"""
-Usage: {sys.argv[0]} <month> <command> [<project>] [<subproject>]
+Usage: {sys.argv[0]} <month> <command> [<options>] [<project>] [<subproject>]
 Month: in format YYYY-MM
 
 Commands:
@@ -42,6 +39,7 @@ Commands:
   Running:
     newmonth:         Begin a new month and reset status for all projects
     run:              Run next steps for all subprojects
+                      --jobs N: advance up to N subprojects concurrently (default 1)
     clear:            Flag cleared in Fossology for [sub]project
     approve:          Flag approved auto-generated findings in report for [sub]project
     deliver:          Flag delivered report for [sub]project
@@ -59,14 +57,20 @@ Commands:
   Metrics:
     getmetrics:       Analyze and save metrics for overall current status to JSON file
     printmetrics:     Load and print metrics from JSON file
+    profile:          Print time and resources used by each stage, for [sub]project
 
   Admin:
     transfer:         Transfer project scans from old Fossology server to new.  New server is in default .scaffold-secrets.json, old server is in .scaffold-secrets-old.json
-    clearlock:        Clear the lock file
+    clearlock:        Clear the lock file for the month, or for [project]
+    compact:          Save any journaled status changes into config.json
 
 """)
 
 def status(cfg, prj_only, sp_only):
+    if cfg._statedb is not None:
+        statusFromStateDB(cfg, prj_only, sp_only)
+        return
+
     headers = ["Project", "Subproject", "Status", "Notes"]
     table = []
     projects = cfg._projects
@@ -88,11 +92,39 @@ def status(cfg, prj_only, sp_only):
 
     table = sorted(table, key=itemgetter(0, 1))
     print(tabulate(table, headers=headers))
+
+# Like status, but reads the state database's rows rather than needing the
+# projects to be loaded.
+def statusFromStateDB(cfg, prj_only, sp_only):
+    headers = ["Project", "Subproject", "Status", "Notes"]
+    table = []
+    statedb = cfg._statedb
+
+    prj_cycles = {}
+    for prj_name, prj_status in statedb.listProjects(prj_only):
+        table.append([prj_name, "", prj_status or Status.UNKNOWN.name, ""])
+        prj_cycles[prj_name] = statedb.getProjectState(prj_name).get("cycle", 99)
+    for prj_name, sp_name, sp_status in statedb.listSubprojects(prj_only):
+        if sp_only == "" or sp_only == sp_name:
+            sp_state = statedb.getSubprojectState(prj_name, sp_name)
+            extras = []
+            if not isCycleInMonth(sp_state.get("cycle", prj_cycles.get(prj_name, 99)), cfg._month):
+                extras.append(f"off-cycle")
+            branch = sp_state.get("github", {}).get("branch", "")
+            if branch != "":
+                extras.append(f"branch: {branch}")
+            table.append([prj_name, sp_name, sp_status, ";".join(extras)])
+
+    table = sorted(table, key=itemgetter(0, 1))
+    print(tabulate(table, headers=headers))
     
 def generateFossologyToken(secrets, secrets_file_name):
     '''
     Generates a FOSSOlogy token and stores it in the secrets file
     '''
+    from fossology import fossology_token
+    from fossology.obj import TokenScope
+
     expire = date.today() + timedelta(days=30)
     try:
         token = fossology_token(
@@ -114,6 +146,8 @@ def generateFossologyToken(secrets, secrets_file_name):
     return token
 
 def fossologySetup(secrets, secrets_file_name):
+    from fossology import Fossology
+
     token = secrets._fossology_token
     if not token or not secrets._fossology_token_expiration or secrets._fossology_token_expiration < date.today() + timedelta(days=2):
         token = generateFossologyToken(secrets, secrets_file_name)
@@ -132,40 +166,92 @@ def fossologySetup(secrets, secrets_file_name):
             return None
     return server
 
-def lockfile(config_dir):
-    ''' Lock the lockfile for the month
-    config_dir - directory for the month containing the configuration file
-    Returns true if the month was successfully locked or false if the month is already locked
+# commands that only read the config, and so don't need a lock
+READ_ONLY_COMMANDS = ["status", "printemail", "printlinks", "printreportlinks", "printmetrics", "profile"]
+# commands that only read state, and so can query the state database (if
+# in use) rather than loading every project
+STATE_QUERY_COMMANDS = ["status", "printlinks", "printreportlinks", "getmetrics"]
+# commands that can be limited to a single project, and so only need that
+# project's lock when one is given
+PROJECT_COMMANDS = ["run", "clear", "approve", "deliver", "ws", "sbom"]
+
+def getLock(month_dir, args):
+    '''
+    Gets the lock needed to run the command
+    month_dir - directory for the month containing the configuration file
+    args - Arguments, as passed to exec_command
+    Returns a ScaffoldLock for the project if the command is limited to one
+    project, a ScaffoldLock for the whole month for other commands, or None
+    if the command doesn't need a lock
     '''
-    
-    lockfile = os.path.join(config_dir, LOCK_FILE_NAME)
     try:
-        with open(lockfile, 'x') as f:
-            f.write('Open for lock on ')
-            f.write(str(datetime.now()))
-            return True
-    except:
-        return False
+        args, _ = parseOptions(args)
+    except ValueError:
+        # exec_command will report the problem
+        return None
+    command = args[2] if len(args) >= 3 else ""
+    if command in READ_ONLY_COMMANDS:
+        return None
+    if command in PROJECT_COMMANDS and len(args) >= 4:
+        return ScaffoldLock(month_dir, args[3])
+    return ScaffoldLock(month_dir)
 
-def unlockfile(config_dir):
-    ''' Unlocks the lockfile for the month
+def getStateOnlyOptions(args):
     '''
-    lockfile = os.path.join(config_dir, LOCK_FILE_NAME)
-    os.remove(lockfile)
-
-def clear_lock(config_dir):
+    Gets the stateOnly and prj_only arguments for loadConfig
+    args - Arguments, as passed to exec_command
+    Returns (True, project or "") if the command only reads state, or
+    (False, "") if it needs every project loaded
+    '''
+    try:
+        args, _ = parseOptions(args)
+    except ValueError:
+        # exec_command will report the problem
+        return False, ""
+    command = args[2] if len(args) >= 3 else ""
+    if command not in STATE_QUERY_COMMANDS:
+        return False, ""
+    return True, args[3] if len(args) >= 4 else ""
+
+def parseOptions(args):
     '''
-    Clears the lock file
+    Separates --option flags from the positional arguments
+    args - Arguments as passed to exec_command
+    Returns a tuple of the positional arguments and a dict of option values
+    Raises ValueError if an option is unknown or has an invalid value
     '''
-    lockfile = os.path.join(config_dir, LOCK_FILE_NAME)
-    if os.path.exists(lockfile):
-        os.remove(lockfile)
+    positional = []
+    options = {"jobs": 1}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == "--jobs" or arg.startswith("--jobs="):
+            if arg == "--jobs":
+                i += 1
+                if i >= len(args):
+                    raise ValueError("--jobs requires a number")
+                value = args[i]
+            else:
+                value = arg[len("--jobs="):]
+            try:
+                options["jobs"] = int(value)
+            except ValueError:
+                raise ValueError(f"Invalid value for --jobs: {value}")
+            if options["jobs"] < 1:
+                raise ValueError(f"Invalid value for --jobs: {value}")
+        elif arg.startswith("--"):
+            raise ValueError(f"Unknown option {arg}")
+        else:
+            positional.append(arg)
+        i += 1
+    return positional, options
 
 def exec_command(SCAFFOLD_HOME, cfg, args):
     '''
     Executes the command
     cfg - Configuration
     args - Arguments - args[1] month; args[2] command; args[3] optional project; args[4] optional subproject
+           --jobs N may appear anywhere after the command
     returns true if successful, false if not
     '''
     # we'll check if added optional args limit to one prj / sp
@@ -173,6 +259,12 @@ def exec_command(SCAFFOLD_HOME, cfg, args):
     sp_only = ""
     ran_command = False
 
+    try:
+        args, options = parseOptions(args)
+    except ValueError as e:
+        print(e)
+        return False
+
     if len(args) >= 3:
         command = args[2]
 
@@ -190,6 +282,8 @@ def exec_command(SCAFFOLD_HOME, cfg, args):
         copyToNextMonth(SCAFFOLD_HOME, cfg)
 
     elif command == "run":
+        from runners import doNextThing
+
         ran_command = True
         saveBackupConfig(SCAFFOLD_HOME, cfg)
 
@@ -200,12 +294,24 @@ def exec_command(SCAFFOLD_HOME, cfg, args):
             sys.exit(1)
 
         # run commands
-        doNextThing(SCAFFOLD_HOME, cfg, fossologyServer, prj_only, sp_only)
+        doNextThing(SCAFFOLD_HOME, cfg, fossologyServer, prj_only, sp_only, options["jobs"])
+
+        # finish deleting code trees that were moved aside while running
+        wait_for_deletions()
+
+        # save modified config file, folding in the journal
+        saveConfig(SCAFFOLD_HOME, cfg, prj_only)
 
-        # save modified config file
+    elif command == "compact":
+        ran_command = True
+
+        # loading the config already replayed the journal, so saving it
+        # folds the journal into config.json
         saveConfig(SCAFFOLD_HOME, cfg)
 
     elif command == "ws":
+        from manualws import runManualWSAgent
+
         ran_command = True
         if prj_only == "" or sp_only == "":
             print(f"ws command requires specifying project and subproject")
@@ -216,6 +322,8 @@ def exec_command(SCAFFOLD_HOME, cfg, args):
         runManualWSAgent(cfg, prj_only, sp_only)
         
     elif command == "sbom":
+        from manualsbom import runManualSbomAgent
+
         ran_command = True
         if prj_only == "":
             print(f"sbom command requires specifying project")
@@ -224,7 +332,7 @@ def exec_command(SCAFFOLD_HOME, cfg, args):
         # run sbom agent manually if between ZIPPEDCODE and CLEARED state
         # does not modify the config file
         runManualSbomAgent(cfg, prj_only, sp_only)
-        saveConfig(SCAFFOLD_HOME, cfg)
+        saveConfig(SCAFFOLD_HOME, cfg, prj_only)
 
     elif command == "clear":
         ran_command = True
@@ -234,7 +342,7 @@ def exec_command(SCAFFOLD_HOME, cfg, args):
         doCleared(SCAFFOLD_HOME, cfg, prj_only, sp_only)
 
         # save config file, even if not modified (b/c saved backup)
-        saveConfig(SCAFFOLD_HOME, cfg)
+        saveConfig(SCAFFOLD_HOME, cfg, prj_only)
 
     elif command == "approve":
         ran_command = True
@@ -244,7 +352,7 @@ def exec_command(SCAFFOLD_HOME, cfg, args):
         doApprove(SCAFFOLD_HOME, cfg, prj_only, sp_only)
 
         # save config file, even if not modified (b/c saved backup)
-        saveConfig(SCAFFOLD_HOME, cfg)
+        saveConfig(SCAFFOLD_HOME, cfg, prj_only)
 
     elif command == "printemail":
         ran_command = True
@@ -272,7 +380,7 @@ def exec_command(SCAFFOLD_HOME, cfg, args):
         doDelivered(SCAFFOLD_HOME, cfg, prj_only, sp_only)
 
         # save config file, even if not modified (b/c saved backup)
-        saveConfig(SCAFFOLD_HOME, cfg)
+        saveConfig(SCAFFOLD_HOME, cfg, prj_only)
 
     elif command == "getmetrics":
         ran_command = True
@@ -280,7 +388,7 @@ def exec_command(SCAFFOLD_HOME, cfg, args):
         if not fossologyServer:
             print(f"Unable to connect to Fossology server")
             sys.exit(1)
-        all_metrics = getMetrics(cfg, fossologyServer)
+        all_metrics = getMetrics(cfg, fossologyServer, SCAFFOLD_HOME)
 
         metricsFilename = os.path.join(cfg._storepath, cfg._month, "metrics.json")
         saveMetrics(metricsFilename, all_metrics)
@@ -290,7 +398,15 @@ def exec_command(SCAFFOLD_HOME, cfg, args):
         metricsFilename = os.path.join(cfg._storepath, cfg._month, "metrics.json")
         printMetrics(metricsFilename)
 
+    elif command == "profile":
+        ran_command = True
+
+        # summarize timings.jsonl, slowest stages first
+        printProfile(cfg, prj_only, sp_only)
+
     elif command == "transfer":
+        from transfer import doTransfer
+
         print("Not upgraded for the new FOSSOlogy Python scripts")
         sys.exit(1)
         
@@ -333,23 +449,26 @@ if __name__ == "__main__":
     MONTH_DIR = os.path.join(SCAFFOLD_HOME, datefuncs.getYMStr(year, month))
 
     if sys.argv[2] == "clearlock":
-        clear_lock(MONTH_DIR)
+        clearLock(MONTH_DIR, sys.argv[3] if len(sys.argv) >= 4 else "")
     else:
-        # load configuration file for this month
-        cfg_file = os.path.join(MONTH_DIR, "config.json")
-        cfg = loadConfig(cfg_file, SCAFFOLD_HOME)
-        ran_command = False
-        if lockfile(MONTH_DIR):
-            try:
-                ran_command = exec_command(SCAFFOLD_HOME, cfg, sys.argv)
-            finally:
-                unlockfile(MONTH_DIR)
-        else:
-            print("""
-It looks like Scaffold is already running for this month.
+        lock = getLock(MONTH_DIR, sys.argv)
+        if lock is not None and not lock.acquire():
+            print(f"""
+It looks like Scaffold is already running for {lock.describe()}.
 If you are Absolutely sure scaffold is Not being run by another user,
 you can run the 'clearlock' command to remove the lock file.
             """)
+            sys.exit(1)
+        try:
+            # load configuration file for this month, once we hold the lock
+            # so that nobody else is changing our part of it
+            cfg_file = os.path.join(MONTH_DIR, "config.json")
+            stateOnly, prj_only = getStateOnlyOptions(sys.argv)
+            cfg = loadConfig(cfg_file, SCAFFOLD_HOME, stateOnly=stateOnly, prj_only=prj_only)
+            ran_command = exec_command(SCAFFOLD_HOME, cfg, sys.argv)
+        finally:
+            if lock is not None:
+                lock.release()
         if not ran_command:
             printUsage()
-            sys.exit(1) 
+            sys.exit(1)
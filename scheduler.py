@@ -0,0 +1,158 @@
+# SPDX-FileCopyrightText: Copyright The Linux Foundation
+# SPDX-FileType: SOURCE
+# SPDX-License-Identifier: Apache-2.0
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from config import saveState, isInThisCycle
+from stages import RESOURCES, getProjectStage, getSubprojectStage, updateProjectPostSubproject
+
+# Runs stages for many subprojects at once. Each time a stage finishes, the
+# scheduler looks for any (subproject, stage) pair that is ready to run, and
+# starts it if fewer than `jobs` stages of the same resource class are
+# already running. So, e.g., one subproject's code can be cloned and zipped
+# while other subprojects are waiting on Fossology.
+#
+# A subproject only ever has one stage running at a time, and a project's
+# subprojects wait while a project-level stage (e.g. Gerrit repo listing)
+# runs. Project-level barriers (combined reports) and saving the new
+# state happen in the scheduling thread, holding the config's _state_lock,
+# after each stage finishes.
+#
+# Stages are started with Stage.start. One with a starter (e.g. an upload
+# that the Poller is watching while Fossology unpacks it) gives back its
+# resource slot as soon as it has started; the subproject stays busy until
+# its Future is done, and then its result is recorded like any other
+# stage's.
+class StageScheduler:
+
+    def __init__(self, scaffold_home, cfg, fossologyServer, jobs):
+        super(StageScheduler, self).__init__()
+
+        self._scaffold_home = scaffold_home
+        self._cfg = cfg
+        self._fossology_server = fossologyServer
+        # maximum number of stages of each resource class that run at once
+        self._limits = {resource: jobs for resource in RESOURCES}
+        self._active = {resource: 0 for resource in RESOURCES}
+        # mapping of running future to (prj, sp, stage, holding), where
+        # holding is whether it still counts against its resource's limit:
+        # while holding, the future is the executor's, for Stage.start's
+        # Future; after that, it is Stage.start's Future itself. sp is None
+        # for project-level stages
+        self._running = {}
+        # (prj name, sp name) keys of projects and subprojects with a
+        # running stage; sp name is None for project-level stages
+        self._busy = set()
+        # mapping of (prj name, sp name) key to the status at which its last
+        # stage accomplished nothing. it won't be tried again unless its
+        # status changes
+        self._stalled = {}
+
+    # Runs stages until nothing else can be done for now. Returns True if
+    # any stage accomplished something.
+    def run(self, prj_only="", sp_only=""):
+        projects = []
+        for prj in self._cfg._projects.values():
+            if prj_only == "" or prj_only == prj._name:
+                if isInThisCycle(self._cfg, prj, None):
+                    projects.append(prj)
+                else:
+                    print(f"{prj._name}: not in this cycle; skipping")
+
+        did_something = False
+        workers = sum(self._limits.values())
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                for prj, sp, stage in self.getReadyStages(projects, sp_only):
+                    if self._active[stage._resource] < self._limits[stage._resource]:
+                        self._submit(executor, prj, sp, stage)
+                if not self._running:
+                    break
+                done, _ = wait(list(self._running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if self._complete(future):
+                        did_something = True
+        return did_something
+
+    # Returns a list of (prj, sp, stage) tuples that could be started now,
+    # ignoring resource limits. sp is None for project-level stages.
+    def getReadyStages(self, projects, sp_only=""):
+        ready = []
+        for prj in projects:
+            prjKey = (prj._name, None)
+            if prjKey in self._busy:
+                continue
+            prjStage = getProjectStage(prj)
+            if prjStage is not None:
+                # subprojects wait for the project stage, and the project
+                # stage waits for any subproject stages still running
+                if self._stalled.get(prjKey, None) == prj._status:
+                    continue
+                if any(key[0] == prj._name for key in self._busy):
+                    continue
+                ready.append((prj, None, prjStage))
+                continue
+
+            for sp in prj._subprojects.values():
+                if sp_only != "" and sp_only != sp._name:
+                    continue
+                spKey = (prj._name, sp._name)
+                if spKey in self._busy or self._stalled.get(spKey, None) == sp._status:
+                    continue
+                if not isInThisCycle(self._cfg, prj, sp):
+                    print(f"{prj._name}/{sp._name}: not in this cycle; skipping")
+                    self._stalled[spKey] = sp._status
+                    continue
+                stage = getSubprojectStage(prj, sp)
+                if stage is None:
+                    # we are done, or we aren't going any further
+                    self._stalled[spKey] = sp._status
+                    continue
+                if stage.isManual():
+                    # tell the user what to do, but there's nothing to run
+                    stage.run(self._cfg, self._fossology_server, prj, sp)
+                    self._stalled[spKey] = sp._status
+                    continue
+                ready.append((prj, sp, stage))
+        return ready
+
+    def _submit(self, executor, prj, sp, stage):
+        key = (prj._name, None if sp is None else sp._name)
+        future = executor.submit(stage.start, self._cfg, self._fossology_server, prj, sp)
+        self._running[future] = (prj, sp, stage, True)
+        self._busy.add(key)
+        self._active[stage._resource] += 1
+
+    # Records the result of a finished stage, runs any project-level
+    # barriers it unblocked and saves the new state. Returns the stage's result.
+    def _complete(self, future):
+        prj, sp, stage, holding = self._running.pop(future)
+        key = (prj._name, None if sp is None else sp._name)
+        if holding:
+            self._active[stage._resource] -= 1
+        name = prj._name if sp is None else f"{prj._name}/{sp._name}"
+
+        try:
+            if holding:
+                started = future.result()
+                if not started.done():
+                    # still waiting on something remote; keep it busy, but
+                    # free up its resource slot for another stage
+                    self._running[started] = (prj, sp, stage, False)
+                    return False
+                future = started
+            retval = future.result()
+        except Exception as e:
+            print(f"##### {name}: Exception running {stage._name}", type(e).__name__, "-", e)
+            retval = False
+        self._busy.discard(key)
+
+        with self._cfg._state_lock:
+            if sp is not None:
+                updateProjectPostSubproject(self._cfg, prj)
+            saveState(self._scaffold_home, self._cfg, prj, sp)
+
+        if not retval:
+            self._stalled[key] = prj._status if sp is None else sp._status
+        return retval
@@ -2,6 +2,9 @@
 # SPDX-License-Identifier: Apache-2.0
 
 class ParsedFileData:
+    # one of these is made for every file in the SPDX document
+    __slots__ = ("path", "license", "md5", "sha1", "sha256", "finding_extensions", "finding_thirdparty", "finding_emptyfile")
+
     def __init__(self):
         super(ParsedFileData, self).__init__()
         self.path = ""
@@ -15,6 +18,9 @@ class ParsedFileData:
         self.finding_emptyfile = ""
 
 class TVParser:
+    # Tags that the parser does anything with; a TVReader can skip the rest
+    TAGS = {"FileName", "LicenseConcluded", "FileChecksum"}
+
     # Possible parser state values
     # ready to read first file-related tag/value pair
     STATE_READY = 1
@@ -52,14 +58,31 @@ class TVParser:
 
         # record current file data record
         self.fdList.append(self.currentFileData)
-        # clean up
-        self.currentFileData = None
+        fdList = self.fdList
+        # clean up, ready for any further pairs to start afresh
+        self._reset()
         # and return file data list
-        return self.fdList
+        return fdList
 
     def isError(self):
         return self.state == self.STATE_ERROR
 
+    # Parses each of the (tag, value) pairs in turn, yielding each file's
+    # ParsedFileData as soon as it is complete, rather than keeping them
+    # all. Stops at the first error; check isError() once done.
+    def parsePairs(self, pairs):
+        for tag, value in pairs:
+            self.parseNextPair(tag, value)
+            if self.state == self.STATE_ERROR:
+                return
+            if self.fdList:
+                done = self.fdList
+                self.fdList = []
+                yield from done
+        done = self.finalize()
+        if done:
+            yield from done
+
     ##### Tag-value parsing main helper functions
 
     def _parseNextPairFromReady(self, tag, value):
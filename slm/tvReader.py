@@ -10,8 +10,12 @@ class TVReader:
     # encountered an error from which we can't recover
     STATE_ERROR = 99
 
-    def __init__(self):
+    # If tags is given, only pairs with those tags are recorded; the values
+    # of any others (including multi-line <text> values) are skipped over
+    # without being kept.
+    def __init__(self, tags=None):
         super(TVReader, self).__init__()
+        self.tags = tags
         self._reset()
 
     ##### Main tag-value reading functions
@@ -45,6 +49,20 @@ class TVReader:
     def isError(self):
         return self.state == self.STATE_ERROR
 
+    # Reads each of lines in turn, yielding each (tag, value) pair as soon
+    # as it has been read, rather than keeping them all. Stops at the first
+    # error; check isError() once done.
+    def readLines(self, lines):
+        for line in lines:
+            self.readNextLine(line)
+            if self.state == self.STATE_ERROR:
+                return
+            if self.tvList:
+                pairs = self.tvList
+                self.tvList = []
+                yield from pairs
+        self.finalize()
+
     ##### Tag-value reading main helper functions
 
     def _readNextLineFromReady(self, line):
@@ -70,6 +88,7 @@ class TVReader:
 
         # preceding string becomes tag
         self.currentTag = line[0:colonLoc].strip()
+        self.currentKeep = self.tags is None or self.currentTag in self.tags
 
         # subsequent string becomes value, or start of value if multi-line <text>
         lineRemainder = line[colonLoc+1:]
@@ -87,7 +106,10 @@ class TVReader:
             if endTagLoc == -1:
                 # no closing </text>, so go to multi-line reading and add a newline
                 self.state = self.STATE_MIDTEXT
-                self.currentValue += '\n'
+                if self.currentKeep:
+                    self.currentValue += '\n'
+                else:
+                    self.currentValue = ""
                 return
             else:
                 # found a closing </text>, so just one line
@@ -97,8 +119,9 @@ class TVReader:
         # if we got here, the value was a single line (maybe with opening and
         # closing <text>)
         # add to tag-value list as a tuple
-        t = (self.currentTag, self.currentValue)
-        self.tvList.append(t)
+        if self.currentKeep:
+            t = (self.currentTag, self.currentValue)
+            self.tvList.append(t)
         # and reset current tag and current value
         self._resetCurrentTagValue()
 
@@ -106,12 +129,14 @@ class TVReader:
         endTagLoc = line.find("</text>")
         if endTagLoc == -1:
             # no closing </text>, so continue multiline
-            self.currentValue += line + '\n'
+            if self.currentKeep:
+                self.currentValue += line + '\n'
         else:
             # found closing </text> so end multiline and record this tag-value
-            self.currentValue += line[0:endTagLoc]
-            t = (self.currentTag, self.currentValue)
-            self.tvList.append(t)
+            if self.currentKeep:
+                self.currentValue += line[0:endTagLoc]
+                t = (self.currentTag, self.currentValue)
+                self.tvList.append(t)
             # reset current tag and current value, and go back to ready state
             self._resetCurrentTagValue()
             self.state = self.STATE_READY
@@ -124,6 +149,7 @@ class TVReader:
         self.currentLine = 0
         self.currentTag = ""
         self.currentValue = ""
+        self.currentKeep = True
         self.errorMessage = ""
 
     def _resetCurrentTagValue(self):
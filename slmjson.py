@@ -45,7 +45,9 @@ def loadSLMCategories(prj, sp, jsonFilename):
                         if fi._path == "":
                             print(f'{prj._name}/{spname}: SLM file in license {lic._name} has no path')
                             return []
-                        fi._findings = file_dict.get("findings", {})
+                        findings = file_dict.get("findings", {})
+                        if findings:
+                            fi._findings = findings
                         lic._files.append(fi)
                     cat._licenses.append(lic)
                 categories.append(cat)
@@ -0,0 +1,104 @@
+# SPDX-FileCopyrightText: Copyright The Linux Foundation
+# SPDX-FileType: SOURCE
+# SPDX-License-Identifier: Apache-2.0
+
+import threading
+import weakref
+
+from datatypes import SLMCategory, SLMLicense
+
+# The lookups that categorizing files needs from an SLMPolicy, worked out
+# once from its category and license configs, so that categorizing each
+# file is a dictionary lookup rather than a scan of every category's
+# licenses.
+class CompiledSLMPolicy:
+
+    def __init__(self, policy):
+        super(CompiledSLMPolicy, self).__init__()
+
+        self._name = policy._name
+        # alias => license name it translates to
+        self._aliases = {}
+        # license name => (category index, license index within category)
+        # of its first appearance in the policy
+        self._license_slots = {}
+        # category names, in policy order
+        self._category_names = []
+        # license names for each category, in policy order
+        self._license_names = []
+        # names of categories whose files need review if not in a finding
+        self._flag_categories = set(policy._flag_categories)
+        # first license of each "Project Licenses" category
+        self._project_licenses = []
+
+        for catIndex, cat in enumerate(policy._category_configs):
+            self._category_names.append(cat._name)
+            self._license_names.append([lic._name for lic in cat._license_configs])
+            for licIndex, lic in enumerate(cat._license_configs):
+                self._license_slots.setdefault(lic._name, (catIndex, licIndex))
+                for a in lic._aliases:
+                    self._aliases[a] = lic._name
+            if cat._name == "Project Licenses" and len(cat._license_configs) > 0:
+                self._project_licenses.append(cat._license_configs[0]._name)
+
+    # Returns the license name that lic is an alias for, or lic itself if it
+    # isn't an alias.
+    def getLicenseForAlias(self, lic):
+        return self._aliases.get(lic, lic)
+
+    # Returns the name of the category that lic is in, or None if it isn't
+    # in any.
+    def getCategoryForLicense(self, lic):
+        slot = self._license_slots.get(lic, None)
+        if slot is None:
+            return None
+        return self._category_names[slot[0]]
+
+    # Returns the (SLMCategory, SLMLicense) in cats (as made by
+    # buildCategories) for lic, or None if it isn't in any category.
+    def getLicenseSlot(self, cats, lic):
+        slot = self._license_slots.get(lic, None)
+        if slot is None:
+            return None
+        cat = cats[slot[0]]
+        return cat, cat._licenses[slot[1]]
+
+    def isFlagCategory(self, catName):
+        return catName in self._flag_categories
+
+    # Returns a new, empty SLMCategory for each of the policy's categories,
+    # with an SLMLicense for each of its licenses, all in policy order.
+    def buildCategories(self):
+        cats = []
+        for catName, licNames in zip(self._category_names, self._license_names):
+            cat = SLMCategory()
+            cat._name = catName
+            for licName in licNames:
+                lic = SLMLicense()
+                lic._name = licName
+                cat._licenses.append(lic)
+            cats.append(cat)
+        return cats
+
+# Returns a tuple of everything in policy that CompiledSLMPolicy uses, to
+# tell whether the policy has changed since it was compiled.
+def _getPolicySignature(policy):
+    return (
+        tuple(policy._flag_categories),
+        tuple((cat._name, tuple((lic._name, tuple(lic._aliases)) for lic in cat._license_configs)) for cat in policy._category_configs),
+    )
+
+_compiled = weakref.WeakKeyDictionary()
+_compiled_lock = threading.Lock()
+
+# Returns the CompiledSLMPolicy for policy, compiling it the first time (or
+# again if the policy has changed since), so that everything categorizing
+# files for the same policy shares it.
+def getCompiledPolicy(policy):
+    signature = _getPolicySignature(policy)
+    with _compiled_lock:
+        entry = _compiled.get(policy, None)
+        if entry is None or entry[0] != signature:
+            entry = (signature, CompiledSLMPolicy(policy))
+            _compiled[policy] = entry
+        return entry[1]
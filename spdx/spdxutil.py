@@ -29,6 +29,7 @@ import spdx_tools.spdx.spdx_element_utils as spdx_element_utils
 from spdx_python_model import v3_0_1 as spdx_3_0
 from datatypes import ProjectRepoType
 from slmjson import loadSLMCategories
+from slmpolicy import getCompiledPolicy
 import re
 import os
 import json
@@ -234,11 +235,7 @@ def augmentTrivyDocument(spdx_document, cfg, prj, sp):
         except KeyError:
             print(f"{prj._name}/{sp._name}: slm policy name \"{sp._slm_policy_name}\" not defined, won't fix the Trivy SBOM")
             return False
-    subproject_licenses = []
-    for category in policy._category_configs:
-        if category._name == "Project Licenses":
-            if len(category._license_configs) > 0:
-                subproject_licenses.append(category._license_configs[0]._name)
+    subproject_licenses = list(getCompiledPolicy(policy)._project_licenses)
     try:
         subprojectDeclaredLicense = licenseStringsToExpression(subproject_licenses, spdx_document.extracted_licensing_info, licensing)
     except:
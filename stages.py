@@ -0,0 +1,236 @@
+# SPDX-FileCopyrightText: Copyright The Linux Foundation
+# SPDX-FileType: SOURCE
+# SPDX-License-Identifier: Apache-2.0
+
+from datetime import datetime
+import time
+
+from config import updateProjectStatusToSubprojectMin
+from poller import completed
+from timings import timedSpan, writeSpan
+from datatypes import ProjectRepoType, Status
+from repolisting import doRepoListingForProject, doRepoListingForGerritProject, doRepoListingForSubproject
+from getcode import doGetRepoCodeForSubproject, doGetRepoCodeForGerritSubproject
+from zipcode import doZipRepoCodeForSubproject, doZipRepoCodeForGerritSubproject
+from uploadws import doUploadWSForSubproject
+from uploadcode import doUploadCodeForSubproject, startUploadCodeForSubproject
+from runagents import doRunAgentsForSubproject, startRunAgentsForSubproject
+from getspdx import doGetSPDXForSubproject, startGetSPDXForSubproject
+from parsespdx import doParseSPDXForSubproject, doCreateCombinedSLMJSONForProject
+from createreports import doCreateReportForProject, doCreateReportForSubproject
+from findings import doMakeDraftFindingsIfNoneForSubproject, doMakeFinalFindingsForSubproject, doMakeDraftFindingsIfNoneForProject, doMakeFinalFindingsForProject
+from uploadspdx import doUploadSPDXForSubproject
+from uploadreport import doUploadReportsForSubproject, doUploadReportsForProject
+from tickets import doFileTicketsForSubproject
+
+# Resource classes for stages. The scheduler limits how many stages of each
+# class run at once, so that stages that mostly wait on a remote server can
+# overlap with stages that keep the local disk or CPU busy.
+# "io": clones and zips code on local disk
+RESOURCE_IO = "io"
+# "wait": mostly waits on a remote server (Fossology, WhiteSource, GitHub,
+# the web server)
+RESOURCE_WAIT = "wait"
+# "cpu": parses SPDX and builds reports locally
+RESOURCE_CPU = "cpu"
+RESOURCES = [RESOURCE_IO, RESOURCE_WAIT, RESOURCE_CPU]
+
+# A single step in a subproject's or project's sequence. The runner is called
+# with (cfg, prj, sp) for subproject stages, or (cfg, prj) for project stages,
+# with fossologyServer inserted after cfg if usesFossology is set. Like the
+# do... runners themselves, it returns True if it accomplished something.
+# Each run is recorded as a span in the month's timings.jsonl.
+# A stage that mostly waits on a remote server may also have a starter,
+# called with the same arguments, which starts the work and returns a
+# Future (see poller.py) for the runner's result rather than waiting; see
+# start().
+# Stages that need a person to do something first have no runner, and
+# instead tell the user which command to run.
+class Stage:
+
+    def __init__(self, name, runner, resource, usesFossology=False, manualHint="", starter=None):
+        super(Stage, self).__init__()
+
+        self._name = name
+        self._runner = runner
+        self._starter = starter
+        self._resource = resource
+        self._uses_fossology = usesFossology
+        self._manual_hint = manualHint
+
+    def isManual(self):
+        return self._runner is None
+
+    def run(self, cfg, fossologyServer, prj, sp=None):
+        if self.isManual():
+            print(f"{prj._name}/{sp._name}: status is {sp._status.name}; {self._manual_hint}")
+            return False
+        with timedSpan(cfg, self._name, prj, sp) as span:
+            retval = self._runner(*self._getArgs(cfg, fossologyServer, prj, sp))
+            span.setResult(retval)
+        return retval
+
+    # Like run(), but returns a Future for the result. If the stage has a
+    # starter, the Future is done once the work it started (e.g. a
+    # Fossology upload that the Poller is watching) finishes, so the caller
+    # can get on with something else in the meantime; otherwise the stage
+    # is run straight away, and the Future is already done.
+    def start(self, cfg, fossologyServer, prj, sp=None):
+        if self._starter is None:
+            return completed(self.run(cfg, fossologyServer, prj, sp))
+        with timedSpan(cfg, self._name, prj, sp) as span:
+            future = self._starter(*self._getArgs(cfg, fossologyServer, prj, sp))
+            span.setResult("pending")
+        # record how long it takes to finish
+        future.add_done_callback(self._recordWait(cfg, prj, sp))
+        return future
+
+    def _getArgs(self, cfg, fossologyServer, prj, sp):
+        args = [cfg]
+        if self._uses_fossology:
+            args.append(fossologyServer)
+        args.append(prj)
+        if sp is not None:
+            args.append(sp)
+        return args
+
+    def _recordWait(self, cfg, prj, sp):
+        started = datetime.now().isoformat(timespec="seconds")
+        wallStart = time.perf_counter()
+        def done(future):
+            e = future.exception()
+            writeSpan(cfg, {
+                "name": f"{self._name}-wait",
+                "parent": self._name,
+                "project": prj._name,
+                "subproject": "" if sp is None else sp._name,
+                "started": started,
+                "wall": round(time.perf_counter() - wallStart, 4),
+                "result": future.result() if e is None else f"exception: {type(e).__name__}",
+            })
+        return done
+
+# A project-level step that may only run once every subproject has reached
+# (or passed, or stopped before) subprojectStatus, while the project itself
+# is at one of projectStatuses. Only applies to projects with combined
+# reports.
+class Barrier:
+
+    def __init__(self, name, projectStatuses, subprojectStatus, action):
+        super(Barrier, self).__init__()
+
+        self._name = name
+        self._project_statuses = projectStatuses
+        self._subproject_status = subprojectStatus
+        self._action = action
+
+    def isReady(self, prj):
+        if prj._slm_combined_report != True or prj._status not in self._project_statuses:
+            return False
+        for sp in prj._subprojects.values():
+            if sp._status.value < self._subproject_status.value:
+                return False
+        return True
+
+    def run(self, cfg, prj):
+        with timedSpan(cfg, self._name, prj) as span:
+            retval = self._action(cfg, prj)
+            span.setResult(retval)
+        return retval
+
+# Gerrit projects also bring the project status up to date after listing,
+# because the listing can add or remove subprojects
+def _doRepoListingForGerritProjectAndUpdate(cfg, prj):
+    retval = doRepoListingForGerritProject(cfg, prj)
+    updateProjectStatusToSubprojectMin(cfg, prj)
+    return retval
+
+# Subproject stages for GITHUB and GITHUB_SHARED projects, keyed on the
+# status that the stage starts from
+GITHUB_STAGES = {
+    Status.START: Stage("repolisting", doRepoListingForSubproject, RESOURCE_WAIT),
+    Status.GOTLISTING: Stage("getcode", doGetRepoCodeForSubproject, RESOURCE_IO),
+    Status.GOTCODE: Stage("zipcode", doZipRepoCodeForSubproject, RESOURCE_IO),
+    Status.ZIPPEDCODE: Stage("uploadws", doUploadWSForSubproject, RESOURCE_WAIT),
+    Status.UPLOADEDWS: Stage("uploadcode", doUploadCodeForSubproject, RESOURCE_WAIT, usesFossology=True, starter=startUploadCodeForSubproject),
+    Status.UPLOADEDCODE: Stage("runagents", doRunAgentsForSubproject, RESOURCE_WAIT, usesFossology=True, starter=startRunAgentsForSubproject),
+    Status.RANAGENTS: Stage("clear", None, RESOURCE_WAIT, manualHint="clear in Fossology then run `clear` action"),
+    Status.CLEARED: Stage("getspdx", doGetSPDXForSubproject, RESOURCE_WAIT, usesFossology=True, starter=startGetSPDXForSubproject),
+    Status.GOTSPDX: Stage("parsespdx", doParseSPDXForSubproject, RESOURCE_CPU),
+    Status.PARSEDSPDX: Stage("createreports", doCreateReportForSubproject, RESOURCE_CPU),
+    Status.CREATEDREPORTS: Stage("findings", doMakeDraftFindingsIfNoneForSubproject, RESOURCE_CPU),
+    Status.MADEDRAFTFINDINGS: Stage("findings", doMakeDraftFindingsIfNoneForSubproject, RESOURCE_CPU),
+    Status.APPROVEDFINDINGS: Stage("finalfindings", doMakeFinalFindingsForSubproject, RESOURCE_CPU),
+    Status.MADEFINALFINDINGS: Stage("uploadspdx", doUploadSPDXForSubproject, RESOURCE_WAIT),
+    Status.UPLOADEDSPDX: Stage("uploadreports", doUploadReportsForSubproject, RESOURCE_WAIT),
+    Status.UPLOADEDREPORTS: Stage("filetickets", doFileTicketsForSubproject, RESOURCE_WAIT),
+    Status.FILEDTICKETS: Stage("deliver", None, RESOURCE_WAIT, manualHint="deliver report then run `deliver` action"),
+}
+
+# Subproject stages for GERRIT projects. START is handled at the project level.
+GERRIT_STAGES = dict(GITHUB_STAGES)
+del GERRIT_STAGES[Status.START]
+GERRIT_STAGES[Status.GOTLISTING] = Stage("getcode", doGetRepoCodeForGerritSubproject, RESOURCE_IO)
+GERRIT_STAGES[Status.GOTCODE] = Stage("zipcode", doZipRepoCodeForGerritSubproject, RESOURCE_IO)
+
+# Project stages that must run before any of the project's subprojects can
+# go further, keyed on project type and then the project's status
+PROJECT_STAGES = {
+    ProjectRepoType.GITHUB_SHARED: {
+        Status.START: Stage("repolisting", doRepoListingForProject, RESOURCE_WAIT),
+    },
+    ProjectRepoType.GERRIT: {
+        Status.START: Stage("repolisting", _doRepoListingForGerritProjectAndUpdate, RESOURCE_WAIT),
+    },
+}
+
+# Project steps that wait for all subprojects, in the order they are checked
+# after every subproject step. More than one may run after the same step,
+# e.g. creating the combined JSON and then the combined report.
+PROJECT_BARRIERS = [
+    Barrier("combinedjson", [Status.GOTSPDX], Status.PARSEDSPDX, doCreateCombinedSLMJSONForProject),
+    Barrier("combinedreport", [Status.PARSEDSPDX], Status.CREATEDREPORTS, doCreateReportForProject),
+    Barrier("combinedfindings", [Status.CREATEDREPORTS, Status.MADEDRAFTFINDINGS], Status.MADEDRAFTFINDINGS, doMakeDraftFindingsIfNoneForProject),
+    Barrier("combinedfinalfindings", [Status.APPROVEDFINDINGS], Status.MADEFINALFINDINGS, doMakeFinalFindingsForProject),
+    Barrier("combineduploadreports", [Status.UPLOADEDSPDX], Status.UPLOADEDREPORTS, doUploadReportsForProject),
+]
+
+def getSubprojectStages(prj):
+    if prj._repotype == ProjectRepoType.GERRIT:
+        return GERRIT_STAGES
+    elif prj._repotype == ProjectRepoType.GITHUB or prj._repotype == ProjectRepoType.GITHUB_SHARED:
+        return GITHUB_STAGES
+    else:
+        return {}
+
+# Returns the Stage to run next for this subproject, or None if there is
+# nothing left to do (e.g. DELIVERED or STOPPED).
+def getSubprojectStage(prj, sp):
+    return getSubprojectStages(prj).get(sp._status, None)
+
+# Returns the project-level Stage that must run before this project's
+# subprojects can go further, or None if there isn't one.
+def getProjectStage(prj):
+    return PROJECT_STAGES.get(prj._repotype, {}).get(prj._status, None)
+
+# For some steps, after all subprojects have reached a particular
+# point, sometimes a step needs to be taken at the project level
+# before the status is advanced. This includes (if appropriate)
+# advancing the status of the project. See PROJECT_BARRIERS
+# for the project-level steps and what they wait for. The steps are
+# tried in order, and each one that is ready is run, so if running one
+# makes the next one ready too (e.g. the subprojects are already past both),
+# both are run in the same call; otherwise bringing the project status up
+# to the subprojects' minimum below would skip the second one.
+def updateProjectPostSubproject(cfg, prj):
+    for barrier in PROJECT_BARRIERS:
+        if barrier.isReady(prj):
+            # try to run the project step, and exit without updating
+            # status if we fail
+            retval = barrier.run(cfg, prj)
+            if retval == False:
+                return
+
+    # and, if appropriate, advance the status of the project to
+    # be the minimum of all its subprojects
+    updateProjectStatusToSubprojectMin(cfg, prj)
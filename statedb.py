@@ -0,0 +1,240 @@
+# SPDX-FileCopyrightText: Copyright The Linux Foundation
+# SPDX-FileType: SOURCE
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+# how long a connection waits for another writer before giving up
+STATEDB_TIMEOUT_SECONDS = 30
+
+STATEDB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    project TEXT PRIMARY KEY,
+    status TEXT,
+    state TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS subprojects (
+    project TEXT NOT NULL,
+    subproject TEXT NOT NULL,
+    status TEXT,
+    state TEXT NOT NULL,
+    PRIMARY KEY (project, subproject)
+);
+CREATE INDEX IF NOT EXISTS subprojects_status ON subprojects (status, project);
+CREATE TABLE IF NOT EXISTS exports (
+    project TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    dirty INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# SQLite store for the mutable state of a month's projects and subprojects
+# (status, code, web URLs, pending licenses, etc.), used instead of the
+# journal when the config section sets "stateBackend": "sqlite".
+#
+# Each row holds the same JSON that config.json would have for that project
+# or subproject, so config.json stays the import / export format: loading
+# the config overlays the rows onto config.json, and saving the config
+# exports everything back to config.json. If config.json has been changed
+# since the last export (e.g. edited by hand, or by another project's run
+# merging in its state), each project whose JSON in it has changed is
+# imported, unless that project's rows have been saved since its last
+# export; the exports table keeps track of both.
+#
+# Each thread gets its own connection, so `run --jobs` workers can each
+# save rows; writers wait up to STATEDB_TIMEOUT_SECONDS for each other.
+class StateDB:
+
+    def __init__(self, filename):
+        super(StateDB, self).__init__()
+
+        self._filename = filename
+        self._local = threading.local()
+        conn = self._conn()
+        # not WAL: it relies on memory shared between the processes using
+        # the database, so it is only safe when they are all on one host,
+        # and scaffold home can be on a network filesystem shared by several
+        # operators (see locking.py), where WAL can corrupt the database
+        # without any error. A rollback journal only needs file locking.
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.executescript(STATEDB_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._filename, timeout=STATEDB_TIMEOUT_SECONDS)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def getMeta(self, key, default=None):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def setMeta(self, key, value):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    # Saves the state of one project and optionally one of its subprojects,
+    # in a single transaction. If subprojects is given instead, it is a
+    # dict of every subproject's state, and replaces all of the project's
+    # subproject rows.
+    def saveState(self, prj_name, prj_state, sp_name=None, sp_state=None, subprojects=None):
+        with self._conn() as conn:
+            self._saveProject(conn, prj_name, prj_state, subprojects)
+            if sp_name is not None:
+                self._saveSubproject(conn, prj_name, sp_name, sp_state)
+            # the rows are now newer than config.json
+            conn.execute("INSERT OR IGNORE INTO exports (project, hash, dirty) VALUES (?, '', 1)", (prj_name,))
+            conn.execute("UPDATE exports SET dirty = 1 WHERE project = ?", (prj_name,))
+
+    def _saveProject(self, conn, prj_name, prj_state, subprojects=None):
+        conn.execute("INSERT OR REPLACE INTO projects (project, status, state) VALUES (?, ?, ?)",
+            (prj_name, prj_state.get("status", None), json.dumps(prj_state)))
+        if subprojects is not None:
+            conn.execute("DELETE FROM subprojects WHERE project = ?", (prj_name,))
+            for name, state in subprojects.items():
+                self._saveSubproject(conn, prj_name, name, state)
+
+    def _saveSubproject(self, conn, prj_name, sp_name, sp_state):
+        conn.execute("INSERT OR REPLACE INTO subprojects (project, subproject, status, state) VALUES (?, ?, ?, ?)",
+            (prj_name, sp_name, sp_state.get("status", None), json.dumps(sp_state)))
+
+    # Returns a list of (project, subproject, status) tuples, optionally
+    # limited to one project and/or to subprojects with the given status
+    # names, sorted by project and subproject.
+    def listSubprojects(self, prj_name="", statuses=None):
+        query = "SELECT project, subproject, status FROM subprojects"
+        clauses = []
+        params = []
+        if prj_name != "":
+            clauses.append("project = ?")
+            params.append(prj_name)
+        if statuses is not None:
+            clauses.append(f"status IN ({','.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY project, subproject"
+        return self._conn().execute(query, params).fetchall()
+
+    # Returns a list of (project, status) tuples, optionally limited to one
+    # project, sorted by project. status is None for projects that don't
+    # have their own (e.g. GitHub projects).
+    def listProjects(self, prj_name=""):
+        query = "SELECT project, status FROM projects"
+        params = []
+        if prj_name != "":
+            query += " WHERE project = ?"
+            params.append(prj_name)
+        query += " ORDER BY project"
+        return self._conn().execute(query, params).fetchall()
+
+    # Returns the saved state dict for one project (without its subprojects
+    # or SLM policies), or None.
+    def getProjectState(self, prj_name):
+        row = self._conn().execute("SELECT state FROM projects WHERE project = ?", (prj_name,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    # Returns the saved state dict for one subproject, or None.
+    def getSubprojectState(self, prj_name, sp_name):
+        row = self._conn().execute("SELECT state FROM subprojects WHERE project = ? AND subproject = ?",
+            (prj_name, sp_name)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    # Imports the project and subproject state from the parsed JSON of
+    # config.json, and records the config.json's mtime. Only projects whose
+    # JSON has changed since they were last imported or exported are
+    # imported, and not if their rows have been saved since then (their
+    # rows are newer, so they win). Rows for projects that are no longer in
+    # config.json are removed, unless they have been saved since.
+    def importConfig(self, js, mtime):
+        projects = js.get('projects', {})
+        with self._conn() as conn:
+            exports = {prj_name: (h, dirty) for prj_name, h, dirty in conn.execute("SELECT project, hash, dirty FROM exports")}
+            for prj_name, prj_dict in projects.items():
+                h, dirty = exports.get(prj_name, ("", 0))
+                newHash = getProjectHash(prj_dict)
+                if h == newHash:
+                    continue
+                if dirty:
+                    print(f"{prj_name}: config.json has changed, but state.db has newer state; keeping state.db's state")
+                    continue
+                self._saveProject(conn, prj_name, projectStateFromDict(prj_dict), prj_dict.get('subprojects', {}))
+                conn.execute("INSERT OR REPLACE INTO exports (project, hash, dirty) VALUES (?, ?, 0)", (prj_name, newHash))
+            for prj_name, (h, dirty) in exports.items():
+                if prj_name not in projects and not dirty:
+                    conn.execute("DELETE FROM projects WHERE project = ?", (prj_name,))
+                    conn.execute("DELETE FROM subprojects WHERE project = ?", (prj_name,))
+                    conn.execute("DELETE FROM exports WHERE project = ?", (prj_name,))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", ("config-mtime", mtime))
+
+    # Records that the projects named in prj_names were just exported to
+    # config.json, whose parsed JSON is js, so their rows match it.
+    def markExported(self, js, prj_names):
+        projects = js.get('projects', {})
+        with self._conn() as conn:
+            for prj_name in prj_names:
+                if prj_name in projects:
+                    conn.execute("INSERT OR REPLACE INTO exports (project, hash, dirty) VALUES (?, ?, 0)",
+                        (prj_name, getProjectHash(projects[prj_name])))
+
+    # Applies the saved rows to the parsed JSON of config.json, before it is
+    # loaded, or only to prj_only's project if given. Projects that have no
+    # rows are left as they are. Subprojects keep their order from
+    # config.json, with any new ones added at the end.
+    def overlayConfig(self, js, prj_only=""):
+        projects = js.get('projects', {})
+        conn = self._conn()
+        where = ""
+        params = []
+        if prj_only != "":
+            where = " WHERE project = ?"
+            params.append(prj_only)
+        sp_states = {}
+        for prj_name, sp_name, state in conn.execute("SELECT project, subproject, state FROM subprojects" + where, params):
+            sp_states.setdefault(prj_name, {})[sp_name] = json.loads(state)
+        for prj_name, state in conn.execute("SELECT project, state FROM projects" + where, params):
+            prj_dict = projects.get(prj_name, None)
+            if prj_dict is None:
+                continue
+            prj_dict.update(json.loads(state))
+            rows = sp_states.get(prj_name, {})
+            subprojects = {}
+            for sp_name in prj_dict.get('subprojects', {}):
+                if sp_name in rows:
+                    subprojects[sp_name] = rows.pop(sp_name)
+            subprojects.update(rows)
+            prj_dict['subprojects'] = subprojects
+
+# Returns the part of a project's JSON that is kept in the projects table:
+# everything but its subprojects (which have their own rows) and its SLM
+# policies (which steps don't change).
+def projectStateFromDict(prj_dict):
+    return {k: v for k, v in prj_dict.items() if k not in ("subprojects", "slm")}
+
+# Returns a hash of a project's JSON from config.json, for telling whether
+# it has changed since it was last imported or exported.
+def getProjectHash(prj_dict):
+    return hashlib.sha256(json.dumps(prj_dict, sort_keys=True).encode("utf-8")).hexdigest()
+
+# Returns the modification time of the file, for detecting whether
+# config.json has changed since it was last exported.
+def getFileMtime(filename):
+    if not os.path.isfile(filename):
+        return ""
+    return str(os.stat(filename).st_mtime_ns)
@@ -0,0 +1,95 @@
+# SPDX-FileCopyrightText: Copyright The Linux Foundation
+# SPDX-FileType: SOURCE
+# SPDX-License-Identifier: Apache-2.0
+
+'''
+Compares how long the per-pattern loops that parsespdx used to run, and
+NoLicenseFoundMatcher, take to apply the "No license found" findings rules
+to many unlicensed files, for a project with long skip lists.
+
+Run from the top of the repo:
+    python tests/benchnolicensefound.py [files]
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datatypes import Project
+from parsespdx import MD5_EMPTY_FILE, NoLicenseFoundMatcher, getExtensionsSkipPatterns
+from slm.tvParser import ParsedFileData
+
+DEFAULT_FILES = 50000
+REPEATS = 3
+
+# the per-pattern loops, as parsespdx ran them before NoLicenseFoundMatcher
+def applyLoops(prj, fdList):
+    extRevisedList, anyList, exactList = getExtensionsSkipPatterns(prj)
+    for fd in fdList:
+        if fd.license == "No license found":
+            ext = os.path.splitext(fd.path)[1].lstrip(".")
+            if str.lower(ext) in extRevisedList:
+                fd.finding_extensions = "yes"
+            for pattern in anyList:
+                if pattern in str.lower(fd.path):
+                    fd.finding_extensions = "yes"
+            for exactPattern in exactList:
+                if exactPattern == str.lower(os.path.split(fd.path)[1]):
+                    fd.finding_extensions = "yes"
+            for directory in prj._slm_thirdparty_dirs:
+                if directory in fd.path:
+                    fd.finding_thirdparty = "yes"
+            if fd.md5 == MD5_EMPTY_FILE:
+                fd.finding_emptyfile = "yes"
+
+def applyMatcher(prj, fdList):
+    matcher = NoLicenseFoundMatcher(prj)
+    for fd in fdList:
+        matcher.apply(fd)
+
+def makeProject():
+    prj = Project()
+    prj._slm_extensions_skip = [f"ext{i}" for i in range(100)] + ["json", "md", "png", "svg"] + \
+        [f"/fixtures{i}/*" for i in range(100)] + [f"NOTICE{i}=" for i in range(50)] + ["license="]
+    prj._slm_thirdparty_dirs = [f"/vendor{i}/" for i in range(50)] + ["/node_modules/", "/third_party/"]
+    return prj
+
+def makeFiles(numFiles):
+    paths = ["./src/Module{i}/Main.java", "./docs/page{i}.MD", "./node_modules/pkg{i}/index.js",
+        "./test/fixtures7/data{i}.txt", "./pkg{i}/LICENSE", "./vendor3/lib{i}/util.go"]
+    fdList = []
+    for i in range(numFiles):
+        fd = ParsedFileData()
+        fd.path = paths[i % len(paths)].format(i=i)
+        fd.license = "No license found"
+        fd.md5 = MD5_EMPTY_FILE if i % 10 == 0 else ""
+        fdList.append(fd)
+    return fdList
+
+def findings(fdList):
+    return [(fd.finding_extensions, fd.finding_thirdparty, fd.finding_emptyfile) for fd in fdList]
+
+# Returns the best of REPEATS wall times for fn, and the findings it made.
+def timeIt(fn, prj, numFiles):
+    best = None
+    for _ in range(REPEATS):
+        fdList = makeFiles(numFiles)
+        started = time.perf_counter()
+        fn(prj, fdList)
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, findings(fdList)
+
+def main(numFiles):
+    prj = makeProject()
+    loopsTime, loopsFindings = timeIt(applyLoops, prj, numFiles)
+    matcherTime, matcherFindings = timeIt(applyMatcher, prj, numFiles)
+    if loopsFindings != matcherFindings:
+        print("NoLicenseFoundMatcher made different findings from the loops")
+    print(f"{numFiles} files, {len(prj._slm_extensions_skip)} skip rules, {len(prj._slm_thirdparty_dirs)} third party dirs; loops {loopsTime:.3f}s, NoLicenseFoundMatcher {matcherTime:.3f}s ({loopsTime / matcherTime:.1f}x)")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_FILES)
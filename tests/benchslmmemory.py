@@ -0,0 +1,123 @@
+# SPDX-FileCopyrightText: Copyright The Linux Foundation
+# SPDX-FileType: SOURCE
+# SPDX-License-Identifier: Apache-2.0
+
+'''
+Measures how much memory parsing a synthetic SPDX tag-value file into SLM
+categories takes, with the slotted ParsedFileData and SLMFile records and
+the shared NO_FINDINGS, compared with the dict-backed records (each with its
+own findings dict) that were used before.
+
+Run from the top of the repo:
+    python tests/benchslmmemory.py [files]
+'''
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datatypes import SLMCategoryConfig, SLMLicenseConfig, SLMPolicy
+from parsespdx import addToLicenseSlot
+from slm import tvParser
+from slm.tvParser import TVParser
+from slm.tvReader import TVReader
+from slmpolicy import getCompiledPolicy
+
+DEFAULT_FILES = 1000000
+LICENSES = ["Apache-2.0", "MIT", "BSD-3-Clause", "No license found", "No license found"]
+
+# the records as they were before __slots__ and NO_FINDINGS
+class DictParsedFileData:
+    def __init__(self):
+        super(DictParsedFileData, self).__init__()
+        self.path = ""
+        self.license = ""
+        self.md5 = ""
+        self.sha1 = ""
+        self.sha256 = ""
+        self.finding_extensions = ""
+        self.finding_thirdparty = ""
+        self.finding_emptyfile = ""
+
+class DictSLMFile:
+    def __init__(self):
+        super(DictSLMFile, self).__init__()
+        self._path = ""
+        self._findings = {}
+
+def addToLicenseSlotDict(cat, lic, fd):
+    f = DictSLMFile()
+    f._path = fd.path
+    if fd.finding_emptyfile != "":
+        f._findings["emptyfile"] = fd.finding_emptyfile
+    lic._numfiles += 1
+    cat._numfiles += 1
+    lic._files.append(f)
+
+def makePolicy():
+    policy = SLMPolicy()
+    for catName in ["Project Licenses", "No license found"]:
+        cat = SLMCategoryConfig()
+        cat._name = catName
+        for licName in sorted(set(LICENSES)):
+            if (licName == "No license found") == (catName == "No license found"):
+                lic = SLMLicenseConfig()
+                lic._name = licName
+                cat._license_configs.append(lic)
+        policy._category_configs.append(cat)
+    return policy
+
+def makeReport(path, numFiles):
+    with open(path, 'w') as f:
+        f.write("SPDXVersion: SPDX-2.2\nDataLicense: CC0-1.0\nDocumentName: synthetic\n\n")
+        for i in range(numFiles):
+            f.write(f"FileName: ./src/dir{i // 1000}/file{i}.c\nSPDXID: SPDXRef-item{i}\n"
+                f"FileChecksum: SHA1: {i:040x}\nFileChecksum: MD5: {i:032x}\n"
+                f"LicenseConcluded: {LICENSES[i % len(LICENSES)]}\nLicenseInfoInFile: NOASSERTION\n"
+                f"FileCopyrightText: NONE\n\n")
+
+# Parses the report into categories, as doParseSPDXForSubproject does, and
+# returns (the categories, MB still allocated, peak MB, seconds).
+def parse(path, policy, addToLicense):
+    tracemalloc.start()
+    started = time.perf_counter()
+    compiled = getCompiledPolicy(policy)
+    cats = compiled.buildCategories()
+    reader = TVReader(TVParser.TAGS)
+    with open(path, 'r') as f:
+        for fd in TVParser().parsePairs(reader.readLines(f)):
+            slot = compiled.getLicenseSlot(cats, fd.license)
+            addToLicense(slot[0], slot[1], fd)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cats, current / (1024 * 1024), peak / (1024 * 1024), elapsed
+
+def main(numFiles):
+    policy = makePolicy()
+    with tempfile.TemporaryDirectory() as tempDir:
+        path = os.path.join(tempDir, "synthetic.spdx")
+        makeReport(path, numFiles)
+        size = os.path.getsize(path) / (1024 * 1024)
+
+        realParsedFileData = tvParser.ParsedFileData
+        tvParser.ParsedFileData = DictParsedFileData
+        try:
+            cats, dictCurrent, dictPeak, dictTime = parse(path, policy, addToLicenseSlotDict)
+        finally:
+            tvParser.ParsedFileData = realParsedFileData
+        del cats
+        cats, current, peak, elapsed = parse(path, policy, addToLicenseSlot)
+        numParsed = sum(cat._numfiles for cat in cats)
+
+    print(f"{numFiles} files ({numParsed} parsed), {size:.0f} MB of SPDX")
+    print(f"  dict records:    {dictCurrent:.0f} MB kept, {dictPeak:.0f} MB peak, {dictTime:.1f}s")
+    print(f"  slotted records: {current:.0f} MB kept, {peak:.0f} MB peak, {elapsed:.1f}s")
+    print(f"  {100 * (1 - current / dictCurrent):.0f}% less kept, {100 * (1 - peak / dictPeak):.0f}% lower peak")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_FILES)
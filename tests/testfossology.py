@@ -8,6 +8,7 @@ from uploadcode import doUploadCodeForSubproject, doUploadCodeForProject
 from datatypes import Status, ProjectRepoType
 from runagents import getUploadFolder, doRunAgentsForSubproject, getUpload, uploadExists
 from getspdx import doGetSPDXForSubproject
+from fossologyindex import getFossologyIndex
 from newmonth import copyToNextMonth
 from getcode import doGetRepoCodeForSubproject
 
@@ -33,6 +34,19 @@ class TestFossology(unittest.TestCase):
 
     def tearDown(self):
         self.temp_dir.cleanup()
+
+    # Creates a folder through the Fossology index, so that later lookups
+    # in the same run find it.
+    def createFolder(self, fossologyServer, parent, name):
+        return getFossologyIndex(fossologyServer).createFolder(parent, name)
+
+    # Uploads a file and adds it to the Fossology index, so that later
+    # lookups in the same run find it.
+    def uploadFile(self, fossologyServer, folder, **kwargs):
+        upload = fossologyServer.upload_file(folder, **kwargs)
+        if upload:
+            getFossologyIndex(fossologyServer).addUpload(upload)
+        return upload
         
     def test_config(self):
         secrets = loadSecrets(SECRET_FILE_NAME)
@@ -142,12 +156,12 @@ class TestFossology(unittest.TestCase):
             self.assertIsNone(result)
             result = getUploadFolder(fossologyServer, test_folder_name)
             self.assertIsNone(result)
-            test_project_folder = fossologyServer.create_folder(fossologyServer.rootFolder, test_project_folder_name)
+            test_project_folder = self.createFolder(fossologyServer, fossologyServer.rootFolder, test_project_folder_name)
             result = getUploadFolder(fossologyServer, test_project_folder_name)
             self.assertIsNotNone(result)
             result = getUploadFolder(fossologyServer, test_folder_name)
             self.assertIsNone(result)
-            test_folder = fossologyServer.create_folder(test_project_folder, test_folder_name)
+            test_folder = self.createFolder(fossologyServer, test_project_folder, test_folder_name)
             result = getUploadFolder(fossologyServer, test_project_folder_name)
             self.assertIsNotNone(result)
             result = getUploadFolder(fossologyServer, test_folder_name)
@@ -174,11 +188,11 @@ class TestFossology(unittest.TestCase):
         upload = None
         try:
             fossologyServer = fossologySetup(cfg._secrets, SECRET_FILE_NAME)
-            test_project_folder = fossologyServer.create_folder(fossologyServer.rootFolder, test_project_folder_name)
-            test_folder = fossologyServer.create_folder(test_project_folder, test_folder_name)
+            test_project_folder = self.createFolder(fossologyServer, fossologyServer.rootFolder, test_project_folder_name)
+            test_folder = self.createFolder(fossologyServer, test_project_folder, test_folder_name)
             result = getUpload(fossologyServer, test_folder, upload_name)
             self.assertIsNone(result)
-            upload = fossologyServer.upload_file(test_folder, file=TEST_SCAFFOLD_CODE, wait_time=20)
+            upload = self.uploadFile(fossologyServer, test_folder, file=TEST_SCAFFOLD_CODE, wait_time=20)
             self.assertIsNotNone(upload)
             result = getUpload(fossologyServer, test_folder, upload_name)
             self.assertIsNotNone(result)
@@ -205,13 +219,13 @@ class TestFossology(unittest.TestCase):
         upload = None
         try:
             fossologyServer = fossologySetup(cfg._secrets, SECRET_FILE_NAME)
-            test_project_folder = fossologyServer.create_folder(fossologyServer.rootFolder, test_project_folder_name)
-            test_folder = fossologyServer.create_folder(test_project_folder, test_folder_name)
+            test_project_folder = self.createFolder(fossologyServer, fossologyServer.rootFolder, test_project_folder_name)
+            test_folder = self.createFolder(fossologyServer, test_project_folder, test_folder_name)
             result = uploadExists(fossologyServer, test_folder, upload_name)
             self.assertFalse(result)
             result = uploadExists(fossologyServer, test_folder_name, upload_name)
             self.assertFalse(result)
-            upload = fossologyServer.upload_file(test_folder, file=TEST_SCAFFOLD_CODE, wait_time=10)
+            upload = self.uploadFile(fossologyServer, test_folder, file=TEST_SCAFFOLD_CODE, wait_time=10)
             result = uploadExists(fossologyServer, test_folder, upload_name)
             self.assertTrue(result)
             result = uploadExists(fossologyServer, test_folder_name, upload_name)
@@ -245,12 +259,12 @@ class TestFossology(unittest.TestCase):
         shutil.copyfile(TEST_SCAFFOLD_CODE, reuseFile)
         try:
             fossologyServer = fossologySetup(cfg._secrets, SECRET_FILE_NAME)
-            test_project_folder = fossologyServer.create_folder(fossologyServer.rootFolder, prj._name)
+            test_project_folder = self.createFolder(fossologyServer, fossologyServer.rootFolder, prj._name)
             self.assertIsNotNone(test_project_folder)
             dstFolder = f"{prj._name}-{cfg._month}"
-            test_folder = fossologyServer.create_folder(test_project_folder, dstFolder)
+            test_folder = self.createFolder(fossologyServer, test_project_folder, dstFolder)
             self.assertIsNotNone(test_folder)
-            upload = fossologyServer.upload_file(test_folder, file=TEST_SCAFFOLD_CODE, wait_time=10)
+            upload = self.uploadFile(fossologyServer, test_folder, file=TEST_SCAFFOLD_CODE, wait_time=10)
             self.assertIsNotNone(upload)
             result = doRunAgentsForSubproject(cfg, fossologyServer, prj, sp)
             self.assertTrue(result)
@@ -261,9 +275,9 @@ class TestFossology(unittest.TestCase):
             cfg._month = "2023-10"
             sp._code_path = "sp1-2023-10-10.zip"
             reuseDstFolder = f"{prj._name}-{cfg._month}"
-            test_reuse_folder = fossologyServer.create_folder(test_project_folder, reuseDstFolder)
+            test_reuse_folder = self.createFolder(fossologyServer, test_project_folder, reuseDstFolder)
             self.assertIsNotNone(test_reuse_folder)
-            reuse_upload = fossologyServer.upload_file(test_reuse_folder, file=reuseFile, wait_time=10)
+            reuse_upload = self.uploadFile(fossologyServer, test_reuse_folder, file=reuseFile, wait_time=10)
             self.assertIsNotNone(reuse_upload)
             result = doRunAgentsForSubproject(cfg, fossologyServer, prj, sp)
             self.assertTrue(result)
@@ -316,12 +330,12 @@ class TestFossology(unittest.TestCase):
         try:
             # Setup and scan a project
             fossologyServer = fossologySetup(cfg._secrets, SECRET_FILE_NAME)
-            test_project_folder = fossologyServer.create_folder(fossologyServer.rootFolder, prj._name)
+            test_project_folder = self.createFolder(fossologyServer, fossologyServer.rootFolder, prj._name)
             self.assertIsNotNone(test_project_folder)
             dstFolder = f"{prj._name}-{cfg._month}"
-            test_folder = fossologyServer.create_folder(test_project_folder, dstFolder)
+            test_folder = self.createFolder(fossologyServer, test_project_folder, dstFolder)
             self.assertIsNotNone(test_folder)
-            upload = fossologyServer.upload_file(test_folder, file=TEST_SCAFFOLD_CODE, wait_time=10)
+            upload = self.uploadFile(fossologyServer, test_folder, file=TEST_SCAFFOLD_CODE, wait_time=10)
             self.assertIsNotNone(upload)
             result = doRunAgentsForSubproject(cfg, fossologyServer, prj, sp)
             self.assertTrue(result)
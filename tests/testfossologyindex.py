@@ -0,0 +1,74 @@
+import unittest
+from unittest import mock
+
+from fossology.obj import Folder, Upload
+
+import runagents
+from fossologyindex import FossologyIndex, getFossologyIndex
+
+'''
+Tests looking up Fossology folders and uploads from an in-memory index
+'''
+class TestFossologyIndex(unittest.TestCase):
+
+    def upload(self, folderId, id, name):
+        return Upload(folderId, "", id, "", name, "2023-07-09", hash={"sha1": "", "md5": "", "sha256": "", "size": 0})
+
+    def setUp(self):
+        self.root = Folder(1, "Software Repository", "", None)
+        self.folders = [self.root]
+        self.uploads = []
+        for i, month in enumerate(["2023-05", "2023-06", "2023-07"]):
+            folder = Folder(10 + i, f"prj1-{month}", "", 1)
+            self.folders.append(folder)
+            self.uploads.append(self.upload(folder.id, 100 + i, f"sp1-{month}-09.zip"))
+        # a subfolder, whose uploads count as being in its parent
+        self.folders.append(Folder(20, "extra", "", 12))
+        self.uploads.append(self.upload(20, 200, "sp2-2023-07-09.zip"))
+        self.server = mock.Mock()
+        self.server.rootFolder = self.root
+        self.server.list_folders.return_value = self.folders
+        self.server.list_uploads.return_value = (self.uploads, 1)
+
+    def test_lookups_list_once(self):
+        index = FossologyIndex(self.server)
+        folder = index.getFolder("prj1-2023-06")
+        self.assertEqual(11, folder.id)
+        # folder names must match exactly, as they did before the index
+        self.assertIsNone(index.getFolder("PRJ1-2023-06"))
+        self.assertIsNone(index.getFolder("prj1-2023-01"))
+        self.assertEqual(101, index.getUpload(folder, "sp1-2023-06").id)
+        self.assertIsNone(index.getUpload(folder, "sp2"))
+        self.assertEqual(200, index.getUpload(index.getFolder("prj1-2023-07"), "sp2-2023-07").id)
+        self.assertEqual(1, self.server.list_folders.call_count)
+        self.assertEqual(1, self.server.list_uploads.call_count)
+
+    def test_create_folder(self):
+        index = FossologyIndex(self.server)
+        # already there, so no need to ask the server
+        self.assertEqual(12, index.createFolder(self.root, "prj1-2023-07").id)
+        self.server.create_folder.assert_not_called()
+        self.server.create_folder.return_value = Folder(13, "prj1-2023-08", "", 1)
+        self.assertEqual(13, index.createFolder(self.root, "prj1-2023-08").id)
+        self.assertEqual(13, index.getFolder("prj1-2023-08").id)
+        self.assertEqual(1, self.server.create_folder.call_count)
+
+    def test_add_upload(self):
+        index = FossologyIndex(self.server)
+        folder = index.getFolder("prj1-2023-07")
+        self.assertIsNone(index.getUpload(folder, "sp3-2023-07"))
+        index.addUpload(self.upload(12, 300, "sp3-2023-07-09.zip"))
+        self.assertEqual(300, index.getUpload(folder, "sp3-2023-07").id)
+        self.assertEqual(1, self.server.list_uploads.call_count)
+
+    def test_runagents_lookups(self):
+        folder = runagents.getUploadFolder(self.server, "prj1-2023-05")
+        self.assertEqual(100, runagents.getUpload(self.server, folder, "sp1-2023-05").id)
+        self.assertTrue(runagents.uploadExists(self.server, "prj1-2023-06", "sp1-2023-06"))
+        self.assertFalse(runagents.uploadExists(self.server, "prj1-2023-06", "sp2-2023-06"))
+        self.assertIs(getFossologyIndex(self.server), getFossologyIndex(self.server))
+        self.assertEqual(1, self.server.list_folders.call_count)
+        self.assertEqual(1, self.server.list_uploads.call_count)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,10 +3,15 @@ import os
 import tempfile
 import shutil
 from datetime import datetime
-from getcode import doGetRepoCodeForSubproject
+from unittest import mock
+import git
+import zipfile
+import gitcache
+from getcode import doGetRepoCodeForSubproject, cloneReposForSubproject
 from config import loadConfig, saveConfig
 from datatypes import Status, ProjectRepoType
 from zipcode import doZipRepoCodeForSubproject
+from util import wait_for_deletions
 
 UPLOAD_FILE_FRAGMENT = "sp1-2023-07"
 UPLOAD_FILE_NAME = UPLOAD_FILE_FRAGMENT + "-09.zip"
@@ -30,6 +35,8 @@ class TestGetCode(unittest.TestCase):
         self.config_month_dir = os.path.join(self.scaffold_home_dir, TEST_MONTH)
 
     def tearDown(self):
+        # zipcode deletes checkouts in the background
+        wait_for_deletions()
         self.temp_dir.cleanup()
 
     def test_empty_github(self):
@@ -57,6 +64,117 @@ class TestGetCode(unittest.TestCase):
         self.assertEqual(len(dirContents), 1)
         self.assertEqual(dirContents[0], '.git')      
 
+    def test_clone_repos_concurrently(self):
+        cfg_file = os.path.join(self.config_month_dir, "config.json")
+        cfg = loadConfig(cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        cfg._zippath = os.path.join(self.temp_dir.name, "zipped")
+        cfg._clone_jobs = 3
+        prj = cfg._projects['prj1']
+        sp = prj._subprojects['sp1']
+        sp._code_repos = {}
+        ziporg_path = os.path.join(self.temp_dir.name, "code", "sp1")
+        # local repos standing in for the upstream ones
+        clones = []
+        heads = {}
+        actor = git.Actor("Test", "test@example.com")
+        for i in range(5):
+            repo = f"repo{i}"
+            upstream_path = os.path.join(self.temp_dir.name, "upstream", repo)
+            upstream = git.Repo.init(upstream_path, initial_branch="main")
+            with open(os.path.join(upstream_path, "a.txt"), "w") as f:
+                f.write(repo)
+            upstream.index.add(["a.txt"])
+            heads[repo] = upstream.index.commit("add a.txt", author=actor, committer=actor).hexsha
+            upstream.close()
+            clones.append((repo, f"file://{upstream_path}", os.path.join(ziporg_path, repo), "", True))
+        with mock.patch("builtins.print"):
+            self.assertTrue(cloneReposForSubproject(cfg, prj, sp, ziporg_path, clones))
+        self.assertEqual(heads, sp._code_repos)
+        for i in range(5):
+            self.assertTrue(os.path.isfile(os.path.join(ziporg_path, f"repo{i}", "a.txt")))
+
+        # one failed clone removes the whole ziporg directory
+        shutil.rmtree(ziporg_path)
+        cfg._git_cache = False
+        clones.append(("missing", f"file://{self.temp_dir.name}/upstream/missing", os.path.join(ziporg_path, "missing"), "", True))
+        with mock.patch("builtins.print") as mock_print:
+            self.assertFalse(cloneReposForSubproject(cfg, prj, sp, ziporg_path, clones))
+        self.assertFalse(os.path.exists(ziporg_path))
+        printed = " ".join(str(call.args[0]) for call in mock_print.call_args_list)
+        self.assertIn("unable to clone missing", printed)
+        self.assertIn("1 of 6 repos failed", printed)
+
+    def test_stream_archives(self):
+        cfg_file = os.path.join(self.config_month_dir, "config.json")
+        cfg = loadConfig(cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        prj = cfg._projects['prj1']
+        sp = prj._subprojects['sp1']
+        sp._repos = ["repo1"]
+        sp._repo_dirs_delete = {"repo1": ["docs"]}
+        # a local repo standing in for the upstream one
+        upstream_path = os.path.join(self.temp_dir.name, "upstream", "repo1")
+        upstream = git.Repo.init(upstream_path, initial_branch="main")
+        for filename in ["a.txt", "src/b.txt", "docs/c.txt", "docsy.txt"]:
+            os.makedirs(os.path.dirname(os.path.join(upstream_path, filename)), exist_ok=True)
+            with open(os.path.join(upstream_path, filename), "w") as f:
+                f.write(filename)
+        os.symlink("a.txt", os.path.join(upstream_path, "link.txt"))
+        upstream.index.add(["a.txt", "src/b.txt", "docs/c.txt", "docsy.txt", "link.txt"])
+        actor = git.Actor("Test", "test@example.com")
+        head = upstream.index.commit("add files", author=actor, committer=actor).hexsha
+        upstream.close()
+
+        # zipping a checkout and streaming from the git cache give the same files
+        namelists = []
+        manifests = []
+        for stream in [False, True]:
+            cfg._zippath = os.path.join(self.temp_dir.name, f"zipped-{stream}")
+            cfg._stream_archives = stream
+            sp._status = Status.GOTLISTING
+            sp._code_repos = {}
+            with mock.patch.object(gitcache, "getRepoURL", lambda prj, sp, repo: f"file://{upstream_path}"), \
+                    mock.patch("builtins.print"):
+                self.assertTrue(doGetRepoCodeForSubproject(cfg, prj, sp))
+                self.assertEqual(Status.GOTCODE, sp._status)
+                self.assertEqual({"repo1": head}, sp._code_repos)
+                ziporg_path = os.path.join(cfg._zippath, cfg._month, "code", prj._name, sp._name, sp._github_ziporg)
+                self.assertEqual(not stream, os.path.isdir(ziporg_path))
+                self.assertTrue(doZipRepoCodeForSubproject(cfg, prj, sp))
+            self.assertEqual(Status.ZIPPEDCODE, sp._status)
+            self.assertEqual(64, len(sp._code_sha256))
+            manifests.append(sp._code_manifest_sha256)
+            with zipfile.ZipFile(sp._code_path) as zf:
+                namelists.append(sorted(zf.namelist()))
+                self.assertEqual(b"src/b.txt", zf.read("repo1/src/b.txt"))
+        self.assertEqual(["repo1/a.txt", "repo1/docsy.txt", "repo1/src/b.txt"], namelists[0])
+        self.assertEqual(namelists[0], namelists[1])
+        self.assertEqual(manifests[0], manifests[1])
+
+    def test_stream_archives_needs_commit(self):
+        cfg_file = os.path.join(self.config_month_dir, "config.json")
+        cfg = loadConfig(cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        cfg._zippath = os.path.join(self.temp_dir.name, "zipped")
+        prj = cfg._projects['prj1']
+        sp = prj._subprojects['sp1']
+        sp._repos = ["repo1"]
+        sp._code_repos = {"repo1": "0" * 40}
+        sp._code_anyfiles = True
+        sp._status = Status.GOTCODE
+
+        # streaming, but the git cache doesn't have the commit
+        cfg._stream_archives = True
+        with mock.patch("builtins.print") as printMock:
+            self.assertFalse(doZipRepoCodeForSubproject(cfg, prj, sp))
+        self.assertIn("git cache doesn't have commit", str(printMock.call_args_list))
+        self.assertEqual(Status.GOTCODE, sp._status)
+
+        # not streaming, but there's no checkout
+        cfg._stream_archives = False
+        with mock.patch("builtins.print") as printMock:
+            self.assertFalse(doZipRepoCodeForSubproject(cfg, prj, sp))
+        self.assertIn("no code found", str(printMock.call_args_list))
+        self.assertEqual(Status.GOTCODE, sp._status)
+
     def test_shallow_clone(self):
         # Test that only depth = 1 is cloned
         repoName = 'TEST-Branches'
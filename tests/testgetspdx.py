@@ -0,0 +1,110 @@
+import unittest
+from unittest import mock
+import os
+import shutil
+import tempfile
+
+from fossology.obj import Folder, Upload
+
+import getspdx
+from config import loadConfig
+from datatypes import Status
+from getspdx import doGetSPDXForSubproject, startGetSPDXForSubproject
+from poller import Poller
+
+SECRET_FILE_NAME = ".test-scaffold-secrets.json"
+TEST_SCAFFOLD_HOME = os.path.join(os.path.dirname(__file__), "testresources", "scaffoldhome")
+TEST_MONTH = "2023-07"
+
+'''
+Tests getting SPDX files from a fake Fossology server
+'''
+class TestGetSPDX(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.scaffold_home_dir = os.path.join(self.temp_dir.name, "scaffold")
+        shutil.copytree(TEST_SCAFFOLD_HOME, self.scaffold_home_dir)
+        cfg_file = os.path.join(self.scaffold_home_dir, TEST_MONTH, "config.json")
+        self.cfg = loadConfig(cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        self.cfg._storepath = self.scaffold_home_dir
+        self.prj = self.cfg._projects['prj-private-sbom']
+        self.sp = next(iter(self.prj._subprojects.values()))
+        self.sp._status = Status.CLEARED
+        self.sp._code_path = f"/zips/{self.sp._name}-2023-07-09.zip"
+        self.sp._code_pulled = "2023-07-09"
+
+        folder = Folder(12, f"{self.prj._name}-{TEST_MONTH}", "", 1)
+        upload = Upload(12, folder.name, 42, "", f"{self.sp._name}-2023-07-09.zip", "2023-07-09",
+            hash={"sha1": "", "md5": "", "sha256": "", "size": 0})
+        self.server = mock.Mock()
+        self.server.api = "https://fossology.example.org/api/v1"
+        self.server.list_folders.return_value = [folder]
+        self.server.list_uploads.return_value = ([upload], 1)
+        self.server.generate_report.return_value = "7"
+        # check on reports without waiting around
+        self.poller_patch = mock.patch.object(getspdx, "getPoller", return_value=Poller(0.01, 0.05))
+        self.poller_patch.start()
+
+    def tearDown(self):
+        self.poller_patch.stop()
+        self.temp_dir.cleanup()
+
+    def response(self, status_code, chunks=[]):
+        response = mock.Mock()
+        response.status_code = status_code
+        response.iter_content.return_value = iter(chunks)
+        return response
+
+    def test_streams_report(self):
+        chunks = [b"SPDXVersion: SPDX-2.2\n", b"DataLicense: CC0-1.0\n" * 1000]
+        ready = self.response(200, chunks)
+        self.server.session.get.side_effect = [self.response(503), ready]
+        with mock.patch("builtins.print"):
+            self.assertTrue(startGetSPDXForSubproject(self.cfg, self.server, self.prj, self.sp).result(timeout=10))
+        self.assertEqual(Status.GOTSPDX, self.sp._status)
+        spdxPath = os.path.join(self.scaffold_home_dir, TEST_MONTH, "spdx", self.prj._name, f"{self.sp._name}-2023-07-09.spdx")
+        with open(spdxPath, "rb") as f:
+            self.assertEqual(b"".join(chunks), f.read())
+        self.assertFalse(os.path.exists(f"{spdxPath}.part"))
+        # it was streamed, rather than read all at once
+        self.assertTrue(self.server.session.get.call_args.kwargs["stream"])
+        ready.close.assert_called()
+
+    def test_report_fails(self):
+        self.server.session.get.side_effect = [self.response(503), self.response(404)]
+        with mock.patch("builtins.print"):
+            self.assertFalse(startGetSPDXForSubproject(self.cfg, self.server, self.prj, self.sp).result(timeout=10))
+        self.assertEqual(Status.CLEARED, self.sp._status)
+
+    def test_report_retries(self):
+        chunks = [b"SPDXVersion: SPDX-2.2\n"]
+        # a blip, and then the report is still being generated for longer
+        # than the retries would allow for on their own
+        responses = [self.response(502)] + [self.response(503) for _ in range(getspdx.REPORT_CHECK_RETRIES + 3)] + \
+            [self.response(429), self.response(200, chunks)]
+        self.server.session.get.side_effect = responses
+        with mock.patch("builtins.print"):
+            self.assertTrue(startGetSPDXForSubproject(self.cfg, self.server, self.prj, self.sp).result(timeout=10))
+        self.assertEqual(Status.GOTSPDX, self.sp._status)
+        self.assertEqual(len(responses), self.server.session.get.call_count)
+
+    def test_report_retries_give_up(self):
+        self.server.session.get.side_effect = [self.response(503)] + [self.response(502)] * (getspdx.REPORT_CHECK_RETRIES + 1)
+        with mock.patch("builtins.print"):
+            self.assertFalse(startGetSPDXForSubproject(self.cfg, self.server, self.prj, self.sp).result(timeout=10))
+        self.assertEqual(Status.CLEARED, self.sp._status)
+        self.assertEqual(getspdx.REPORT_CHECK_RETRIES + 2, self.server.session.get.call_count)
+
+    def test_early_exit(self):
+        self.sp._code_path = ""
+        with mock.patch("builtins.print"):
+            # the bool API stays a bool, and the start API is already done
+            self.assertIs(False, doGetSPDXForSubproject(self.cfg, self.server, self.prj, self.sp))
+            started = startGetSPDXForSubproject(self.cfg, self.server, self.prj, self.sp)
+        self.assertTrue(started.done())
+        self.assertFalse(started.result())
+        self.server.generate_report.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import unittest
+import unittest.mock
+import os
+import tempfile
+import shutil
+
+import git
+
+import gitcache
+from config import loadConfig
+
+SECRET_FILE_NAME = ".test-scaffold-secrets.json"
+TEST_SCAFFOLD_HOME = os.path.join(os.path.dirname(__file__), "testresources", "scaffoldhome")
+TEST_MONTH = "2023-07"
+
+'''
+Tests the git mirror cache, using local repos in place of GitHub
+'''
+class TestGitCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.scaffold_home_dir = os.path.join(self.temp_dir.name, "scaffold")
+        shutil.copytree(TEST_SCAFFOLD_HOME, self.scaffold_home_dir)
+        self.config_month_dir = os.path.join(self.scaffold_home_dir, TEST_MONTH)
+        cfg_file = os.path.join(self.config_month_dir, "config.json")
+        self.cfg = loadConfig(cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        self.cfg._zippath = os.path.join(self.temp_dir.name, "zipped")
+        # a local repo standing in for the upstream one
+        self.upstream_path = os.path.join(self.temp_dir.name, "upstream", "repo1")
+        os.makedirs(self.upstream_path)
+        self.upstream = git.Repo.init(self.upstream_path, initial_branch="main")
+        self.upstream_url = f"file://{self.upstream_path}"
+
+    def tearDown(self):
+        self.upstream.close()
+        self.temp_dir.cleanup()
+
+    def commitFile(self, filename, contents):
+        with open(os.path.join(self.upstream_path, filename), "w") as f:
+            f.write(contents)
+        self.upstream.index.add([filename])
+        actor = git.Actor("Test", "test@example.com")
+        return self.upstream.index.commit(f"add {filename}", author=actor, committer=actor).hexsha
+
+    def readShallow(self, dst):
+        with open(os.path.join(dst, ".git", "shallow"), "r") as f:
+            return f.read().strip()
+
+    def test_mirror_path(self):
+        self.assertEqual(os.path.join(self.cfg._zippath, "gitcache", "github.com", "org", "repo.git"),
+            gitcache.getMirrorPath(self.cfg, "git@github.com:org/repo.git"))
+        self.assertEqual(os.path.join(self.cfg._zippath, "gitcache", "gerrit.example.org", "a", "b.git"),
+            gitcache.getMirrorPath(self.cfg, "https://user@gerrit.example.org/a/b"))
+
+    def test_clone_and_incremental_fetch(self):
+        first = self.commitFile("a.txt", "one")
+        dst1 = os.path.join(self.temp_dir.name, "month1", "repo1")
+        gitcache.cloneRepo(self.cfg, self.upstream_url, dst1)
+        self.assertTrue(os.path.isfile(os.path.join(dst1, "a.txt")))
+        self.assertEqual(first, self.readShallow(dst1))
+        mirror_path = gitcache.getMirrorPath(self.cfg, self.upstream_url)
+        self.assertTrue(os.path.isdir(mirror_path))
+
+        # next month, the mirror is updated rather than cloned again
+        second = self.commitFile("b.txt", "two")
+        dst2 = os.path.join(self.temp_dir.name, "month2", "repo1")
+        gitcache.cloneRepo(self.cfg, self.upstream_url, dst2)
+        self.assertTrue(os.path.isfile(os.path.join(dst2, "b.txt")))
+        self.assertEqual(second, self.readShallow(dst2))
+        self.assertEqual(second, git.Git(mirror_path).rev_parse("refs/heads/main"))
+
+    def test_branch(self):
+        self.commitFile("a.txt", "one")
+        self.upstream.git.checkout("-b", "test-branch")
+        branchCommit = self.commitFile("branch.txt", "branch")
+        self.upstream.git.checkout("main")
+        dst = os.path.join(self.temp_dir.name, "month1", "repo1")
+        gitcache.cloneRepo(self.cfg, self.upstream_url, dst, "test-branch")
+        self.assertTrue(os.path.isfile(os.path.join(dst, "branch.txt")))
+        self.assertEqual(branchCommit, self.readShallow(dst))
+
+    def test_archive_matches_checkout(self):
+        self.commitFile(".gitattributes", "ignored.txt export-ignore\nsubst.txt export-subst\n")
+        self.commitFile("ignored.txt", "still scanned")
+        commit = self.commitFile("subst.txt", "commit $Format:%H$")
+        self.assertEqual(commit, gitcache.fetchRepo(self.cfg, self.upstream_url))
+        contents = {}
+        with gitcache.openArchive(self.cfg, self.upstream_url, commit) as tar:
+            for member in tar:
+                if member.isfile():
+                    contents[member.name] = tar.extractfile(member).read()
+        # the files are the same as a checkout would have, regardless of
+        # the repo's export attributes
+        self.assertEqual(b"still scanned", contents["ignored.txt"])
+        self.assertEqual(b"commit $Format:%H$", contents["subst.txt"])
+
+    def test_broken_mirror(self):
+        first = self.commitFile("a.txt", "one")
+        mirror_path = gitcache.getMirrorPath(self.cfg, self.upstream_url)
+        # e.g. from an interrupted clone
+        os.makedirs(mirror_path)
+        dst = os.path.join(self.temp_dir.name, "month1", "repo1")
+        gitcache.cloneRepo(self.cfg, self.upstream_url, dst)
+        self.assertEqual(first, self.readShallow(dst))
+        self.assertTrue(os.path.isfile(os.path.join(mirror_path, "HEAD")))
+
+    def test_unreachable_mirror_falls_back(self):
+        first = self.commitFile("a.txt", "one")
+        dst = os.path.join(self.temp_dir.name, "month1", "repo1")
+        with unittest.mock.patch("gitcache.updateMirror", side_effect=git.GitCommandError("fetch", 128)), \
+                unittest.mock.patch("builtins.print"):
+            gitcache.cloneRepo(self.cfg, self.upstream_url, dst)
+        self.assertEqual(first, self.readShallow(dst))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import os
+import sys
+import json
+import subprocess
+
+TEST_SCAFFOLD_HOME = os.path.join(os.path.dirname(__file__), "testresources", "scaffoldhome")
+TEST_MONTH = "2023-07"
+SCAFFOLD_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that read-only commands like `status` should never need
+HEAVY_MODULES = ["fossology", "git", "jira", "openpyxl", "jinja2", "spdx_tools", "spdx_python_model", "runners"]
+# generous, so that slow machines don't fail; loading everything used to
+# take several times this long
+STATUS_IMPORT_BUDGET_SECONDS = 0.5
+
+# imports scaffold and runs `status` in a fresh interpreter, then reports
+# how long importing took and which heavy modules got loaded
+STATUS_SCRIPT = f"""
+import json, os, sys, time
+from unittest import mock
+start = time.perf_counter()
+import scaffold
+elapsed = time.perf_counter() - start
+from config import loadConfig
+cfg = loadConfig(os.path.join({TEST_SCAFFOLD_HOME!r}, {TEST_MONTH!r}, "config.json"), {TEST_SCAFFOLD_HOME!r}, ".test-scaffold-secrets.json")
+with mock.patch("builtins.print"):
+    scaffold.exec_command({TEST_SCAFFOLD_HOME!r}, cfg, ["scaffold.py", {TEST_MONTH!r}, "status"])
+heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]
+sys.stdout.write(json.dumps({{"elapsed": elapsed, "heavy": heavy}}))
+"""
+
+'''
+Tests that read-only commands don't load heavy dependencies
+'''
+class TestImportTime(unittest.TestCase):
+
+    def runStatus(self):
+        cp = subprocess.run([sys.executable, "-c", STATUS_SCRIPT], cwd=SCAFFOLD_DIR, capture_output=True, text=True)
+        self.assertEqual(0, cp.returncode, cp.stderr)
+        return json.loads(cp.stdout)
+
+    def test_status_skips_heavy_modules(self):
+        result = self.runStatus()
+        self.assertEqual([], result["heavy"])
+
+    def test_status_import_budget(self):
+        # take the best of a few runs, to smooth over a busy machine
+        elapsed = min(self.runStatus()["elapsed"] for _ in range(3))
+        self.assertLess(elapsed, STATUS_IMPORT_BUDGET_SECONDS)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import os
+import tempfile
+import shutil
+
+from config import loadConfig, saveConfig, saveState, getJournalFilename
+from datatypes import Status
+from journal import readJournal
+
+SECRET_FILE_NAME = ".test-scaffold-secrets.json"
+TEST_SCAFFOLD_HOME = os.path.join(os.path.dirname(__file__), "testresources", "scaffoldhome")
+TEST_MONTH = "2023-07"
+
+'''
+Tests journaling status changes and replaying / compacting the journal
+'''
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.scaffold_home_dir = os.path.join(self.temp_dir.name, "scaffold")
+        shutil.copytree(TEST_SCAFFOLD_HOME, self.scaffold_home_dir)
+        self.config_month_dir = os.path.join(self.scaffold_home_dir, TEST_MONTH)
+        self.cfg_file = os.path.join(self.config_month_dir, "config.json")
+        self.cfg = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        self.journal_file = getJournalFilename(self.scaffold_home_dir, TEST_MONTH, 'prj-private-sbom')
+
+    def tearDown(self):
+        for journal in self.cfg._journals.values():
+            journal.close()
+        self.temp_dir.cleanup()
+
+    def test_replay(self):
+        with open(self.cfg_file, 'r') as f:
+            original = f.read()
+        prj = self.cfg._projects['prj-private-sbom']
+        sp = prj._subprojects['sp1']
+        sp._status = Status.ZIPPEDCODE
+        sp._code_path = "/tmp/sp1.zip"
+        saveState(self.scaffold_home_dir, self.cfg, prj, sp)
+        sp._status = Status.UPLOADEDCODE
+        saveState(self.scaffold_home_dir, self.cfg, prj, sp)
+        self.cfg._journals['prj-private-sbom'].close()
+
+        # config.json is untouched, but loading it replays the journal
+        with open(self.cfg_file, 'r') as f:
+            self.assertEqual(original, f.read())
+        self.assertEqual(2, len(readJournal(self.journal_file)))
+        cfg = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        sp = cfg._projects['prj-private-sbom']._subprojects['sp1']
+        self.assertEqual(Status.UPLOADEDCODE, sp._status)
+        self.assertEqual("/tmp/sp1.zip", sp._code_path)
+        self.assertEqual(len(prj._subprojects), len(cfg._projects['prj-private-sbom']._subprojects))
+
+    def test_compact(self):
+        prj = self.cfg._projects['prj-private-sbom']
+        sp = prj._subprojects['sp1']
+        sp._status = Status.ZIPPEDCODE
+        saveState(self.scaffold_home_dir, self.cfg, prj, sp)
+        saveConfig(self.scaffold_home_dir, self.cfg)
+        self.assertFalse(os.path.exists(self.journal_file))
+        cfg = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        self.assertEqual(Status.ZIPPEDCODE, cfg._projects['prj-private-sbom']._subprojects['sp1']._status)
+
+    def test_torn_record(self):
+        prj = self.cfg._projects['prj-private-sbom']
+        sp = prj._subprojects['sp1']
+        sp._status = Status.ZIPPEDCODE
+        saveState(self.scaffold_home_dir, self.cfg, prj, sp)
+        self.cfg._journals['prj-private-sbom'].close()
+        # simulate a crash in the middle of writing the next record
+        with open(self.journal_file, 'a') as f:
+            f.write('{"version":99,"project":"prj-private-sbom","subproject":"sp1","subpro')
+        cfg = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        self.assertEqual(Status.ZIPPEDCODE, cfg._projects['prj-private-sbom']._subprojects['sp1']._status)
+
+if __name__ == '__main__':
+    unittest.main()
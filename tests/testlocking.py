@@ -0,0 +1,130 @@
+import unittest
+import os
+import json
+import tempfile
+import shutil
+import time
+
+from config import loadConfig, saveBackupConfig, saveConfig, saveState
+from datatypes import Status
+from locking import ScaffoldLock, getProjectLockFilename
+
+SECRET_FILE_NAME = ".test-scaffold-secrets.json"
+TEST_SCAFFOLD_HOME = os.path.join(os.path.dirname(__file__), "testresources", "scaffoldhome")
+TEST_MONTH = "2023-07"
+
+'''
+Tests month and project locks, and merging project state into config.json
+'''
+class TestLocking(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.scaffold_home_dir = os.path.join(self.temp_dir.name, "scaffold")
+        shutil.copytree(TEST_SCAFFOLD_HOME, self.scaffold_home_dir)
+        self.config_month_dir = os.path.join(self.scaffold_home_dir, TEST_MONTH)
+        self.cfg_file = os.path.join(self.config_month_dir, "config.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_project_and_month_locks(self):
+        with ScaffoldLock(self.config_month_dir, "prj1") as lock1, \
+                ScaffoldLock(self.config_month_dir, "prj2") as lock2:
+            self.assertTrue(lock1.acquire())
+            self.assertTrue(lock2.acquire())
+            self.assertFalse(ScaffoldLock(self.config_month_dir, "prj1").acquire())
+            self.assertFalse(ScaffoldLock(self.config_month_dir).acquire())
+        with ScaffoldLock(self.config_month_dir) as monthLock:
+            self.assertTrue(monthLock.acquire())
+            self.assertFalse(ScaffoldLock(self.config_month_dir, "prj1").acquire())
+        self.assertEqual([], [f for f in os.listdir(self.config_month_dir) if "lock" in f])
+
+    def test_stale_lock(self):
+        lockFilename = getProjectLockFilename(self.config_month_dir, "prj1")
+        with open(lockFilename, 'w') as f:
+            now = time.time()
+            json.dump({"host": "elsewhere", "pid": 1, "acquired": now - 1000, "expires": now - 10}, f)
+        with ScaffoldLock(self.config_month_dir, "prj1") as lock:
+            self.assertTrue(lock.acquire())
+            with open(lockFilename, 'r') as f:
+                self.assertEqual(os.getpid(), json.load(f)["pid"])
+
+    def test_merge_project_config(self):
+        # two operators load the config, and each runs a different project
+        cfgA = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        cfgB = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        prjNames = list(cfgA._projects.keys())[:2]
+        spA = next(iter(cfgA._projects[prjNames[0]]._subprojects.values()))
+        spA._status = Status.ZIPPEDCODE
+        spB = next(iter(cfgB._projects[prjNames[1]]._subprojects.values()))
+        spB._status = Status.CLEARED
+        saveConfig(self.scaffold_home_dir, cfgA, prjNames[0])
+        saveConfig(self.scaffold_home_dir, cfgB, prjNames[1])
+
+        cfg = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        self.assertEqual(Status.ZIPPEDCODE, cfg._projects[prjNames[0]]._subprojects[spA._name]._status)
+        self.assertEqual(Status.CLEARED, cfg._projects[prjNames[1]]._subprojects[spB._name]._status)
+
+    def test_journal_survives_other_project_save(self):
+        # operator A journals progress on one project and then crashes,
+        # while operator B backs up the config and saves another project
+        cfgA = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        cfgB = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        prjNames = list(cfgA._projects.keys())[:2]
+        prjA = cfgA._projects[prjNames[0]]
+        spA = next(iter(prjA._subprojects.values()))
+        saveBackupConfig(self.scaffold_home_dir, cfgA)
+        spA._status = Status.ZIPPEDCODE
+        saveState(self.scaffold_home_dir, cfgA, prjA, spA)
+        cfgA._journals[prjA._name].close()
+
+        saveBackupConfig(self.scaffold_home_dir, cfgB)
+        spB = next(iter(cfgB._projects[prjNames[1]]._subprojects.values()))
+        spB._status = Status.CLEARED
+        saveConfig(self.scaffold_home_dir, cfgB, prjNames[1])
+        self.assertGreater(cfgB._version, cfgA._version)
+
+        # A's journaled progress is still replayed, along with B's save
+        cfg = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        self.assertEqual(Status.ZIPPEDCODE, cfg._projects[prjNames[0]]._subprojects[spA._name]._status)
+        self.assertEqual(Status.CLEARED, cfg._projects[prjNames[1]]._subprojects[spB._name]._status)
+
+        # but once A's project has been saved, records journaled before
+        # that (e.g. left behind by a crash before the journal was removed)
+        # aren't replayed over it
+        cfg._projects[prjNames[0]]._subprojects[spA._name]._status = Status.UPLOADEDCODE
+        saveConfig(self.scaffold_home_dir, cfg, prjNames[0])
+        cfgA._journals.clear()
+        saveState(self.scaffold_home_dir, cfgA, prjA, spA)
+        cfgA._journals[prjA._name].close()
+        cfg = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        self.assertEqual(Status.UPLOADEDCODE, cfg._projects[prjNames[0]]._subprojects[spA._name]._status)
+
+    def test_backup_config(self):
+        # two operators back up the config before running different
+        # projects, and neither backup overwrites the other
+        cfgA = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        cfgB = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        version = cfgA._version
+        prjNames = list(cfgA._projects.keys())[:2]
+        saveBackupConfig(self.scaffold_home_dir, cfgA)
+        spA = next(iter(cfgA._projects[prjNames[0]]._subprojects.values()))
+        spA._status = Status.ZIPPEDCODE
+        saveConfig(self.scaffold_home_dir, cfgA, prjNames[0])
+        saveBackupConfig(self.scaffold_home_dir, cfgB)
+
+        backupDir = os.path.join(self.config_month_dir, "backup")
+        self.assertEqual([f"config-{version}.json", f"config-{version + 1}.json"], sorted(os.listdir(backupDir)))
+        with open(os.path.join(backupDir, f"config-{version + 1}.json"), "r") as f:
+            self.assertIn("ZIPPEDCODE", f.read())
+        self.assertEqual(version + 2, cfgB._version)
+
+        # and backing up again without saving in between doesn't overwrite
+        # the last backup either
+        saveBackupConfig(self.scaffold_home_dir, cfgA)
+        self.assertEqual(3, len(os.listdir(backupDir)))
+        self.assertEqual(version + 3, cfgA._version)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import unittest
+from unittest import mock
+import io
+import os
+import tempfile
+import zipfile
+import zlib
+
+import parallelzip
+from config import loadConfig
+from datatypes import ZipCompressionPolicy
+from parallelzip import ParallelZipWriter, getCategory, describeStats, getFileSha256
+
+SECRET_FILE_NAME = ".test-scaffold-secrets.json"
+TEST_SCAFFOLD_HOME = os.path.join(os.path.dirname(__file__), "testresources", "scaffoldhome")
+
+'''
+Tests writing zip files with compression in worker threads
+'''
+class TestParallelZip(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.src_dir = os.path.join(self.temp_dir.name, "src")
+        os.makedirs(os.path.join(self.src_dir, "sub"))
+        self.contents = {}
+        for i in range(40):
+            rpath = f"sub/file{i}.txt" if i % 2 else f"file{i}.txt"
+            self.contents[rpath] = (f"line {i}\n" * (i * 50)).encode("utf-8")
+            with open(os.path.join(self.src_dir, rpath), "wb") as f:
+                f.write(self.contents[rpath])
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_write_in_order(self):
+        zf_path = os.path.join(self.temp_dir.name, "out.zip")
+        with ParallelZipWriter(zf_path, 4) as zf:
+            for rpath in self.contents:
+                zf.write(os.path.join(self.src_dir, rpath), arcname=rpath)
+        with zipfile.ZipFile(zf_path) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(list(self.contents.keys()), zf.namelist())
+            for info in zf.infolist():
+                self.assertEqual(zipfile.ZIP_DEFLATED, info.compress_type)
+                self.assertEqual(self.contents[info.filename], zf.read(info))
+            extract_dir = os.path.join(self.temp_dir.name, "extracted")
+            zf.extractall(extract_dir)
+        for rpath, data in self.contents.items():
+            with open(os.path.join(extract_dir, rpath), "rb") as f:
+                self.assertEqual(data, f.read())
+
+    def test_large_files_and_streams(self):
+        zf_path = os.path.join(self.temp_dir.name, "out.zip")
+        names = list(self.contents.keys())
+        # make every other file "large", so that they are written in between
+        # entries that are compressed by workers
+        with mock.patch.object(parallelzip, "LARGE_FILE_SIZE", 1000):
+            with ParallelZipWriter(zf_path, 3) as zf:
+                for rpath in names[:20]:
+                    zf.write(os.path.join(self.src_dir, rpath), arcname=rpath)
+                for rpath in names[20:]:
+                    zinfo = zipfile.ZipInfo(rpath, date_time=(2023, 7, 1, 0, 0, 0))
+                    if len(self.contents[rpath]) > 5000:
+                        zf.writestream(zinfo, io.BytesIO(self.contents[rpath]))
+                    else:
+                        zf.writestr(zinfo, self.contents[rpath])
+        with zipfile.ZipFile(zf_path) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(names, zf.namelist())
+            for rpath in names:
+                self.assertEqual(self.contents[rpath], zf.read(rpath))
+
+    def test_categories(self):
+        policy = ZipCompressionPolicy()
+        self.assertEqual("compressed", getCategory(policy, "lib/x.JAR", b"anything"))
+        self.assertEqual("compressed", getCategory(policy, "no-extension", b"\x1f\x8b\x08\x00"))
+        self.assertEqual("compressed", getCategory(policy, "a.bin", b"PK\x03\x04rest"))
+        self.assertEqual("binary", getCategory(policy, "a.bin", b"\x7fELF\x02\x01\x00"))
+        self.assertEqual("text", getCategory(policy, "main.c", b"int main() {}\n"))
+        self.assertEqual("text", getCategory(policy, "BZh.txt", b"BZh is not bzip2"))
+        policy._compressed_extensions = [".dat"]
+        self.assertEqual("compressed", getCategory(policy, "x.dat", b"text"))
+
+    def test_store_compressed_formats(self):
+        zf_path = os.path.join(self.temp_dir.name, "out.zip")
+        already = zlib.compress(b"x" * 10000)
+        policy = ZipCompressionPolicy()
+        policy._levels["text"] = 9
+        with mock.patch.object(parallelzip, "LARGE_FILE_SIZE", 5000):
+            with ParallelZipWriter(zf_path, 2, policy) as zf:
+                zf.writestr(zipfile.ZipInfo("a.gz"), already)
+                zf.writestr(zipfile.ZipInfo("a.txt"), b"hello " * 1000)
+                big_path = os.path.join(self.temp_dir.name, "big.png")
+                with open(big_path, "wb") as f:
+                    f.write(b"\x89PNG\r\n\x1a\n" + b"\x00" * 10000)
+                zf.write(big_path, arcname="big.png")
+                zf.writestream(zipfile.ZipInfo("stream.txt"), io.BytesIO(b"abc " * 5000))
+        stats = zf.getStats()
+        self.assertEqual((2, len(already) + 10008, len(already) + 10008), stats["compressed"])
+        self.assertEqual(2, stats["text"][0])
+        self.assertLess(stats["text"][2], stats["text"][1] / 10)
+        self.assertIn("4 files", describeStats(stats))
+        with zipfile.ZipFile(zf_path) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zipfile.ZIP_STORED, zf.getinfo("a.gz").compress_type)
+            self.assertEqual(zipfile.ZIP_STORED, zf.getinfo("big.png").compress_type)
+            self.assertEqual(zipfile.ZIP_DEFLATED, zf.getinfo("a.txt").compress_type)
+            self.assertEqual(zipfile.ZIP_DEFLATED, zf.getinfo("stream.txt").compress_type)
+            self.assertEqual(already, zf.read("a.gz"))
+            self.assertEqual(b"abc " * 5000, zf.read("stream.txt"))
+
+    def test_deterministic(self):
+        digests = []
+        manifests = []
+        for jobs, mtime in [(1, 1000000000), (4, 1600000000)]:
+            for rpath in self.contents:
+                os.utime(os.path.join(self.src_dir, rpath), (mtime, mtime))
+            zf_path = os.path.join(self.temp_dir.name, f"out-{jobs}.zip")
+            with ParallelZipWriter(zf_path, jobs, deterministic=True) as zf:
+                for rpath in sorted(self.contents):
+                    zf.write(os.path.join(self.src_dir, rpath), arcname=rpath)
+            digests.append(getFileSha256(zf_path))
+            manifests.append(zf.getManifestSha256())
+        self.assertEqual(digests[0], digests[1])
+        self.assertEqual(manifests[0], manifests[1])
+
+        # the manifest doesn't depend on the order, or on timestamps
+        zf_path = os.path.join(self.temp_dir.name, "out-reversed.zip")
+        with ParallelZipWriter(zf_path, 2) as zf:
+            for rpath in reversed(list(self.contents)):
+                zf.write(os.path.join(self.src_dir, rpath), arcname=rpath)
+        self.assertEqual(manifests[0], zf.getManifestSha256())
+        self.assertNotEqual(digests[0], getFileSha256(zf_path))
+        self.assertEqual(len(self.contents), len(zf.getManifest().splitlines()))
+
+    def test_zipfile_internals(self):
+        # appendCompressed is only used on the Python versions it has been
+        # checked against; elsewhere ZipFile.open does the compressing, and
+        # either way gives the same zip file
+        lowest, highest = parallelzip.ZIPFILE_INTERNALS_VERSIONS
+        for version, expected in [(lowest, True), (highest, True), ((3, 8), False), ((highest[0], highest[1] + 1), False)]:
+            with mock.patch.object(parallelzip.sys, "version_info", version + (0, "final", 0)):
+                self.assertEqual(expected, parallelzip.canAppendCompressed())
+
+        digests = []
+        for precompress in [True, False]:
+            zf_path = os.path.join(self.temp_dir.name, f"out-{precompress}.zip")
+            with mock.patch.object(parallelzip, "canAppendCompressed", lambda: precompress), \
+                    mock.patch.object(parallelzip, "LARGE_FILE_SIZE", 1000):
+                with ParallelZipWriter(zf_path, 2, deterministic=True) as zf:
+                    self.assertEqual(precompress, zf._precompress)
+                    for rpath in sorted(self.contents):
+                        zf.write(os.path.join(self.src_dir, rpath), arcname=rpath)
+                    zf.writestr(zipfile.ZipInfo("empty.txt"), b"")
+            with zipfile.ZipFile(zf_path) as zf:
+                self.assertIsNone(zf.testzip())
+                for rpath, data in self.contents.items():
+                    self.assertEqual(data, zf.read(rpath))
+            digests.append(getFileSha256(zf_path))
+        self.assertEqual(digests[0], digests[1])
+
+    def test_config(self):
+        cfg_file = os.path.join(TEST_SCAFFOLD_HOME, "2023-07", "config.json")
+        cfg = loadConfig(cfg_file, TEST_SCAFFOLD_HOME, SECRET_FILE_NAME)
+        self.assertEqual({"compressed": 0, "text": 6, "binary": 6}, cfg._zip_compression._levels)
+        self.assertEqual([], cfg._zip_compression._compressed_extensions)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+from unittest import mock
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from config import loadConfig
+from datatypes import NO_FINDINGS, SLMCategoryConfig, SLMLicenseConfig, Status
+from parsespdx import MD5_EMPTY_FILE, NoLicenseFoundMatcher, doParseSPDXForSubproject, getNoLicenseFoundMatcher
+from slm.tvParser import ParsedFileData, TVParser
+from slm.tvReader import TVReader
+from slmjson import loadSLMCategories
+
+SECRET_FILE_NAME = ".test-scaffold-secrets.json"
+TEST_SCAFFOLD_HOME = os.path.join(os.path.dirname(__file__), "testresources", "scaffoldhome")
+TEST_SPDX_FILE = os.path.join(os.path.dirname(__file__), "testresources", "flexmeasures-2024-08-21.spdx")
+TEST_MONTH = "2023-07"
+
+'''
+Tests reading and parsing SPDX tag-value files into SLM JSON data
+'''
+class TestParseSPDX(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.scaffold_home_dir = os.path.join(self.temp_dir.name, "scaffold")
+        shutil.copytree(TEST_SCAFFOLD_HOME, self.scaffold_home_dir)
+        cfg_file = os.path.join(self.scaffold_home_dir, TEST_MONTH, "config.json")
+        self.cfg = loadConfig(cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        self.cfg._storepath = self.scaffold_home_dir
+        self.prj = self.cfg._projects['prj1']
+        self.sp = self.prj._subprojects['sp1']
+        self.sp._status = Status.GOTSPDX
+        self.sp._code_pulled = "2024-08-21"
+        spdxFolder = os.path.join(self.scaffold_home_dir, TEST_MONTH, "spdx", self.prj._name)
+        os.makedirs(spdxFolder, exist_ok=True)
+        shutil.copyfile(TEST_SPDX_FILE, os.path.join(spdxFolder, "sp1-2024-08-21.spdx"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def readAll(self, lines):
+        # the original way: read every pair, then parse them all
+        reader = TVReader()
+        for line in lines:
+            reader.readNextLine(line)
+        parser = TVParser()
+        for tag, value in reader.finalize():
+            parser.parseNextPair(tag, value)
+        return parser.finalize()
+
+    def test_streaming_matches_list(self):
+        with open(TEST_SPDX_FILE, 'r') as f:
+            expected = self.readAll(f)
+        with open(TEST_SPDX_FILE, 'r') as f:
+            reader = TVReader(TVParser.TAGS)
+            parser = TVParser()
+            streamed = list(parser.parsePairs(reader.readLines(f)))
+        self.assertFalse(reader.isError())
+        self.assertFalse(parser.isError())
+        self.assertEqual(630, len(streamed))
+        self.assertEqual([(fd.path, fd.license, fd.sha1, fd.md5) for fd in expected],
+            [(fd.path, fd.license, fd.sha1, fd.md5) for fd in streamed])
+
+    def test_skips_unused_tags(self):
+        lines = io.StringIO("Creator: Tool: fossology\nCreatorComment: <text>\nlots of\ntext\n</text>\n"
+            "FileName: ./a.c\nFileComment: <text>not kept</text>\nLicenseConcluded: MIT\n")
+        reader = TVReader(TVParser.TAGS)
+        self.assertEqual([("FileName", "./a.c"), ("LicenseConcluded", "MIT")], list(reader.readLines(lines)))
+
+    def test_read_error(self):
+        reader = TVReader(TVParser.TAGS)
+        pairs = list(reader.readLines(io.StringIO("FileName: ./a.c\nFileCopyrightText: <text>\nnever closed\n")))
+        self.assertEqual([("FileName", "./a.c")], pairs)
+        self.assertTrue(reader.isError())
+        self.assertEqual("No closing </text> tag found", reader.errorMessage)
+        reader = TVReader(TVParser.TAGS)
+        list(reader.readLines(io.StringIO("FileName: ./a.c\nno colon here\nLicenseConcluded: MIT\n")))
+        self.assertEqual("No colon found at line 2: 'no colon here'", reader.errorMessage)
+
+    def test_reader_skips_text(self):
+        lines = io.StringIO("FileName: ./a.c\nFileCopyrightText: <text>\nFileName: ./not-a-file.c\n</text>\n"
+            "LicenseConcluded: MIT\nFileChecksum: SHA1: 1234\n# FileName: <text> in a comment\n"
+            "FileName: ./b.c\nLicenseConcluded: <text>Apache-2.0</text>\n")
+        reader = TVReader(TVParser.TAGS)
+        parser = TVParser()
+        fdList = list(parser.parsePairs(reader.readLines(lines)))
+        self.assertFalse(reader.isError())
+        self.assertFalse(parser.isError())
+        self.assertEqual([("./a.c", "MIT", "1234"), ("./b.c", "Apache-2.0", "")],
+            [(fd.path, fd.license, fd.sha1) for fd in fdList])
+
+    def test_no_license_found_matcher(self):
+        self.prj._slm_extensions_skip = ["json", "/fixtures/*", "LICENSE="]
+        self.prj._slm_thirdparty_dirs = ["/vendor/"]
+        matcher = NoLicenseFoundMatcher(self.prj)
+        results = []
+        for path, lic, md5 in [("./a/Data.JSON", "No license found", ""), ("./test/Fixtures/a.c", "No license found", ""),
+                ("./pkg/license", "No license found", ""), ("./vendor/b.go", "No license found", MD5_EMPTY_FILE),
+                ("./Vendor/b.go", "No license found", ""), ("./vendor/c.json", "MIT", MD5_EMPTY_FILE)]:
+            fd = ParsedFileData()
+            fd.path = path
+            fd.license = lic
+            fd.md5 = md5
+            matcher.apply(fd)
+            results.append((fd.finding_extensions, fd.finding_thirdparty, fd.finding_emptyfile))
+        self.assertEqual([("yes", "", ""), ("yes", "", ""), ("yes", "", ""), ("", "yes", "yes"), ("", "", ""), ("", "", "")], results)
+
+    def test_no_license_found_matcher_cached(self):
+        self.prj._slm_extensions_skip = ["json"]
+        self.prj._slm_thirdparty_dirs = ["/vendor/"]
+        matcher = getNoLicenseFoundMatcher(self.prj)
+        self.assertIs(matcher, getNoLicenseFoundMatcher(self.prj))
+        # changing the project's rules compiles them again
+        self.prj._slm_thirdparty_dirs = ["/third_party/"]
+        recompiled = getNoLicenseFoundMatcher(self.prj)
+        self.assertIsNot(matcher, recompiled)
+        fd = ParsedFileData()
+        fd.path = "./third_party/a.c"
+        fd.license = "No license found"
+        recompiled.apply(fd)
+        self.assertEqual("yes", fd.finding_thirdparty)
+
+    def test_parse_spdx(self):
+        with mock.patch("builtins.print"):
+            self.assertFalse(doParseSPDXForSubproject(self.cfg, self.prj, self.sp))
+        self.assertEqual(["CC-BY-3.0 AND MIT AND OFL-1.1"], self.sp._slm_pending_lics)
+
+        # categorize the missing license, and try again
+        cat = SLMCategoryConfig()
+        cat._name = "Other"
+        lic = SLMLicenseConfig()
+        lic._name = "CC-BY-3.0 AND MIT AND OFL-1.1"
+        cat._license_configs.append(lic)
+        self.prj._slm_policies["apache"]._category_configs.append(cat)
+        with mock.patch("builtins.print"):
+            self.assertTrue(doParseSPDXForSubproject(self.cfg, self.prj, self.sp))
+        self.assertEqual(Status.PARSEDSPDX, self.sp._status)
+        with open(self.sp._slm_report_json, 'r') as f:
+            cats = json.load(f)
+        numfiles = {cat["name"]: cat["numFiles"] for cat in cats}
+        self.assertEqual({"Project Licenses": 9, "Attribution": 2, "No license found": 618, "Other": 1}, numfiles)
+
+        # files without findings share NO_FINDINGS, and have none in the JSON
+        loaded = loadSLMCategories(self.prj, self.sp, self.sp._slm_report_json)
+        files = [fi for cat in loaded for lic in cat._licenses for fi in lic._files]
+        self.assertEqual(630, len(files))
+        noFindings = [fi for fi in files if fi._findings is NO_FINDINGS]
+        self.assertTrue(len(noFindings) > 0)
+        jsonFiles = [f for cat in cats for lic in cat["licenses"] for f in lic["files"]]
+        self.assertEqual(len(noFindings), len([f for f in jsonFiles if "findings" not in f]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import threading
+import time
+
+from poller import Poller, chain
+
+'''
+Tests watching many things at once with a Poller
+'''
+class TestPoller(unittest.TestCase):
+
+    def setUp(self):
+        self.poller = Poller(0.01, 0.05)
+
+    def countdown(self, n, result):
+        remaining = [n]
+        def check():
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return False, None
+            return True, result
+        return check
+
+    def test_many_watches(self):
+        futures = [self.poller.watch(self.countdown(i % 5 + 1, i)) for i in range(50)]
+        self.assertEqual(list(range(50)), [f.result(timeout=10) for f in futures])
+        self.assertEqual(0, self.poller.pending())
+
+    def test_backoff(self):
+        poller = Poller(0.01, 0.04, factor=2.0, jitter=0.0)
+        times = []
+        lock = threading.Lock()
+        def check():
+            with lock:
+                times.append(time.monotonic())
+            return len(times) >= 5, len(times)
+        self.assertEqual(5, poller.watch(check).result(timeout=10))
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        # 0.02, 0.04, then capped at 0.04
+        self.assertGreaterEqual(gaps[0], 0.015)
+        self.assertGreaterEqual(gaps[-1], 0.035)
+
+    def test_exception(self):
+        def check():
+            raise ValueError("server went away")
+        future = self.poller.watch(check)
+        with self.assertRaises(ValueError):
+            future.result(timeout=10)
+        # the poller keeps going after a check fails
+        self.assertEqual("ok", self.poller.watch(self.countdown(2, "ok")).result(timeout=10))
+
+    def test_chain(self):
+        future = chain(self.poller.watch(self.countdown(2, 3)), lambda f: f.result() * 2)
+        self.assertEqual(6, future.result(timeout=10))
+        failed = chain(self.poller.watch(self.countdown(1, 3)), lambda f: 1 / 0)
+        with self.assertRaises(ZeroDivisionError):
+            failed.result(timeout=10)
+
+if __name__ == '__main__':
+    unittest.main()
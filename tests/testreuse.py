@@ -0,0 +1,136 @@
+import unittest
+import unittest.mock
+import json
+import os
+import tempfile
+import shutil
+
+import git
+
+import gitcache
+import reuse
+from config import loadConfig, getConfigFilename, ConfigJSONEncoder
+from datatypes import Status
+
+SECRET_FILE_NAME = ".test-scaffold-secrets.json"
+TEST_SCAFFOLD_HOME = os.path.join(os.path.dirname(__file__), "testresources", "scaffoldhome")
+TEST_MONTH = "2023-07"
+PRIOR_MONTH = "2023-06"
+PRIOR_PULLED = "2023-06-05"
+
+'''
+Tests reusing last month's results for subprojects whose repos haven't
+changed, using local repos in place of GitHub
+'''
+class TestReuse(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.scaffold_home_dir = os.path.join(self.temp_dir.name, "scaffold")
+        shutil.copytree(TEST_SCAFFOLD_HOME, self.scaffold_home_dir)
+        self.config_month_dir = os.path.join(self.scaffold_home_dir, TEST_MONTH)
+        cfg_file = os.path.join(self.config_month_dir, "config.json")
+        self.cfg = loadConfig(cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        self.cfg._storepath = self.scaffold_home_dir
+        self.cfg._zippath = os.path.join(self.temp_dir.name, "zipped")
+        self.cfg._reuse_unchanged = True
+        self.prj = self.cfg._projects["prj1"]
+        self.sp = self.prj._subprojects["sp1"]
+        self.sp._repos = ["repo1", "repo2"]
+        self.sp._status = Status.GOTLISTING
+
+        # local repos standing in for the upstream ones
+        self.upstreams = {}
+        self.heads = {}
+        for repo in self.sp._repos:
+            upstream_path = os.path.join(self.temp_dir.name, "upstream", repo)
+            os.makedirs(upstream_path)
+            self.upstreams[repo] = git.Repo.init(upstream_path, initial_branch="main")
+            self.heads[repo] = self.commitFile(repo, "a.txt", "one")
+
+    def tearDown(self):
+        for upstream in self.upstreams.values():
+            upstream.close()
+        self.temp_dir.cleanup()
+
+    def commitFile(self, repo, filename, contents):
+        upstream = self.upstreams[repo]
+        with open(os.path.join(upstream.working_dir, filename), "w") as f:
+            f.write(contents)
+        upstream.index.add([filename])
+        actor = git.Actor("Test", "test@example.com")
+        return upstream.index.commit(f"add {filename}", author=actor, committer=actor).hexsha
+
+    def getRepoURL(self, prj, sp, repo):
+        return f"file://{self.upstreams[repo].working_dir}"
+
+    # writes last month's config.json and results, as if sp1 had been
+    # parsed from the current heads of its repos
+    def writePriorMonth(self, status=Status.PARSEDSPDX):
+        js = json.loads(json.dumps(self.cfg, cls=ConfigJSONEncoder))
+        js["config"]["month"] = PRIOR_MONTH
+        prior_zip = os.path.join(self.cfg._zippath, PRIOR_MONTH, "code", "prj1", "sp1", f"sp1-{PRIOR_PULLED}.zip")
+        prior_spdx = os.path.join(self.scaffold_home_dir, PRIOR_MONTH, "spdx", "prj1", f"sp1-{PRIOR_PULLED}.spdx")
+        prior_json = os.path.join(self.scaffold_home_dir, PRIOR_MONTH, "report", "prj1", f"sp1-{PRIOR_PULLED}.json")
+        for path in [prior_zip, prior_spdx, prior_json]:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(os.path.basename(path))
+        sp_js = js["projects"]["prj1"]["subprojects"]["sp1"]
+        sp_js["status"] = status.name
+        sp_js["code"] = {"anyfiles": True, "pulled": PRIOR_PULLED, "path": prior_zip, "repos": dict(self.heads)}
+        sp_js["slm"]["report-json"] = prior_json
+        with open(getConfigFilename(self.scaffold_home_dir, PRIOR_MONTH), "w") as f:
+            json.dump(js, f)
+
+    def test_unchanged_repos(self):
+        self.writePriorMonth()
+        changed = self.commitFile("repo2", "b.txt", "two")
+        prior_prj = reuse.getPriorMonthProject(self.cfg, self.prj)
+        with unittest.mock.patch.object(gitcache, "getRepoURL", self.getRepoURL):
+            unchanged = reuse.findUnchangedRepos(self.prj, self.sp, prior_prj["subprojects"]["sp1"])
+        self.assertEqual({"repo1": self.heads["repo1"]}, unchanged)
+        self.assertNotEqual(changed, self.heads["repo2"])
+
+    def test_reuse_prior_month(self):
+        self.writePriorMonth()
+        with unittest.mock.patch.object(gitcache, "getRepoURL", self.getRepoURL), unittest.mock.patch("builtins.print"):
+            reused, unchanged = reuse.checkPriorMonth(self.cfg, self.prj, self.sp)
+        self.assertTrue(reused)
+        self.assertEqual(self.heads, unchanged)
+        self.assertEqual(Status.PARSEDSPDX, self.sp._status)
+        self.assertEqual(PRIOR_MONTH, self.sp._code_reused_from)
+        self.assertEqual(PRIOR_MONTH, json.loads(json.dumps(self.sp, cls=ConfigJSONEncoder))["code"]["reused-from"])
+        self.assertEqual(self.heads, self.sp._code_repos)
+        self.assertTrue(self.sp._code_anyfiles)
+        for path in [self.sp._code_path, self.sp._slm_report_json]:
+            self.assertTrue(os.path.isfile(path))
+        self.assertTrue(self.sp._code_path.startswith(os.path.join(self.cfg._zippath, TEST_MONTH)))
+        self.assertTrue(os.path.isfile(os.path.join(self.scaffold_home_dir, TEST_MONTH, "spdx", "prj1", f"sp1-{self.sp._code_pulled}.spdx")))
+
+    def test_reparse_if_policy_changed(self):
+        self.writePriorMonth()
+        self.prj._slm_extensions_skip = self.prj._slm_extensions_skip + ["changed"]
+        with unittest.mock.patch.object(gitcache, "getRepoURL", self.getRepoURL), unittest.mock.patch("builtins.print"):
+            reused, _ = reuse.checkPriorMonth(self.cfg, self.prj, self.sp)
+        self.assertTrue(reused)
+        self.assertEqual(Status.GOTSPDX, self.sp._status)
+
+    def test_no_reuse_if_changed_or_unfinished(self):
+        self.writePriorMonth(Status.CLEARED)
+        with unittest.mock.patch.object(gitcache, "getRepoURL", self.getRepoURL):
+            reused, unchanged = reuse.checkPriorMonth(self.cfg, self.prj, self.sp)
+        self.assertFalse(reused)
+        self.assertEqual(self.heads, unchanged)
+        self.writePriorMonth()
+        self.commitFile("repo1", "b.txt", "two")
+        with unittest.mock.patch.object(gitcache, "getRepoURL", self.getRepoURL):
+            reused, unchanged = reuse.checkPriorMonth(self.cfg, self.prj, self.sp)
+        self.assertFalse(reused)
+        self.assertEqual(["repo2"], list(unchanged.keys()))
+        self.assertEqual(Status.GOTLISTING, self.sp._status)
+        self.cfg._reuse_unchanged = False
+        self.assertEqual((False, {}), reuse.checkPriorMonth(self.cfg, self.prj, self.sp))
+
+if __name__ == '__main__':
+    unittest.main()
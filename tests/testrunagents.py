@@ -0,0 +1,52 @@
+import unittest
+from unittest import mock
+
+import requests
+
+import runagents
+from poller import Poller
+from runagents import watchJob
+
+'''
+Tests watching Fossology scanning jobs, with a fake Fossology server
+'''
+class TestRunAgents(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mock.Mock()
+        self.server.api = "https://fossology.example.org/api/v1"
+        self.job = mock.Mock()
+        self.job.id = 9
+        self.job.status = "Queued"
+        # check on jobs without waiting around
+        self.poller_patch = mock.patch.object(runagents, "getPoller", return_value=Poller(0.01, 0.05))
+        self.poller_patch.start()
+
+    def tearDown(self):
+        self.poller_patch.stop()
+
+    def response(self, status_code, status="Processing"):
+        response = mock.Mock()
+        response.status_code = status_code
+        response.json.return_value = {"id": 9, "name": "sp1", "queueDate": "2023-07-09", "uploadId": 42,
+            "userId": 2, "groupId": 2, "eta": 0, "status": status}
+        return response
+
+    def test_watch_job_retries_errors(self):
+        self.server.session.get.side_effect = [self.response(200), requests.exceptions.ConnectionError("connection reset"),
+            self.response(502), self.response(200), self.response(503), self.response(200, "Completed")]
+        with mock.patch("builtins.print"):
+            detail = watchJob(self.server, self.job, "prj1/sp1").result(timeout=10)
+        self.assertEqual("Completed", detail.status)
+        self.assertEqual(6, self.server.session.get.call_count)
+
+    def test_watch_job_gives_up(self):
+        self.server.session.get.side_effect = [self.response(200)] + [self.response(500)] * (runagents.JOB_CHECK_RETRIES + 1)
+        with mock.patch("builtins.print"):
+            with self.assertRaises(Exception) as cm:
+                watchJob(self.server, self.job, "prj1/sp1").result(timeout=10)
+        self.assertIn("status code 500", str(cm.exception))
+        self.assertEqual(runagents.JOB_CHECK_RETRIES + 2, self.server.session.get.call_count)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+import unittest
+import os
+import tempfile
+import shutil
+import time
+from unittest import mock
+
+import runners
+import stages
+from config import loadConfig
+from datatypes import Status
+from poller import Poller, chain, completed
+from scaffold import parseOptions
+from scheduler import StageScheduler
+
+SECRET_FILE_NAME = ".test-scaffold-secrets.json"
+TEST_SCAFFOLD_HOME = os.path.join(os.path.dirname(__file__), "testresources", "scaffoldhome")
+TEST_MONTH = "2023-07"
+
+'''
+Tests the runner framework, including running subprojects concurrently
+'''
+class TestRunners(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.scaffold_home_dir = os.path.join(self.temp_dir.name, "scaffold")
+        shutil.copytree(TEST_SCAFFOLD_HOME, self.scaffold_home_dir)
+        self.config_month_dir = os.path.join(self.scaffold_home_dir, TEST_MONTH)
+        cfg_file = os.path.join(self.config_month_dir, "config.json")
+        self.cfg = loadConfig(cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        self.cfg._storepath = self.scaffold_home_dir
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_parse_options(self):
+        args, options = parseOptions(["scaffold.py", "2023-07", "run", "--jobs", "4", "prj1"])
+        self.assertEqual(["scaffold.py", "2023-07", "run", "prj1"], args)
+        self.assertEqual(4, options["jobs"])
+        args, options = parseOptions(["scaffold.py", "2023-07", "run", "prj1", "--jobs=2"])
+        self.assertEqual(["scaffold.py", "2023-07", "run", "prj1"], args)
+        self.assertEqual(2, options["jobs"])
+        args, options = parseOptions(["scaffold.py", "2023-07", "status"])
+        self.assertEqual(1, options["jobs"])
+        with self.assertRaises(ValueError):
+            parseOptions(["scaffold.py", "2023-07", "run", "--jobs", "0"])
+        with self.assertRaises(ValueError):
+            parseOptions(["scaffold.py", "2023-07", "run", "--unknown"])
+
+    def test_parallel_combined_barrier(self):
+        prj = self.cfg._projects['prj-private-sbom']
+        prj._slm_combined_report = True
+        prj._status = Status.GOTSPDX
+        for sp in prj._subprojects.values():
+            sp._status = Status.GOTSPDX
+        combinedCalls = []
+
+        def fakeStep(cfg, prj, sp):
+            # make the subprojects finish in a different order than listed
+            time.sleep(0.01 * len(sp._name) % 0.05)
+            sp._status = Status.PARSEDSPDX
+            return True
+
+        def fakeCombined(cfg, prj):
+            combinedCalls.append([sp._status for sp in prj._subprojects.values()])
+            prj._status = Status.PARSEDSPDX
+            return True
+
+        with mock.patch.object(stages.GITHUB_STAGES[Status.GOTSPDX], "_runner", fakeStep), \
+                mock.patch.object(stages.GITHUB_STAGES[Status.PARSEDSPDX], "_runner", lambda cfg, prj, sp: False), \
+                mock.patch.object(stages.PROJECT_BARRIERS[0], "_action", fakeCombined), \
+                mock.patch.object(stages.PROJECT_BARRIERS[1], "_action", lambda cfg, prj: False):
+            runners.doNextThing(self.scaffold_home_dir, self.cfg, None, prj._name, "", 3)
+
+        self.assertEqual(1, len(combinedCalls))
+        for status in combinedCalls[0]:
+            self.assertEqual(Status.PARSEDSPDX, status)
+        for sp in prj._subprojects.values():
+            self.assertEqual(Status.PARSEDSPDX, sp._status)
+        self.assertEqual(Status.PARSEDSPDX, prj._status)
+
+    def test_two_ready_barriers(self):
+        prj = self.cfg._projects['prj-private-sbom']
+        prj._slm_combined_report = True
+        prj._status = Status.GOTSPDX
+        for sp in prj._subprojects.values():
+            sp._status = Status.CREATEDREPORTS
+        calls = []
+
+        def fakeCombinedJSON(cfg, prj):
+            calls.append("combinedjson")
+            # running this one makes the next one ready as well
+            prj._status = Status.PARSEDSPDX
+            return True
+
+        def fakeCombinedReport(cfg, prj):
+            calls.append("combinedreport")
+            prj._status = Status.CREATEDREPORTS
+            return True
+
+        with mock.patch.object(stages.PROJECT_BARRIERS[0], "_action", fakeCombinedJSON), \
+                mock.patch.object(stages.PROJECT_BARRIERS[1], "_action", fakeCombinedReport):
+            stages.updateProjectPostSubproject(self.cfg, prj)
+        # both run in one call, in order, and the later ones aren't ready
+        self.assertEqual(["combinedjson", "combinedreport"], calls)
+        self.assertEqual(Status.CREATEDREPORTS, prj._status)
+
+    def test_pending_stages_free_their_slot(self):
+        prj = self.cfg._projects['prj-private-sbom']
+        for sp in prj._subprojects.values():
+            sp._status = Status.UPLOADEDWS
+        poller = Poller(0.01, 0.02)
+        started = []
+
+        def fakeUpload(cfg, fossologyServer, prj, sp):
+            started.append(sp._name)
+            # the upload is only done once every subproject has started one,
+            # which can only happen if they don't each hold the one slot
+            def check():
+                return len(started) == len(prj._subprojects), True
+            def finish(done):
+                sp._status = Status.UPLOADEDCODE
+                return done.result()
+            return chain(poller.watch(check), finish)
+
+        with mock.patch.object(stages.GITHUB_STAGES[Status.UPLOADEDWS], "_starter", fakeUpload), \
+                mock.patch.object(stages.GITHUB_STAGES[Status.UPLOADEDCODE], "_starter", lambda cfg, fossologyServer, prj, sp: completed(False)):
+            scheduler = StageScheduler(self.scaffold_home_dir, self.cfg, None, 1)
+            self.assertTrue(scheduler.run(prj._name))
+
+        self.assertEqual(len(prj._subprojects), len(started))
+        for sp in prj._subprojects.values():
+            self.assertEqual(Status.UPLOADEDCODE, sp._status)
+        self.assertEqual({stage: 0 for stage in stages.RESOURCES}, scheduler._active)
+
+    def test_batch_agents(self):
+        self.cfg._batch_agents = True
+        prj = self.cfg._projects['prj-private-sbom']
+        for sp in prj._subprojects.values():
+            sp._status = Status.UPLOADEDCODE
+        poller = Poller(0.01, 0.02)
+        scheduled = []
+
+        def fakeRunAgents(cfg, fossologyServer, prj, sp):
+            scheduled.append(sp._name)
+            # the jobs only complete once all of them have been scheduled
+            def check():
+                return len(scheduled) == len(prj._subprojects), True
+            def finish(done):
+                sp._status = Status.RANAGENTS
+                return done.result()
+            return chain(poller.watch(check), finish)
+
+        with mock.patch.object(stages.GITHUB_STAGES[Status.UPLOADEDCODE], "_starter", fakeRunAgents), \
+                mock.patch("builtins.print"):
+            runners.doNextThing(self.scaffold_home_dir, self.cfg, None, prj._name, "", 1)
+
+        self.assertEqual(sorted(prj._subprojects), sorted(scheduled))
+        for sp in prj._subprojects.values():
+            self.assertEqual(Status.RANAGENTS, sp._status)
+        self.assertEqual(Status.RANAGENTS, prj._status)
+
+    def test_batched_statuses(self):
+        # reports are batched by default, and agents aren't
+        self.assertEqual([Status.CLEARED], runners.getBatchedStatuses(self.cfg))
+        self.cfg._batch_agents = True
+        self.assertEqual([Status.UPLOADEDCODE, Status.CLEARED], runners.getBatchedStatuses(self.cfg))
+        self.cfg._batch_reports = False
+        self.assertEqual([Status.UPLOADEDCODE], runners.getBatchedStatuses(self.cfg))
+
+    def test_ready_stages(self):
+        prj = self.cfg._projects['prj-private-sbom']
+        statuses = [Status.GOTLISTING, Status.RANAGENTS, Status.DELIVERED]
+        for sp, status in zip(prj._subprojects.values(), statuses):
+            sp._status = status
+        scheduler = StageScheduler(self.scaffold_home_dir, self.cfg, None, 2)
+        with mock.patch("builtins.print"):
+            ready = scheduler.getReadyStages([prj])
+        # manual stages and finished subprojects are never ready
+        self.assertEqual(1, len(ready))
+        for _, sp, stage in ready:
+            self.assertEqual(Status.GOTLISTING, sp._status)
+            self.assertEqual("getcode", stage._name)
+            self.assertEqual(stages.RESOURCE_IO, stage._resource)
+
+    def test_subproject_stages(self):
+        prj = self.cfg._projects['prj-private-sbom']
+        sp = next(iter(prj._subprojects.values()))
+        sp._status = Status.UPLOADEDCODE
+        self.assertEqual("runagents", stages.getSubprojectStage(prj, sp)._name)
+        sp._status = Status.STOPPED
+        self.assertIsNone(stages.getSubprojectStage(prj, sp))
+        sp._status = Status.FILEDTICKETS
+        self.assertTrue(stages.getSubprojectStage(prj, sp).isManual())
+
+if __name__ == '__main__':
+    unittest.main()
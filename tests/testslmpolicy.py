@@ -0,0 +1,61 @@
+import unittest
+
+from datatypes import SLMCategoryConfig, SLMLicenseConfig, SLMPolicy
+from slmpolicy import getCompiledPolicy
+
+'''
+Tests the lookups that are compiled once from an SLM policy
+'''
+class TestSLMPolicy(unittest.TestCase):
+
+    def category(self, name, licenses):
+        cat = SLMCategoryConfig()
+        cat._name = name
+        for licName, aliases in licenses:
+            lic = SLMLicenseConfig()
+            lic._name = licName
+            lic._aliases = aliases
+            cat._license_configs.append(lic)
+        return cat
+
+    def setUp(self):
+        self.policy = SLMPolicy()
+        self.policy._name = "apache"
+        self.policy._category_configs = [
+            self.category("Project Licenses", [("Apache-2.0", ["Apache-possibility"]), ("MIT", [])]),
+            self.category("Copyleft", [("GPL-2.0-only", ["GPL-2.0"])]),
+            self.category("No license found", [("No license found", ["NOASSERTION"])]),
+        ]
+        self.policy._flag_categories = ["Copyleft"]
+
+    def test_lookups(self):
+        compiled = getCompiledPolicy(self.policy)
+        self.assertEqual("GPL-2.0-only", compiled.getLicenseForAlias("GPL-2.0"))
+        self.assertEqual("MIT", compiled.getLicenseForAlias("MIT"))
+        self.assertEqual("Project Licenses", compiled.getCategoryForLicense("MIT"))
+        self.assertEqual("No license found", compiled.getCategoryForLicense("No license found"))
+        self.assertIsNone(compiled.getCategoryForLicense("BSD-3-Clause"))
+        self.assertTrue(compiled.isFlagCategory("Copyleft"))
+        self.assertFalse(compiled.isFlagCategory("Project Licenses"))
+        self.assertEqual(["Apache-2.0"], compiled._project_licenses)
+
+    def test_license_slots(self):
+        compiled = getCompiledPolicy(self.policy)
+        cats = compiled.buildCategories()
+        self.assertEqual(["Project Licenses", "Copyleft", "No license found"], [cat._name for cat in cats])
+        self.assertEqual(["Apache-2.0", "MIT"], [lic._name for lic in cats[0]._licenses])
+        cat, lic = compiled.getLicenseSlot(cats, "MIT")
+        self.assertIs(cats[0], cat)
+        self.assertIs(cats[0]._licenses[1], lic)
+        self.assertIsNone(compiled.getLicenseSlot(cats, "BSD-3-Clause"))
+
+    def test_shared_until_changed(self):
+        compiled = getCompiledPolicy(self.policy)
+        self.assertIs(compiled, getCompiledPolicy(self.policy))
+        self.policy._category_configs.append(self.category("Other", [("BSD-3-Clause", [])]))
+        recompiled = getCompiledPolicy(self.policy)
+        self.assertIsNot(compiled, recompiled)
+        self.assertEqual("Other", recompiled.getCategoryForLicense("BSD-3-Clause"))
+
+if __name__ == '__main__':
+    unittest.main()
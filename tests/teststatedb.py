@@ -0,0 +1,164 @@
+import unittest
+import os
+import tempfile
+import shutil
+import json
+import io
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+
+from config import loadConfig, saveConfig, saveState
+from datatypes import Status
+from metrics import getMetrics
+from scaffold import status
+
+SECRET_FILE_NAME = ".test-scaffold-secrets.json"
+TEST_SCAFFOLD_HOME = os.path.join(os.path.dirname(__file__), "testresources", "scaffoldhome")
+TEST_MONTH = "2023-07"
+
+'''
+Tests the SQLite state backend
+'''
+class TestStateDB(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.scaffold_home_dir = os.path.join(self.temp_dir.name, "scaffold")
+        shutil.copytree(TEST_SCAFFOLD_HOME, self.scaffold_home_dir)
+        self.config_month_dir = os.path.join(self.scaffold_home_dir, TEST_MONTH)
+        self.cfg_file = os.path.join(self.config_month_dir, "config.json")
+        # switch the test config over to the sqlite backend
+        cfg = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        cfg._state_backend = "sqlite"
+        saveConfig(self.scaffold_home_dir, cfg)
+        self.cfg = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+
+    def tearDown(self):
+        if self.cfg._statedb is not None:
+            self.cfg._statedb.close()
+        self.temp_dir.cleanup()
+
+    def test_save_and_overlay(self):
+        self.assertIsNotNone(self.cfg._statedb)
+        with open(self.cfg_file, 'r') as f:
+            original = f.read()
+        self.assertEqual("sqlite", json.loads(original)["config"]["stateBackend"])
+        prj = self.cfg._projects['prj-private-sbom']
+        sp = prj._subprojects['sp1']
+        sp._status = Status.ZIPPEDCODE
+        sp._code_path = "/tmp/sp1.zip"
+        saveState(self.scaffold_home_dir, self.cfg, prj, sp)
+
+        # config.json is untouched, but loading it overlays the database
+        with open(self.cfg_file, 'r') as f:
+            self.assertEqual(original, f.read())
+        cfg = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        sp2 = cfg._projects['prj-private-sbom']._subprojects['sp1']
+        self.assertEqual(Status.ZIPPEDCODE, sp2._status)
+        self.assertEqual("/tmp/sp1.zip", sp2._code_path)
+        self.assertEqual(list(prj._subprojects), list(cfg._projects['prj-private-sbom']._subprojects))
+        self.assertEqual([('prj-private-sbom', 'sp1', 'ZIPPEDCODE')],
+            self.cfg._statedb.listSubprojects('prj-private-sbom', ['ZIPPEDCODE']))
+        cfg._statedb.close()
+
+    def test_edited_config_is_imported(self):
+        prj = self.cfg._projects['prj-private-sbom']
+        sp = prj._subprojects['sp1']
+        sp._status = Status.ZIPPEDCODE
+        saveState(self.scaffold_home_dir, self.cfg, prj, sp)
+        saveConfig(self.scaffold_home_dir, self.cfg)
+
+        # editing config.json by hand after it was exported takes precedence
+        # over the database
+        with open(self.cfg_file, 'r') as f:
+            js = json.load(f)
+        js["projects"]["prj-private-sbom"]["subprojects"]["sp1"]["status"] = "CLEARED"
+        with open(self.cfg_file, 'w') as f:
+            json.dump(js, f, indent=4)
+        os.utime(self.cfg_file, ns=(0, 0))
+        cfg = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        self.assertEqual(Status.CLEARED, cfg._projects['prj-private-sbom']._subprojects['sp1']._status)
+        self.assertEqual('CLEARED', cfg._statedb.getSubprojectState('prj-private-sbom', 'sp1')['status'])
+        cfg._statedb.close()
+
+    def test_newer_rows_are_kept(self):
+        prj = self.cfg._projects['prj-private-sbom']
+        sp = prj._subprojects['sp1']
+        sp._status = Status.ZIPPEDCODE
+        saveState(self.scaffold_home_dir, self.cfg, prj, sp)
+
+        # another project's run merges its state into config.json, which
+        # must not replace the rows saved since the last export
+        other = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        other_prj = other._projects['prj1']
+        other_sp = other_prj._subprojects['sp1']
+        other_sp._status = Status.CLEARED
+        saveState(self.scaffold_home_dir, other, other_prj, other_sp)
+        saveConfig(self.scaffold_home_dir, other, 'prj1')
+        other._statedb.close()
+
+        # and neither does editing config.json by hand
+        with open(self.cfg_file, 'r') as f:
+            js = json.load(f)
+        js["projects"]["prj-private-sbom"]["subprojects"]["sp1"]["status"] = "DELIVERED"
+        js["projects"]["TEST-DEPENDENCIES"]["subprojects"]["sp1"]["status"] = "DELIVERED"
+        with open(self.cfg_file, 'w') as f:
+            json.dump(js, f, indent=4)
+        os.utime(self.cfg_file, ns=(0, 0))
+
+        cfg = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        self.assertEqual(Status.ZIPPEDCODE, cfg._projects['prj-private-sbom']._subprojects['sp1']._status)
+        self.assertEqual(Status.CLEARED, cfg._projects['prj1']._subprojects['sp1']._status)
+        self.assertEqual(Status.DELIVERED, cfg._projects['TEST-DEPENDENCIES']._subprojects['sp1']._status)
+        cfg._statedb.close()
+
+    def test_concurrent_writers(self):
+        prj = self.cfg._projects['prj-private-sbom']
+
+        def advance(sp):
+            for status in [Status.GOTCODE, Status.ZIPPEDCODE, Status.UPLOADEDWS]:
+                sp._status = status
+                saveState(self.scaffold_home_dir, self.cfg, prj, sp)
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            list(executor.map(advance, prj._subprojects.values()))
+        rows = self.cfg._statedb.listSubprojects('prj-private-sbom')
+        self.assertEqual(len(prj._subprojects), len(rows))
+        for row in rows:
+            self.assertEqual('UPLOADEDWS', row[2])
+
+    def test_no_wal(self):
+        # WAL isn't safe on a network filesystem, so state.db never uses it
+        mode = self.cfg._statedb._conn().execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual("delete", mode)
+        self.assertFalse(os.path.exists(os.path.join(self.config_month_dir, "state.db-wal")))
+
+    def test_state_only_commands(self):
+        prj = self.cfg._projects['prj-private-sbom']
+        sp = prj._subprojects['sp1']
+        sp._status = Status.ZIPPEDCODE
+        saveState(self.scaffold_home_dir, self.cfg, prj, sp)
+
+        # status and getmetrics query the database instead of loading projects
+        cfg = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME, stateOnly=True)
+        self.assertEqual({}, cfg._projects)
+        out = io.StringIO()
+        with redirect_stdout(out):
+            status(cfg, "prj-private-sbom", "")
+            all_metrics = getMetrics(cfg, None, self.scaffold_home_dir)
+        self.assertIn("sp1", out.getvalue())
+        self.assertIn("ZIPPEDCODE", out.getvalue())
+        self.assertEqual({'TEST-DEPENDENCIES', 'prj1', 'prj-private-sbom'}, set(all_metrics))
+        sp_metrics = all_metrics['prj-private-sbom']['sp1']
+        self.assertEqual("inproc", sp_metrics._state_category)
+        self.assertEqual(len(sp._repos), sp_metrics._num_repos)
+        cfg._statedb.close()
+
+        # printlinks only needs its own project
+        cfg = loadConfig(self.cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME, stateOnly=True, prj_only='prj-private-sbom')
+        self.assertEqual(['prj-private-sbom'], list(cfg._projects))
+        self.assertEqual(Status.ZIPPEDCODE, cfg._projects['prj-private-sbom']._subprojects['sp1']._status)
+        cfg._statedb.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import os
+import tempfile
+import shutil
+from unittest import mock
+
+from config import loadConfig
+from timings import timedSpan, loadTimings, aggregateTimings, getTimingsFilename, printProfile
+
+SECRET_FILE_NAME = ".test-scaffold-secrets.json"
+TEST_SCAFFOLD_HOME = os.path.join(os.path.dirname(__file__), "testresources", "scaffoldhome")
+TEST_MONTH = "2023-07"
+
+'''
+Tests recording and summarizing stage timings
+'''
+class TestTimings(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.scaffold_home_dir = os.path.join(self.temp_dir.name, "scaffold")
+        shutil.copytree(TEST_SCAFFOLD_HOME, self.scaffold_home_dir)
+        self.config_month_dir = os.path.join(self.scaffold_home_dir, TEST_MONTH)
+        cfg_file = os.path.join(self.config_month_dir, "config.json")
+        self.cfg = loadConfig(cfg_file, self.scaffold_home_dir, SECRET_FILE_NAME)
+        self.cfg._storepath = self.scaffold_home_dir
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_spans(self):
+        prj = self.cfg._projects['prj-private-sbom']
+        sp = prj._subprojects['sp1']
+        with timedSpan(self.cfg, "sbom", prj, sp) as span:
+            span.step("unzip")
+            sum(range(10000))
+            span.step("trivy")
+            span.setResult(True)
+        with timedSpan(self.cfg, "zipcode", prj, sp):
+            pass
+
+        spans = loadTimings(getTimingsFilename(self.scaffold_home_dir, TEST_MONTH))
+        self.assertEqual(["unzip", "trivy", "sbom", "zipcode"], [s["name"] for s in spans])
+        self.assertEqual(["sbom", "sbom", "", ""], [s["parent"] for s in spans])
+        self.assertEqual(True, spans[2]["result"])
+        for s in spans:
+            self.assertEqual("prj-private-sbom", s["project"])
+            self.assertEqual("sp1", s["subproject"])
+            for field in ["wall", "cpu", "maxrss-kb", "read-bytes", "write-bytes", "child-cpu"]:
+                self.assertIn(field, s)
+        self.assertGreaterEqual(spans[2]["wall"], spans[0]["wall"] + spans[1]["wall"])
+
+        totals = aggregateTimings(spans, ["parent"])
+        self.assertEqual(2, totals[("sbom",)]["count"])
+        self.assertEqual(2, totals[("",)]["count"])
+        with mock.patch("builtins.print"):
+            printProfile(self.cfg, "prj-private-sbom")
+
+    def test_exception_is_recorded(self):
+        with self.assertRaises(ValueError):
+            with timedSpan(self.cfg, "parsespdx"):
+                raise ValueError("bad")
+        spans = loadTimings(getTimingsFilename(self.scaffold_home_dir, TEST_MONTH))
+        self.assertEqual("exception: ValueError", spans[0]["result"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import unittest
+from unittest import mock
+import email.parser
+import os
+import tempfile
+
+import requests
+from fossology.obj import Upload
+
+import uploadcode
+from poller import Poller
+from uploadcode import MultipartFileStream, upload_file
+
+'''
+Tests uploading code to Fossology, with a fake Fossology server
+'''
+class TestUploadCode(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.zip_path = os.path.join(self.temp_dir.name, "sp1-2023-07-09.zip")
+        self.contents = os.urandom(3 * 1024 * 1024 + 17)
+        with open(self.zip_path, "wb") as f:
+            f.write(self.contents)
+        self.server = mock.Mock()
+        self.server.api = "https://fossology.example.org/api/v1"
+        self.folder = mock.Mock()
+        self.folder.id = 7
+        self.folder.parent = 1
+        self.folder.name = "prj1-2023-07"
+        self.server.list_folders.return_value = [self.folder]
+        self.server.list_uploads.return_value = ([], None)
+        self.bodies = []
+        # check on uploads without waiting around
+        self.poller_patch = mock.patch.object(uploadcode, "getPoller", return_value=Poller(0.01, 0.05))
+        self.poller_patch.start()
+
+    def tearDown(self):
+        self.poller_patch.stop()
+        self.temp_dir.cleanup()
+
+    def readBody(self, data):
+        # read it the way http.client does
+        body = b""
+        chunk = data.read(8192)
+        while chunk:
+            body += chunk
+            chunk = data.read(8192)
+        self.assertEqual(len(data), len(body))
+        return body
+
+    def parseFile(self, body, contentType):
+        msg = email.parser.BytesParser().parsebytes(b"Content-Type: " + contentType.encode("utf-8") + b"\r\n\r\n" + body)
+        parts = msg.get_payload()
+        self.assertEqual(1, len(parts))
+        self.assertEqual("fileInput", parts[0].get_param("name", header="content-disposition"))
+        self.assertEqual("sp1-2023-07-09.zip", parts[0].get_filename())
+        return parts[0].get_payload(decode=True)
+
+    def response(self, status_code, json={}):
+        response = mock.Mock()
+        response.status_code = status_code
+        response.json.return_value = json
+        return response
+
+    def uploadJson(self, size):
+        return {"folderid": 7, "foldername": "prj1-2023-07", "id": 42, "description": "", "uploadname": "sp1-2023-07-09.zip",
+            "uploaddate": "2023-07-09", "hash": {"sha1": "", "md5": "", "sha256": "", "size": size}}
+
+    def test_multipart_stream(self):
+        stream = MultipartFileStream(self.zip_path, "fileInput")
+        body = self.readBody(stream)
+        stream.close()
+        self.assertEqual(self.contents, self.parseFile(body, stream.getContentType()))
+
+    def test_upload_retries_failed_post(self):
+        attempts = []
+        def post(url, data, headers):
+            attempts.append(headers)
+            self.bodies.append(self.readBody(data))
+            if len(attempts) == 1:
+                raise requests.exceptions.ConnectionError("connection reset")
+            return self.response(201, {"message": 42})
+        self.server.session.post.side_effect = post
+        self.server.session.get.side_effect = [self.response(503), self.response(200, self.uploadJson(len(self.contents)))]
+        with mock.patch.object(uploadcode.time, "sleep"), mock.patch("builtins.print"):
+            self.assertTrue(upload_file(self.server, self.folder, self.zip_path))
+        self.assertEqual(2, len(attempts))
+        self.assertEqual("7", attempts[1]["folderId"])
+        # each attempt sends the whole file again
+        for body, headers in zip(self.bodies, attempts):
+            self.assertEqual(self.contents, self.parseFile(body, headers["Content-Type"]))
+
+    def test_upload_not_sent_twice(self):
+        # the post times out, but the server got the upload anyway
+        self.server.session.post.side_effect = requests.exceptions.ReadTimeout("read timed out")
+        self.server.list_uploads.side_effect = [([], None), ([Upload.from_json(self.uploadJson(len(self.contents)))], None)]
+        self.server.session.get.return_value = self.response(200, self.uploadJson(len(self.contents)))
+        with mock.patch.object(uploadcode.time, "sleep"), mock.patch("builtins.print"):
+            self.assertTrue(upload_file(self.server, self.folder, self.zip_path))
+        self.assertEqual(2, self.server.session.post.call_count)
+        self.assertEqual(f"{self.server.api}/uploads/42", self.server.session.get.call_args.args[0])
+
+    def test_upload_size_mismatch(self):
+        self.server.session.post.return_value = self.response(201, {"message": 42})
+        self.server.session.get.return_value = self.response(200, self.uploadJson(len(self.contents) - 1))
+        with mock.patch("builtins.print"):
+            with self.assertRaises(Exception) as cm:
+                upload_file(self.server, self.folder, self.zip_path)
+        self.assertIn("bytes on the server", str(cm.exception))
+
+    def test_upload_check_fails(self):
+        self.server.session.post.return_value = self.response(201, {"message": 42})
+        self.server.session.get.side_effect = [self.response(503), self.response(403)]
+        with mock.patch("builtins.print"):
+            with self.assertRaises(Exception) as cm:
+                upload_file(self.server, self.folder, self.zip_path)
+        self.assertIn("Authorization error", str(cm.exception))
+        self.assertEqual(2, self.server.session.get.call_count)
+
+    def test_upload_gives_up(self):
+        self.server.session.post.return_value = self.response(502)
+        with mock.patch.object(uploadcode.time, "sleep") as mock_sleep, mock.patch("builtins.print"):
+            with self.assertRaises(Exception):
+                upload_file(self.server, self.folder, self.zip_path)
+        self.assertEqual(uploadcode.UPLOAD_RETRIES + 1, self.server.session.post.call_count)
+        self.assertEqual([5, 10, 20, 40], [call.args[0] for call in mock_sleep.call_args_list])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+from unittest import mock
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+
+import util
+from timings import getTimingsFilename
+from util import DeferredDeleter
+
+'''
+Tests utility functions, such as deleting trees in the background
+'''
+class TestUtil(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.trash_path = os.path.join(self.temp_dir.name, "zipped", util.TRASH_DIR_NAME)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def makeTree(self, path, files=20, size=1000):
+        for i in range(files):
+            fpath = os.path.join(path, f"dir{i % 3}", f"file{i}")
+            os.makedirs(os.path.dirname(fpath), exist_ok=True)
+            with open(fpath, "wb") as f:
+                f.write(b"x" * size)
+
+    def test_deferred_delete(self):
+        tree = os.path.join(self.temp_dir.name, "zipped", "code", "tree")
+        self.makeTree(tree)
+        done = []
+        deleter = DeferredDeleter()
+        with mock.patch("builtins.print"):
+            deleter.delete(tree, self.trash_path, lambda path, seconds, freed: done.append((path, freed)))
+            # gone straight away, even if not deleted yet
+            self.assertFalse(os.path.exists(tree))
+            # deleting something that isn't there does nothing
+            deleter.delete(tree, self.trash_path)
+            results = deleter.wait()
+        self.assertEqual(1, len(results))
+        self.assertEqual(tree, results[0][0])
+        self.assertGreaterEqual(results[0][2], 20 * 1000)
+        self.assertEqual([(tree, results[0][2])], done)
+        self.assertEqual([], os.listdir(self.trash_path))
+
+    def test_leftover_trash(self):
+        # as if an earlier run was interrupted before deleting this
+        self.makeTree(os.path.join(self.trash_path, "abc-leftover"))
+        tree = os.path.join(self.temp_dir.name, "zipped", "tree")
+        self.makeTree(tree, files=2)
+        deleter = DeferredDeleter()
+        with mock.patch("builtins.print"):
+            deleter.delete(tree, self.trash_path)
+            results = deleter.wait()
+        self.assertEqual(2, len(results))
+        self.assertEqual([], os.listdir(self.trash_path))
+
+    def test_other_processes_trash(self):
+        host = socket.gethostname()
+        # a process that has exited, one that is still running, and one on
+        # another machine, which can't be checked
+        exited = subprocess.Popen([sys.executable, "-c", "pass"])
+        exited.wait()
+        for owner in [f"{host}-{exited.pid}", f"{host}-{os.getppid()}", f"elsewhere-{os.getpid()}"]:
+            self.makeTree(os.path.join(self.trash_path, owner, "abc-tree"), files=2)
+        tree = os.path.join(self.temp_dir.name, "zipped", "tree")
+        self.makeTree(tree, files=2)
+        deleter = DeferredDeleter()
+        with mock.patch("builtins.print"):
+            deleter.delete(tree, self.trash_path)
+            results = deleter.wait()
+        self.assertEqual(2, len(results))
+        self.assertEqual(sorted([f"{host}-{os.getppid()}", f"elsewhere-{os.getpid()}"]), sorted(os.listdir(self.trash_path)))
+
+    def test_deferred_rmtree_timings(self):
+        cfg = mock.Mock()
+        cfg._zippath = os.path.join(self.temp_dir.name, "zipped")
+        cfg._storepath = os.path.join(self.temp_dir.name, "scaffold")
+        cfg._month = "2023-07"
+        prj = mock.Mock()
+        prj._name = "prj1"
+        tree = os.path.join(cfg._zippath, "2023-07", "code", "prj1", "tree")
+        self.makeTree(tree, files=3, size=10)
+        with mock.patch("builtins.print"):
+            util.deferred_rmtree(cfg, tree, prj)
+            util.wait_for_deletions()
+        self.assertFalse(os.path.exists(tree))
+        with open(getTimingsFilename(cfg._storepath, cfg._month), "r") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(1, len(records))
+        self.assertEqual("delete", records[0]["name"])
+        self.assertEqual("cleanup", records[0]["parent"])
+        self.assertEqual("prj1", records[0]["project"])
+        self.assertEqual(tree, records[0]["path"])
+        self.assertGreaterEqual(records[0]["bytes-freed"], 30)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+# SPDX-FileCopyrightText: Copyright The Linux Foundation
+# SPDX-FileType: SOURCE
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from tabulate import tabulate
+
+import datefuncs
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows; spans there only record wall and CPU time
+    resource = None
+
+TIMINGS_FILE_NAME = "timings.jsonl"
+
+# serializes appending spans to timings.jsonl from `run --jobs` workers
+_timings_lock = threading.Lock()
+# each thread's stack of open spans, for recording a span's parent
+_local = threading.local()
+
+def getTimingsFilename(storepath, month):
+    return os.path.join(storepath, month, TIMINGS_FILE_NAME)
+
+# Returns the (read, written) bytes of storage I/O so far for this thread,
+# or for the whole process if per-thread counts aren't available. Returns
+# (0, 0) where neither is available (non-Linux).
+def _getIOBytes():
+    for ioFilename in ["/proc/thread-self/io", "/proc/self/io"]:
+        try:
+            readBytes = 0
+            writeBytes = 0
+            with open(ioFilename, 'r') as f:
+                for line in f:
+                    key, _, value = line.partition(":")
+                    if key == "read_bytes":
+                        readBytes = int(value)
+                    elif key == "write_bytes":
+                        writeBytes = int(value)
+            return readBytes, writeBytes
+        except (OSError, ValueError):
+            continue
+    return 0, 0
+
+# Returns the CPU seconds used so far by this thread, or the whole process
+# if per-thread counts aren't available.
+def _getCPUSeconds():
+    try:
+        return time.thread_time()
+    except (AttributeError, OSError):
+        return time.process_time()
+
+# Returns (user + system CPU seconds, peak RSS in KB) for child processes
+# (e.g. git, trivy, java) that have finished so far.
+def _getChildUsage():
+    if resource is None:
+        return 0.0, 0
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return ru.ru_utime + ru.ru_stime, ru.ru_maxrss
+
+def _getPeakRSS():
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# A timed section of a run: a stage for a subproject or project, or a step
+# within one. Records wall time, CPU time, peak RSS, bytes read and written,
+# and CPU time used by child processes, and appends them as one JSON line to
+# the month's timings.jsonl when it ends.
+#
+# Child process and peak RSS figures come from getrusage and cover the whole
+# scaffold process, so with `run --jobs` they include whatever other stages
+# were doing at the same time.
+class TimingSpan:
+
+    def __init__(self, cfg, name, prj=None, sp=None):
+        super(TimingSpan, self).__init__()
+
+        self._cfg = cfg
+        self._name = name
+        self._prj_name = "" if prj is None else prj._name
+        self._sp_name = "" if sp is None else sp._name
+        self._prj = prj
+        self._sp = sp
+        self._parent = ""
+        self._child = None
+        self._result = None
+
+    def start(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = []
+            _local.stack = stack
+        if stack:
+            self._parent = stack[-1]._name
+        stack.append(self)
+        self._started = datetime.now().isoformat(timespec="seconds")
+        self._wall_start = time.perf_counter()
+        self._cpu_start = _getCPUSeconds()
+        self._io_start = _getIOBytes()
+        self._child_start = _getChildUsage()
+        return self
+
+    # Ends the current step within this span (if any), and starts a new one
+    # with the given name. Lets a long function like runUnifiedAgent time
+    # each of its steps without nesting them all in `with` blocks.
+    def step(self, name):
+        self.endStep()
+        self._child = TimingSpan(self._cfg, name, self._prj, self._sp).start()
+
+    def endStep(self):
+        if self._child is not None:
+            self._child.end()
+            self._child = None
+
+    def setResult(self, result):
+        self._result = result
+
+    def end(self):
+        self.endStep()
+        stack = getattr(_local, "stack", [])
+        if stack and stack[-1] is self:
+            stack.pop()
+        ioEnd = _getIOBytes()
+        childEnd = _getChildUsage()
+        record = {
+            "name": self._name,
+            "parent": self._parent,
+            "project": self._prj_name,
+            "subproject": self._sp_name,
+            "started": self._started,
+            "wall": round(time.perf_counter() - self._wall_start, 4),
+            "cpu": round(_getCPUSeconds() - self._cpu_start, 4),
+            "maxrss-kb": _getPeakRSS(),
+            "read-bytes": ioEnd[0] - self._io_start[0],
+            "write-bytes": ioEnd[1] - self._io_start[1],
+            "child-cpu": round(childEnd[0] - self._child_start[0], 4),
+            "child-maxrss-kb": childEnd[1],
+        }
+        if self._result is not None:
+            record["result"] = self._result
+        writeSpan(self._cfg, record)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self._result = f"exception: {exc_type.__name__}"
+        self.end()
+
+# Returns a TimingSpan to use in a `with` statement, e.g.
+#     with timedSpan(cfg, "zipcode", prj, sp):
+def timedSpan(cfg, name, prj=None, sp=None):
+    return TimingSpan(cfg, name, prj, sp)
+
+def writeSpan(cfg, record):
+    if cfg is None or cfg._storepath == "" or cfg._month == "":
+        return
+    timingsFilename = getTimingsFilename(cfg._storepath, cfg._month)
+    line = json.dumps(record) + "\n"
+    try:
+        with _timings_lock:
+            os.makedirs(os.path.dirname(timingsFilename), exist_ok=True)
+            with open(timingsFilename, 'a') as f:
+                f.write(line)
+    except OSError as e:
+        # timings are nice to have, but must never stop a run
+        print(f"Unable to write timings to {timingsFilename}: {str(e)}")
+
+def loadTimings(timingsFilename):
+    spans = []
+    if not os.path.isfile(timingsFilename):
+        return spans
+    with open(timingsFilename, 'r') as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except json.decoder.JSONDecodeError:
+                continue
+    return spans
+
+# Returns a dict mapping each key (a tuple of the span fields named in
+# keyFields) to its totals across the spans.
+def aggregateTimings(spans, keyFields):
+    totals = {}
+    for span in spans:
+        key = tuple(span.get(field, "") for field in keyFields)
+        t = totals.get(key, None)
+        if t is None:
+            t = {"count": 0, "wall": 0.0, "wall-max": 0.0, "cpu": 0.0, "child-cpu": 0.0, "read-bytes": 0, "write-bytes": 0, "maxrss-kb": 0}
+            totals[key] = t
+        t["count"] += 1
+        t["wall"] += span.get("wall", 0.0)
+        t["wall-max"] = max(t["wall-max"], span.get("wall", 0.0))
+        t["cpu"] += span.get("cpu", 0.0)
+        t["child-cpu"] += span.get("child-cpu", 0.0)
+        t["read-bytes"] += span.get("read-bytes", 0)
+        t["write-bytes"] += span.get("write-bytes", 0)
+        t["maxrss-kb"] = max(t["maxrss-kb"], span.get("maxrss-kb", 0))
+    return totals
+
+def _mb(numBytes):
+    return round(numBytes / (1024 * 1024), 1)
+
+# Prints the month's timings aggregated by stage, and by project and
+# subproject, slowest first. Stage totals are compared against the prior
+# month's, if it has timings too.
+def printProfile(cfg, prj_only="", sp_only=""):
+    spans = loadTimings(getTimingsFilename(cfg._storepath, cfg._month))
+    spans = [s for s in spans if (prj_only == "" or s.get("project", "") == prj_only) and (sp_only == "" or s.get("subproject", "") == sp_only)]
+    if spans == []:
+        print(f"No timings found for {cfg._month}")
+        return
+
+    year, month = datefuncs.parseYM(cfg._month)
+    priorYear, priorMonth = datefuncs.priorMonth(year, month)
+    priorSpans = loadTimings(getTimingsFilename(cfg._storepath, datefuncs.getYMStr(priorYear, priorMonth)))
+    priorSpans = [s for s in priorSpans if (prj_only == "" or s.get("project", "") == prj_only) and (sp_only == "" or s.get("subproject", "") == sp_only)]
+    priorTotals = aggregateTimings(priorSpans, ["parent", "name"])
+
+    headers = ["Stage", "Count", "Wall (s)", "Max (s)", "CPU (s)", "Child CPU (s)", "Read (MB)", "Written (MB)", "Peak RSS (MB)", "Prior wall (s)"]
+    table = []
+    for (parent, name), t in aggregateTimings(spans, ["parent", "name"]).items():
+        stage = name if parent == "" else f"{parent}/{name}"
+        prior = priorTotals.get((parent, name), None)
+        table.append([stage, t["count"], round(t["wall"], 1), round(t["wall-max"], 1), round(t["cpu"], 1), round(t["child-cpu"], 1),
+            _mb(t["read-bytes"]), _mb(t["write-bytes"]), round(t["maxrss-kb"] / 1024, 1), "" if prior is None else round(prior["wall"], 1)])
+    table = sorted(table, key=lambda row: row[2], reverse=True)
+    print(tabulate(table, headers=headers))
+    print()
+
+    # only count top-level spans, so that steps aren't counted twice
+    topSpans = [s for s in spans if s.get("parent", "") == ""]
+    headers = ["Project", "Subproject", "Stages", "Wall (s)", "CPU (s)", "Child CPU (s)", "Read (MB)", "Written (MB)"]
+    table = []
+    for (prj_name, sp_name), t in aggregateTimings(topSpans, ["project", "subproject"]).items():
+        table.append([prj_name, sp_name, t["count"], round(t["wall"], 1), round(t["cpu"], 1), round(t["child-cpu"], 1), _mb(t["read-bytes"]), _mb(t["write-bytes"])])
+    table = sorted(table, key=lambda row: row[3], reverse=True)
+    print(tabulate(table, headers=headers))
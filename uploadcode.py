@@ -4,74 +4,233 @@
 
 import os
 import time
+import uuid
 from pathlib import Path
+
+import requests
 from fossology.obj import Upload
 
 from datatypes import Status, ProjectRepoType
+from fossologyindex import getFossologyIndex
+from poller import chain, completed, getPoller
 
 
-TIME_BETWEEN_RETRIES = 10  # seconds
+# how many checks of an upload that is still being unpacked between
+# messages saying we're still waiting
 RETRIES_BETWEEN_MESSAGES = 12
 
-def upload_file(fossologyServer, folder, file):
-    # some code copied from fossology-python https://github.com/fossology/fossology-python/blob/main/fossology/uploads.py#L128
-    # Licensed under MIT
-    headers = {"folderId": str(folder.id)}
-    headers["uploadType"] = "file"
-    with open(file, "rb") as fp:
-        files = {"fileInput": fp}
+# how much of the zip file to read at a time while uploading it
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# how many times to retry a request to the Fossology server that failed,
+# waiting UPLOAD_BACKOFF_SECONDS before the first retry and twice as long
+# before each one after that
+UPLOAD_RETRIES = 4
+UPLOAD_BACKOFF_SECONDS = 5
+# how often to report progress while uploading
+UPLOAD_PROGRESS_SECONDS = 30
+# HTTP status codes that mean the request might work if retried
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+# A multipart/form-data request body containing a single file, which is
+# read from disk a piece at a time as the request is sent, rather than
+# being built in memory first. Has a length, so that requests sends a
+# Content-Length header instead of a chunked body, and reports how fast
+# the upload is going as it goes.
+class MultipartFileStream:
+
+    def __init__(self, path, fieldName):
+        super(MultipartFileStream, self).__init__()
+
+        self._path = path
+        boundary = uuid.uuid4().hex
+        self._content_type = f"multipart/form-data; boundary={boundary}"
+        self._preamble = (
+            f"--{boundary}\r\n"
+            f"Content-Disposition: form-data; name=\"{fieldName}\"; filename=\"{os.path.basename(path)}\"\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n"
+        ).encode("utf-8")
+        self._epilogue = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        self._file_size = os.path.getsize(path)
+        self._length = len(self._preamble) + self._file_size + len(self._epilogue)
+        self._fp = open(path, "rb")
+        self._pos = 0
+        self._started = time.monotonic()
+        self._last_progress = self._started
+
+    def getContentType(self):
+        return self._content_type
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._length
+        size = min(size, UPLOAD_CHUNK_SIZE)
+        chunk = b""
+        fileEnd = len(self._preamble) + self._file_size
+        if self._pos < len(self._preamble):
+            chunk = self._preamble[self._pos:self._pos + size]
+        elif self._pos < fileEnd:
+            chunk = self._fp.read(min(size, fileEnd - self._pos))
+        elif self._pos < self._length:
+            start = self._pos - fileEnd
+            chunk = self._epilogue[start:start + size]
+        self._pos += len(chunk)
+        self._reportProgress()
+        return chunk
+
+    def _reportProgress(self):
+        now = time.monotonic()
+        if now - self._last_progress < UPLOAD_PROGRESS_SECONDS and self._pos < self._length:
+            return
+        self._last_progress = now
+        elapsed = max(now - self._started, 0.001)
+        print(f"Uploading {self._path}: {self._pos / (1024 * 1024):.1f} of {self._length / (1024 * 1024):.1f} MB ({self._pos / (1024 * 1024) / elapsed:.1f} MB/s)")
+
+    def close(self):
+        self._fp.close()
+
+# Sends a request to the Fossology server, retrying (with backoff) only
+# this request if it fails to connect or gets a status code that means it
+# might work next time. makeRequest is called for each attempt, and
+# should return the response. If alreadyDone is given, it is called before
+# each retry, and if it returns anything but None, that is returned instead
+# of sending the request again (e.g. because a request that seemed to fail
+# got through after all).
+def _requestWithRetry(description, makeRequest, alreadyDone=None):
+    wait = UPLOAD_BACKOFF_SECONDS
+    for attempt in range(UPLOAD_RETRIES + 1):
+        if attempt > 0 and alreadyDone is not None:
+            done = alreadyDone()
+            if done is not None:
+                return done
         try:
-            response = fossologyServer.session.post(
-                f"{fossologyServer.api}/uploads", files=files, headers=headers
-        )
-        except Exception as ex:
-            print("Unexpected exception posting file upload")
-            print(ex)
-            raise ex
-        # This will initiate the file upload
-    source = f"{file}"
-    if response.status_code == 201:
-        # Successfully initiated - now we need to check to see if it is done
-        upload_id =  response.json()["message"]
-        done = False
-        retries = 0
-        while not done:
-            try:
-                checkResponse = fossologyServer.session.get(f"{fossologyServer.api}/uploads/{upload_id}", headers={})
-            except Exception as ex:
-                print("Unexpected exception checking upload response")
-                print(ex)
-                raise ex
-            if checkResponse.status_code == 200:
-                # we're done
-                done = True
-                upload = Upload.from_json(checkResponse.json())
-                print(f"Upload completed for {file}")
-            elif checkResponse.status_code == 403:
-                description = f"Authorization error checking for status on upload for {file}"
-                raise Exception(description)
-            elif checkResponse.status_code == 503:
-                # Still waiting
-                retries = retries + 1
-                if retries % RETRIES_BETWEEN_MESSAGES == 0:
-                    msg = f"Waiting for upload of {file}"
-                    print(msg)
-                time.sleep(TIME_BETWEEN_RETRIES)
-            else:
-                description = f"Error checking for status on upload for {file}"
-                raise Exception(description)
-    elif response.status_code == 403:
+            response = makeRequest()
+            if response.status_code not in RETRY_STATUS_CODES:
+                return response
+            error = f"status code {response.status_code}"
+        except requests.exceptions.RequestException as ex:
+            error = str(ex)
+        if attempt == UPLOAD_RETRIES:
+            break
+        print(f"Error {description} ({error}); retrying in {wait} seconds")
+        time.sleep(wait)
+        wait = wait * 2
+    raise Exception(f"Error {description} after {UPLOAD_RETRIES + 1} attempts: {error}")
+
+# Posts the file to the Fossology server as a new upload in folder,
+# streaming it from disk, and returns the new upload's ID. A post that
+# times out or gets a server error might still have created the upload, so
+# before posting again, the folder's uploads are listed again to see
+# whether it is there, so that it isn't uploaded twice.
+def _postUpload(fossologyServer, folder, file):
+    def post():
+        stream = MultipartFileStream(file, "fileInput")
+        try:
+            headers = {
+                "folderId": str(folder.id),
+                "uploadType": "file",
+                "Content-Type": stream.getContentType(),
+            }
+            return fossologyServer.session.post(f"{fossologyServer.api}/uploads", data=stream, headers=headers)
+        finally:
+            stream.close()
+
+    def findUpload():
+        index = getFossologyIndex(fossologyServer)
+        index.invalidateUploads()
+        return index.getUpload(folder, os.path.basename(file))
+
+    result = _requestWithRetry(f"uploading {file}", post, findUpload)
+    if isinstance(result, Upload):
+        print(f"Upload of {file} got through after all; not sending it again")
+        return result.id
+    if result.status_code == 403:
         description = f"Authorization error uploading {file}"
         raise Exception(description)
-    else:
-        description = "Error uploading {file}"
+    elif result.status_code != 201:
+        description = f"Error uploading {file}"
         raise Exception(description)
-    return True
+    return result.json()["message"]
+
+# Returns the size in bytes that the Fossology server has for the upload,
+# or None if it didn't say.
+def getUploadSize(upload):
+    if upload.filesize:
+        return int(upload.filesize)
+    if upload.hash is not None and upload.hash.size:
+        return int(upload.hash.size)
+    return None
+
+# Checks that the Fossology server's copy of the upload is the same size
+# (and, if it reports one and expectedSha256 is given, has the same
+# SHA-256) as the file on disk, and raises an exception if not.
+def verifyUpload(upload, file, expectedSha256=""):
+    localSize = os.path.getsize(file)
+    serverSize = getUploadSize(upload)
+    if serverSize is not None and serverSize != localSize:
+        raise Exception(f"Upload of {file} has {serverSize} bytes on the server, expected {localSize}")
+    if expectedSha256 != "" and upload.hash is not None and upload.hash.sha256:
+        if upload.hash.sha256.lower() != expectedSha256.lower():
+            raise Exception(f"Upload of {file} has SHA-256 {upload.hash.sha256} on the server, expected {expectedSha256}")
+
+# Uploads the file to the folder on the Fossology server, and starts
+# watching (with the shared Poller) for the server to finish unpacking it.
+# Returns a Future that gets True once the server has the upload, and it
+# passes verifyUpload; or an exception if it fails.
+def startUpload(fossologyServer, folder, file, expectedSha256=""):
+    # some code copied from fossology-python https://github.com/fossology/fossology-python/blob/main/fossology/uploads.py#L128
+    # Licensed under MIT
+    # This will initiate the file upload
+    upload_id = _postUpload(fossologyServer, folder, file)
+
+    # Successfully initiated - now we need to check to see if it is done
+    counts = {"checks": 0, "errors": 0}
+
+    def check():
+        try:
+            checkResponse = fossologyServer.session.get(f"{fossologyServer.api}/uploads/{upload_id}", headers={})
+        except requests.exceptions.RequestException as ex:
+            # try again at the next check, unless it keeps happening
+            counts["errors"] += 1
+            if counts["errors"] > UPLOAD_RETRIES:
+                raise
+            print(f"Error checking upload response for {file} ({str(ex)}); will retry")
+            return False, None
+        counts["errors"] = 0
+        if checkResponse.status_code == 200:
+            # we're done
+            upload = Upload.from_json(checkResponse.json())
+            verifyUpload(upload, file, expectedSha256)
+            getFossologyIndex(fossologyServer).addUpload(upload)
+            print(f"Upload completed for {file}")
+            return True, True
+        elif checkResponse.status_code == 403:
+            description = f"Authorization error checking for status on upload for {file}"
+            raise Exception(description)
+        elif checkResponse.status_code in RETRY_STATUS_CODES:
+            # Still waiting
+            counts["checks"] += 1
+            if counts["checks"] % RETRIES_BETWEEN_MESSAGES == 0:
+                print(f"Waiting for upload of {file}")
+            return False, None
+        else:
+            description = f"Error checking for status on upload for {file}"
+            raise Exception(description)
+
+    return getPoller().watch(check)
+
+# Uploads the file to the folder on the Fossology server, and waits for the
+# server to finish unpacking it. Returns True once the server has the
+# upload, and it passes verifyUpload.
+def upload_file(fossologyServer, folder, file, expectedSha256=""):
+    return startUpload(fossologyServer, folder, file, expectedSha256).result()
 
 def doUploadCodeForProject(cfg, fossologyServer, prj):
     # create top-level folder for project, if it doesn't already exist
     try:
-        folder = fossologyServer.create_folder(fossologyServer.rootFolder, prj._name)
+        folder = getFossologyIndex(fossologyServer).createFolder(fossologyServer.rootFolder, prj._name)
     except Exception as e:
         print("Exception creating folder", e)
     if not folder:
@@ -83,7 +242,7 @@ def doUploadCodeForProject(cfg, fossologyServer, prj):
     
     dstFolder = f"{prj._name}-{cfg._month}"
     try:
-        folder = fossologyServer.create_folder(folder, dstFolder)
+        folder = getFossologyIndex(fossologyServer).createFolder(folder, dstFolder)
     except Exception as e:
         print("Exception creating folder", e)
     if not folder:
@@ -104,7 +263,7 @@ def doUploadCodeForProject(cfg, fossologyServer, prj):
         print(f"{prj._name}/{sp._name}: uploading {zipPath} to {dstFolder}")
         retval = None
         try:
-            retval = upload_file(fossologyServer, folder, zipPath)
+            retval = upload_file(fossologyServer, folder, zipPath, sp._code_sha256)
         except Exception as e:
             print("Exception uploading file", e)
         if not retval:
@@ -118,49 +277,65 @@ def doUploadCodeForProject(cfg, fossologyServer, prj):
     return True
 
 def doUploadCodeForSubproject(cfg, fossologyServer, prj, sp):
+    return startUploadCodeForSubproject(cfg, fossologyServer, prj, sp).result()
+
+# Like doUploadCodeForSubproject, but returns a Future (see poller.py) for
+# its result as soon as the upload has been sent, which is done once
+# Fossology has unpacked it. The Future is already done if there was
+# nothing to wait for.
+def startUploadCodeForSubproject(cfg, fossologyServer, prj, sp):
     # create top-level folder for project, if it doesn't already exist
     try:
-        folder = fossologyServer.create_folder(fossologyServer.rootFolder, prj._name)
+        folder = getFossologyIndex(fossologyServer).createFolder(fossologyServer.rootFolder, prj._name)
     except Exception as e:
         print("Exception creating folder", e)
     if not folder:
         print(f"{prj._name}/{sp._name}: Could not create folder {prj._name}")
-        return False
+        return completed(False)
 
     # create one project-level folder for this month, and
     # upload all code there
     
     dstFolder = f"{prj._name}-{cfg._month}"
     try:
-        folder = fossologyServer.create_folder(folder, dstFolder)
+        folder = getFossologyIndex(fossologyServer).createFolder(folder, dstFolder)
     except Exception as e:
         print("Exception creating folder", e)
     if not folder:
         print(f"{prj._name}/{sp._name}: Could not create folder {dstFolder}")
-        return False
+        return completed(False)
 
     # make sure the subproject has not already had its code uploaded
     if sp._status != Status.UPLOADEDWS:
         print(f"{prj._name}/{sp._name}: skipping, status is {sp._status.name}, expected UPLOADEDWS")
-        return True
+        return completed(True)
     zipPath = sp._code_path
     if zipPath == "":
         print(f"{prj._name}/{sp._name}: skipping, no path found for retrieved code")
         sp._status = Status.STOPPED
-        return True
+        return completed(True)
     print(f"{prj._name}/{sp._name}: uploading {zipPath} to {dstFolder}")
-    retval = None
     try:
-        retval = upload_file(fossologyServer, folder, zipPath)
+        pending = startUpload(fossologyServer, folder, zipPath, sp._code_sha256)
     except Exception as e:
         print("Exception uploading file", e)
-    if not retval:
         print(f"Error: Could not upload")
-        return False
+        return completed(False)
 
-    # once we get here, the project's code has been uploaded
-    sp._status = Status.UPLOADEDCODE
-    
-    # and when we return, the runner framework should update the project's
-    # status to reflect the min of its subprojects
-    return True
+    # the upload is unpacked while the poller waits for it, so the runner
+    # can get on with other subprojects in the meantime
+    def finish(done):
+        try:
+            done.result()
+        except Exception as e:
+            print("Exception uploading file", e)
+            print(f"Error: Could not upload")
+            return False
+
+        # once we get here, the project's code has been uploaded
+        sp._status = Status.UPLOADEDCODE
+
+        # and when we return, the runner framework should update the project's
+        # status to reflect the min of its subprojects
+        return True
+    return chain(pending, finish)
@@ -13,7 +13,34 @@ Utility class to support common function in Scaffold
 import shutil
 import time
 import os
+import queue
 import stat
+import socket
+import threading
+import uuid
+
+from locking import isProcessGone
+
+# name of the directory under the zippath that trees are moved into before
+# being deleted in the background. Each scaffold process has its own
+# subdirectory in it, named for its host and pid (see getTrashOwnerName),
+# since several processes can be running for the same month.
+TRASH_DIR_NAME = ".trash"
+
+def getTrashOwnerName():
+    """Returns the name of this process's subdirectory of the trash directory
+    """
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def isTrashOwnerGone(name):
+    """Returns True if the trash subdirectory name belongs to a scaffold
+    process that is no longer running, or isn't a process's subdirectory
+    at all (e.g. left behind by a version of scaffold without them)
+    """
+    host, _, pid = name.rpartition("-")
+    if host == "" or not pid.isdigit():
+        return True
+    return isProcessGone(host, int(pid))
 
 def _rmtree_error_handler(fun, path, excinfo):
    """Handles exceptions in the retry_rmtree - changes the permissions if needed
@@ -42,3 +69,132 @@ def retry_rmtree(path, max_retries=5):
     # if we got here, we exceeded the 
     # Try one more time and let the exception be thrown if unsuccessful
     shutil.rmtree(path)
+
+def getTreeSize(path):
+    """Returns the total size in bytes of the files under path, without following symlinks
+    """
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files + dirs:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+class DeferredDeleter:
+    """Deletes directory trees in a background thread. Each tree is first
+    renamed into this process's subdirectory of a trash directory, which is
+    atomic and immediate as long as the trash directory is on the same
+    filesystem, so the caller can go on right away as if the tree were
+    already gone. If the rename fails (e.g. across filesystems), the tree is
+    deleted synchronously instead.
+    """
+
+    def __init__(self):
+        super(DeferredDeleter, self).__init__()
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        # this process's subdirectories of the trash directories used so far
+        self._owned_paths = set()
+        # (path, seconds, bytes freed) for each finished deletion
+        self._results = []
+
+    def delete(self, path, trash_path, onDone=None):
+        """Moves path into this process's subdirectory of trash_path and
+        queues it for deletion. onDone, if given, is called from the
+        background thread with (path, seconds, bytes freed) once it has been
+        deleted.
+        """
+        if not os.path.lexists(path):
+            return
+        with self._lock:
+            owned_path = os.path.join(trash_path, getTrashOwnerName())
+            if owned_path not in self._owned_paths:
+                self._owned_paths.add(owned_path)
+                os.makedirs(owned_path, exist_ok=True)
+                # other processes' subdirectories are left alone while they
+                # are still running, since they may still be deleting them;
+                # the rest were left behind by runs that were interrupted
+                for leftover in os.listdir(trash_path):
+                    leftover_path = os.path.join(trash_path, leftover)
+                    if leftover_path != owned_path and isTrashOwnerGone(leftover):
+                        self._put(leftover_path, leftover_path, None)
+            dst_path = os.path.join(owned_path, f"{uuid.uuid4().hex}-{os.path.basename(path.rstrip(os.sep))}")
+            try:
+                os.rename(path, dst_path)
+            except OSError as e:
+                print(f"Unable to move {path} to {owned_path}, deleting it now: {str(e)}")
+                retry_rmtree(path)
+                return
+            self._put(dst_path, path, onDone)
+
+    def wait(self):
+        """Waits for all queued deletions to finish, and returns the
+        (path, seconds, bytes freed) for each deletion finished so far.
+        """
+        self._queue.join()
+        with self._lock:
+            # nothing is left in this process's trash subdirectories now
+            for owned_path in self._owned_paths:
+                try:
+                    os.rmdir(owned_path)
+                except OSError:
+                    pass
+            self._owned_paths = set()
+            return list(self._results)
+
+    def _put(self, dst_path, path, onDone):
+        self._queue.put((dst_path, path, onDone))
+        if self._thread is None:
+            # a daemon thread, so that an interrupted run doesn't hang; anything
+            # left in the trash is deleted by the next run
+            self._thread = threading.Thread(target=self._run, name="deferred-deleter", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            dst_path, path, onDone = self._queue.get()
+            try:
+                started = time.perf_counter()
+                freed = getTreeSize(dst_path)
+                retry_rmtree(dst_path)
+                seconds = time.perf_counter() - started
+                print(f"Deleted {path} in {seconds:.1f}s, freeing {freed / (1024 * 1024):.1f} MB")
+                with self._lock:
+                    self._results.append((path, seconds, freed))
+                if onDone is not None:
+                    onDone(path, seconds, freed)
+            except Exception as e:
+                print(f"Unable to delete {dst_path}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+_deferred_deleter = DeferredDeleter()
+
+def deferred_rmtree(cfg, path, prj=None, sp=None):
+    """Removes the tree at path in the background (see DeferredDeleter),
+    using a trash directory under the zippath, and records how long it took
+    and how much it freed in the month's timings
+    """
+    def recordDeletion(path, seconds, freed):
+        from timings import writeSpan
+        # under "cleanup" rather than at the top level, since it runs in the
+        # background alongside the stages, and isn't one of them
+        writeSpan(cfg, {
+            "name": "delete",
+            "parent": "cleanup",
+            "project": "" if prj is None else prj._name,
+            "subproject": "" if sp is None else sp._name,
+            "path": path,
+            "wall": round(seconds, 4),
+            "bytes-freed": freed,
+        })
+    _deferred_deleter.delete(path, os.path.join(cfg._zippath, TRASH_DIR_NAME), recordDeletion)
+
+def wait_for_deletions():
+    """Waits for any deferred deletions to finish; call before exiting
+    """
+    return _deferred_deleter.wait()
@@ -6,7 +6,10 @@ import os
 import zipfile
 import util
 
+import gitcache
+from parallelzip import ParallelZipWriter, DETERMINISTIC_DATE_TIME, LARGE_FILE_SIZE, describeStats, getFileSha256
 from datatypes import ProjectRepoType, Status
+from getcode import isStreamingArchives
 
 # Runner for GOTCODE in GITHUB and GITHUB_SHARED
 def doZipRepoCodeForSubproject(cfg, prj, sp):
@@ -18,16 +21,24 @@ def doZipRepoCodeForSubproject(cfg, prj, sp):
     elif sp._repotype == ProjectRepoType.GITHUB:
         ziporg_path = os.path.join(sp_path, sp._github_ziporg)
 
+    # if getcode left the code in the git cache rather than checking it out,
+    # stream it from there instead
+    streamed = isStreamingArchives(cfg)
+    if not streamed and sp._code_anyfiles and not os.path.isdir(ziporg_path):
+        print(f"{prj._name}/{sp._name}: no code found at {ziporg_path}; if streamArchives was turned off after getting the code, get it again")
+        return False
+
     # remove each repo's .git directory
-    for repo in sp._repos:
-        dotgit_path = os.path.join(ziporg_path, repo, ".git")
-        util.retry_rmtree(dotgit_path)
-        # also remove its repo-dirs-delete, if any
-        delete_dirs = sp._repo_dirs_delete.get(repo, [])
-        for delete_dir in delete_dirs:
-            delete_dir_path = os.path.join(ziporg_path, repo, delete_dir)
-            print(f"{prj._name}/{sp._name}: deleting {repo}:{delete_dir}")
-            util.retry_rmtree(delete_dir_path)
+    if not streamed:
+        for repo in sp._repos:
+            dotgit_path = os.path.join(ziporg_path, repo, ".git")
+            util.deferred_rmtree(cfg, dotgit_path, prj, sp)
+            # also remove its repo-dirs-delete, if any
+            delete_dirs = sp._repo_dirs_delete.get(repo, [])
+            for delete_dir in delete_dirs:
+                delete_dir_path = os.path.join(ziporg_path, repo, delete_dir)
+                print(f"{prj._name}/{sp._name}: deleting {repo}:{delete_dir}")
+                util.deferred_rmtree(cfg, delete_dir_path, prj, sp)
 
     # before zipping it all together, check and see whether it actually has any files
     if not sp._code_anyfiles:
@@ -41,21 +52,30 @@ def doZipRepoCodeForSubproject(cfg, prj, sp):
     print(f"{prj._name}/{sp._name}: zipping into {zf_path}")
     if os.path.exists(zf_path):
         os.remove(zf_path)
-    zf = zipfile.ZipFile(zf_path, 'w', compression=zipfile.ZIP_DEFLATED)
-    for root, _, files in os.walk(ziporg_path):
-        for f in files:
-            fpath = os.path.join(root, f)
-            rpath = os.path.relpath(fpath, ziporg_path)
-            if not os.path.islink(fpath):
-                zf.write(fpath, arcname=rpath)
-    zf.close()
-
-    # and finally, remove the original unzipped directory
-    util.retry_rmtree(ziporg_path)
+    if streamed:
+        if not zipReposFromGitCache(cfg, prj, sp, zf_path, {repo: repo for repo in sp._repos}):
+            return False
+    else:
+        # sorted, so that the same code always gives the same zip file
+        rpaths = []
+        for root, _, files in os.walk(ziporg_path):
+            for f in files:
+                fpath = os.path.join(root, f)
+                if not os.path.islink(fpath):
+                    rpaths.append(os.path.relpath(fpath, ziporg_path))
+        with ParallelZipWriter(zf_path, cfg._zip_jobs, cfg._zip_compression, deterministic=True) as zf:
+            for rpath in sorted(rpaths):
+                zf.write(os.path.join(ziporg_path, rpath), arcname=rpath)
+        print(f"{prj._name}/{sp._name}: zipped {describeStats(zf.getStats())}")
+        sp._code_manifest_sha256 = zf.getManifestSha256()
+
+        # and finally, remove the original unzipped directory
+        util.deferred_rmtree(cfg, ziporg_path, prj, sp)
 
     # success - advance state
     sp._status = Status.ZIPPEDCODE
     sp._code_path = zf_path
+    sp._code_sha256 = getFileSha256(zf_path)
     return True
 
 # Runner for GOTCODE in GERRIT
@@ -64,18 +84,26 @@ def doZipRepoCodeForGerritSubproject(cfg, prj, sp):
     sp_path = os.path.join(cfg._zippath, cfg._month, "code", prj._name, sp._name)
     ziporg_path = os.path.join(sp_path, sp._name)
 
+    # if getcode left the code in the git cache rather than checking it out,
+    # stream it from there instead
+    streamed = isStreamingArchives(cfg)
+    if not streamed and sp._code_anyfiles and not os.path.isdir(ziporg_path):
+        print(f"{prj._name}/{sp._name}: no code found at {ziporg_path}; if streamArchives was turned off after getting the code, get it again")
+        return False
+
     # remove each repo's .git directory
-    for repo in sp._repos:
-        dashName = repo.replace("/", "-")
-        dstFolder = os.path.join(ziporg_path, dashName)
-        dotgit_path = os.path.join(dstFolder, ".git")
-        util.retry_rmtree(dotgit_path)
-        # also remove its repo-dirs-delete, if any
-        delete_dirs = sp._repo_dirs_delete.get(repo, [])
-        for delete_dir in delete_dirs:
-            delete_dir_path = os.path.join(ziporg_path, dashName, delete_dir)
-            print(f"{prj._name}/{sp._name}: deleting {repo}:{delete_dir}")
-            util.retry_rmtree(delete_dir_path)
+    if not streamed:
+        for repo in sp._repos:
+            dashName = repo.replace("/", "-")
+            dstFolder = os.path.join(ziporg_path, dashName)
+            dotgit_path = os.path.join(dstFolder, ".git")
+            util.deferred_rmtree(cfg, dotgit_path, prj, sp)
+            # also remove its repo-dirs-delete, if any
+            delete_dirs = sp._repo_dirs_delete.get(repo, [])
+            for delete_dir in delete_dirs:
+                delete_dir_path = os.path.join(ziporg_path, dashName, delete_dir)
+                print(f"{prj._name}/{sp._name}: deleting {repo}:{delete_dir}")
+                util.deferred_rmtree(cfg, delete_dir_path, prj, sp)
 
     # before zipping it all together, check and see whether it actually has any files
     if not sp._code_anyfiles:
@@ -89,19 +117,77 @@ def doZipRepoCodeForGerritSubproject(cfg, prj, sp):
     print(f"{prj._name}/{sp._name}: zipping into {zf_path}")
     if os.path.exists(zf_path):
         os.remove(zf_path)
-    zf = zipfile.ZipFile(zf_path, 'w', compression=zipfile.ZIP_DEFLATED)
-    for root, _, files in os.walk(ziporg_path):
-        for f in files:
-            fpath = os.path.join(root, f)
-            rpath = os.path.relpath(fpath, ziporg_path)
-            if not os.path.islink(fpath):
-                zf.write(fpath, arcname=rpath)
-    zf.close()
-
-    # and finally, remove the original unzipped directory
-    util.retry_rmtree(ziporg_path)
+    if streamed:
+        if not zipReposFromGitCache(cfg, prj, sp, zf_path, {repo: repo.replace("/", "-") for repo in sp._repos}):
+            return False
+    else:
+        # sorted, so that the same code always gives the same zip file
+        rpaths = []
+        for root, _, files in os.walk(ziporg_path):
+            for f in files:
+                fpath = os.path.join(root, f)
+                if not os.path.islink(fpath):
+                    rpaths.append(os.path.relpath(fpath, ziporg_path))
+        with ParallelZipWriter(zf_path, cfg._zip_jobs, cfg._zip_compression, deterministic=True) as zf:
+            for rpath in sorted(rpaths):
+                zf.write(os.path.join(ziporg_path, rpath), arcname=rpath)
+        print(f"{prj._name}/{sp._name}: zipped {describeStats(zf.getStats())}")
+        sp._code_manifest_sha256 = zf.getManifestSha256()
+
+        # and finally, remove the original unzipped directory
+        util.deferred_rmtree(cfg, ziporg_path, prj, sp)
 
     # success - advance state
     sp._status = Status.ZIPPEDCODE
     sp._code_path = zf_path
+    sp._code_sha256 = getFileSha256(zf_path)
+    return True
+
+# Returns True if path (relative to the top of its repo) is in, or is, one
+# of the repo's repo-dirs-delete.
+def isInDeletedDir(path, delete_dirs):
+    for delete_dir in delete_dirs:
+        delete_dir = delete_dir.strip("/")
+        if path == delete_dir or path.startswith(delete_dir + "/"):
+            return True
+    return False
+
+# Zips the code for the subproject's repos by streaming `git archive`
+# output for each recorded commit out of the git cache, without checking
+# it out to disk first. repo_dirs maps each repo to the directory its files
+# go under in the zip file. repo-dirs-delete are skipped as the files go
+# by, and so are symlinks, as when zipping a checkout. Like zipping a
+# checkout, the zip file is deterministic. Returns False, without making
+# the zip file, if the git cache doesn't have a recorded commit (e.g. if
+# streamArchives was turned on after getting the code without it).
+def zipReposFromGitCache(cfg, prj, sp, zf_path, repo_dirs):
+    for repo in sorted(repo_dirs):
+        commit = sp._code_repos.get(repo, "")
+        if commit != "" and not gitcache.hasCommit(cfg, gitcache.getRepoURL(prj, sp, repo), commit):
+            print(f"{prj._name}/{sp._name}: git cache doesn't have commit {commit} for {repo}; get the code again to stream it")
+            return False
+
+    os.makedirs(os.path.dirname(zf_path), exist_ok=True)
+    with ParallelZipWriter(zf_path, cfg._zip_jobs, cfg._zip_compression, deterministic=True) as zf:
+        for repo, repo_dir in sorted(repo_dirs.items(), key=lambda item: item[1]):
+            commit = sp._code_repos.get(repo, "")
+            if commit == "":
+                # no commits, so no files
+                continue
+            delete_dirs = sp._repo_dirs_delete.get(repo, [])
+            for delete_dir in delete_dirs:
+                print(f"{prj._name}/{sp._name}: skipping {repo}:{delete_dir}")
+            with gitcache.openArchive(cfg, gitcache.getRepoURL(prj, sp, repo), commit) as tar:
+                for member in tar:
+                    if not member.isfile() or isInDeletedDir(member.name, delete_dirs):
+                        continue
+                    zinfo = zipfile.ZipInfo(f"{repo_dir}/{member.name}", date_time=DETERMINISTIC_DATE_TIME)
+                    zinfo.external_attr = (0o100000 | member.mode) << 16
+                    with tar.extractfile(member) as src:
+                        if member.size > LARGE_FILE_SIZE:
+                            zf.writestream(zinfo, src)
+                        else:
+                            zf.writestr(zinfo, src.read())
+    print(f"{prj._name}/{sp._name}: zipped {describeStats(zf.getStats())}")
+    sp._code_manifest_sha256 = zf.getManifestSha256()
     return True